@@ -53,6 +53,18 @@ try:
 except ImportError:
     import yaml
 
+def writeIfChanged(path, contents):
+    # Leave files that are already up to date untouched, so that
+    # regenerating the tests doesn't change every file's mtime
+    try:
+        with codecs.open(path, 'r', 'utf-8') as f:
+            if f.read() == contents:
+                return
+    except IOError:
+        pass
+    with codecs.open(path, 'w', 'utf-8') as f:
+        f.write(contents)
+
 def genTestUtils(TESTOUTPUTDIR, IMAGEOUTPUTDIR, TEMPLATEFILE, NAME2DIRFILE, ISOFFSCREENCANVAS):
 
     MISCOUTPUTDIR = './output'
@@ -391,11 +403,11 @@ def genTestUtils(TESTOUTPUTDIR, IMAGEOUTPUTDIR, TEMPLATEFILE, NAME2DIRFILE, ISOF
                 'fallback':fallback
             }
 
-            f = codecs.open('%s/%s%s.html' % (TESTOUTPUTDIR, mapped_name, name_variant), 'w', 'utf-8')
-            f.write(templates['w3c'] % template_params)
+            writeIfChanged('%s/%s%s.html' % (TESTOUTPUTDIR, mapped_name, name_variant),
+                           templates['w3c'] % template_params)
             if ISOFFSCREENCANVAS:
-                f = codecs.open('%s/%s%s.worker.js' % (TESTOUTPUTDIR, mapped_name, name_variant), 'w', 'utf-8')
-                f.write(templates['w3cworker'] % template_params)
+                writeIfChanged('%s/%s%s.worker.js' % (TESTOUTPUTDIR, mapped_name, name_variant),
+                               templates['w3cworker'] % template_params)
 
     print()
 
@@ -585,8 +597,7 @@ def genTestUtils(TESTOUTPUTDIR, IMAGEOUTPUTDIR, TEMPLATEFILE, NAME2DIRFILE, ISOF
         head = doc.documentElement.getElementsByTagName('head')[0]
         head.insertBefore(doc.createElement('meta'), head.firstChild).setAttribute('charset', 'UTF-8')
 
-        f = codecs.open('%s/annotated-spec.html' % SPECOUTPUTDIR, 'w', 'utf-8')
-        f.write(htmlSerializer(doc))
+        writeIfChanged('%s/annotated-spec.html' % SPECOUTPUTDIR, htmlSerializer(doc))
 
 
     if not ISOFFSCREENCANVAS:
@@ -32,6 +32,11 @@ def get_template(basename):
 
 
 def write_file(filename, contents):
+    # Leave files that are already up to date untouched
+    if os.path.exists(filename):
+        with open(filename, "r") as f:
+            if f.read() == contents:
+                return
     with open(filename, "w") as f:
         f.write(contents)
 
@@ -1,7 +1,8 @@
 import argparse
 import os
 import re
-from ..wpt.testfiles import branch_point, files_changed
+import sys
+from ..wpt.testfiles import affected_testfiles, branch_point, files_changed
 
 from tools import localpaths  # noqa: F401
 from six import iteritems
@@ -27,9 +28,15 @@ job_path_map = {
     "tools_unittest": ["tools/"],
     "wptrunner_unittest": ["tools/wptrunner/*"],
     "build_css": ["css/"],
-    "update_built": ["2dcontext/",
+    "update_built": ["update-built-tests.sh",
+                     "tools/wpt/update_built.py",
+                     "2dcontext/",
                      "html/",
-                     "offscreen-canvas/"],
+                     "infrastructure/assumptions/",
+                     "mimesniff/",
+                     "mixed-content/",
+                     "offscreen-canvas/",
+                     "referrer-policy/"],
     "wpt_integration": ["tools/"],
     "wptrunner_infrastructure": ["infrastructure/", "tools/"],
 }
@@ -69,15 +76,89 @@ class Ruleset(object):
         return "Rules<include:[%s] exclude:[%s]>" % subs
 
 
-def get_paths(**kwargs):
-    if kwargs["revish"] is None:
-        revish = "%s..HEAD" % branch_point()
+class JobMatcher(object):
+    """Matches paths against the rules of several jobs at once.
+
+    The rules are compiled into a single regular expression made of an
+    optional lookahead per rule, each capturing a named group, so one
+    match finds every rule that applies to a path. This has the same
+    result as trying the Ruleset of each job in turn.
+
+    :param job_rules: dict of job name to its list of rules, as in
+                      job_path_map
+    """
+    # Python 2 limits the number of named groups in an expression
+    max_groups = 90
+
+    def __init__(self, job_rules):
+        self.jobs = set(job_rules)
+        rules = []
+        for job, job_rule_list in sorted(iteritems(job_rules)):
+            for rule in job_rule_list:
+                exclude = rule.startswith("!")
+                rules.append((job, exclude, rule[1:] if exclude else rule))
+
+        self.regexps = []
+        for start in range(0, len(rules), self.max_groups):
+            groups = {}
+            parts = []
+            for i, (job, exclude, rule) in enumerate(rules[start:start + self.max_groups]):
+                name = "r%i" % i
+                groups[name] = (job, exclude)
+                parts.append("(?=(?P<%s>%s)?)" % (name, rule))
+            self.regexps.append((re.compile("".join(parts)), groups))
+
+    def __call__(self, path):
+        """Get the set of jobs whose rules match path"""
+        if os.path.sep != "/":
+            path = path.replace(os.path.sep, "/")
+        path = os.path.normcase(path)
+        included = set()
+        excluded = set()
+        for regexp, groups in self.regexps:
+            for name, value in iteritems(regexp.match(path).groupdict()):
+                if value is not None:
+                    job, exclude = groups[name]
+                    (excluded if exclude else included).add(job)
+        return included - excluded
+
+
+def read_paths(path):
+    """Read a list of paths, one per line, from the file at path or from
+    stdin if path is "-". Only the first tab-separated field of each line
+    is used, so the output of ``wpt tests-affected --show-type`` can be
+    read directly."""
+    if path == "-":
+        lines = sys.stdin.readlines()
     else:
-        revish = kwargs["revish"]
+        with open(path) as f:
+            lines = f.readlines()
+    return set(line.split("\t", 1)[0].strip() for line in lines if line.strip())
 
-    changed, _ = files_changed(revish)
-    all_changed = set(os.path.relpath(item, wpt_root)
-                      for item in set(changed))
+
+def get_paths(**kwargs):
+    if kwargs.get("paths_from"):
+        all_changed = read_paths(kwargs["paths_from"])
+        changed = [os.path.join(wpt_root, item) for item in all_changed]
+    else:
+        if kwargs["revish"] is None:
+            revish = "%s..HEAD" % branch_point()
+        else:
+            revish = kwargs["revish"]
+
+        changed, _ = files_changed(revish)
+        all_changed = set(os.path.relpath(item, wpt_root)
+                          for item in set(changed))
+
+    if kwargs.get("affected"):
+        # Also include the tests that depend on the changed files, found
+        # using the manifest's dependency index
+        tests_changed, dependents = affected_testfiles(
+            changed,
+            set(["conformance-checkers", "docs", "tools"]),
+            manifest_path=os.path.join(wpt_root, "MANIFEST.json"))
+        all_changed |= set(os.path.relpath(item, wpt_root)
+                           for item in tests_changed | dependents)
     return all_changed
 
 
@@ -90,16 +171,17 @@ def get_jobs(paths, **kwargs):
         includes = set(includes)
     for key, value in iteritems(job_path_map):
         if includes is None or key in includes:
-            rules[key] = Ruleset(value)
+            rules[key] = value
 
+    matcher = JobMatcher(rules)
+    remaining = set(rules)
     for path in paths:
-        for job in list(rules.keys()):
-            ruleset = rules[job]
-            if ruleset(path):
-                rules.pop(job)
-                jobs.add(job)
-        if not rules:
-            break
+        matched = matcher(path) & remaining
+        if matched:
+            jobs |= matched
+            remaining -= matched
+            if not remaining:
+                break
 
     # Default jobs shuld run even if there were no changes
     if not paths:
@@ -114,6 +196,11 @@ def create_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("revish", default=None, help="Commits to consider. Defaults to the commits on the current branch", nargs="?")
     parser.add_argument("--includes", default=None, help="Jobs to check for. Return code is 0 if all jobs are found, otherwise 1", nargs="*")
+    parser.add_argument("--paths-from", action="store", default=None,
+                        help="Read the changed paths, one per line, from this file, or - for stdin, "
+                        "rather than from git. Accepts the output of wpt tests-affected")
+    parser.add_argument("--affected", action="store_true",
+                        help="Also select jobs for the tests affected by the changed files")
     return parser
 
 
@@ -73,6 +73,12 @@ def test_update_built():
                          includes=["update_built"]) == set(["update_built"])
     assert jobs.get_jobs(["offscreen-canvas/foo.html"],
                          includes=["update_built"]) == set(["update_built"])
+    assert jobs.get_jobs(["mixed-content/spec.src.json"],
+                         includes=["update_built"]) == set(["update_built"])
+    assert jobs.get_jobs(["tools/wpt/update_built.py"],
+                         includes=["update_built"]) == set(["update_built"])
+    assert jobs.get_jobs(["css/foo.html"],
+                         includes=["update_built"]) == set()
 
 
 def test_wpt_integration():
@@ -86,3 +92,35 @@ def test_wpt_infrastructure():
                          includes=["wptrunner_infrastructure"]) == set(["wptrunner_infrastructure"])
     assert jobs.get_jobs(["infrastructure/assumptions/ahem.html"],
                          includes=["wptrunner_infrastructure"]) == set(["wptrunner_infrastructure"])
+
+
+def test_job_matcher():
+    matcher = jobs.JobMatcher(jobs.job_path_map)
+    rulesets = {job: jobs.Ruleset(rules) for job, rules in jobs.job_path_map.items()}
+    for path in ["resources/testharness.js",
+                 "tools/wptrunner/wptrunner/wptrunner.py",
+                 "docs/index.md",
+                 "dom/historical.html",
+                 "dom/OWNERS",
+                 "css/CSS21/test-001.html",
+                 "2dcontext/tools/build.sh",
+                 "html/syntax/parsing/test.html",
+                 "infrastructure/assumptions/ahem.html"]:
+        assert matcher(path) == set(job for job, ruleset in rulesets.items() if ruleset(path))
+
+
+def test_job_matcher_many_rules():
+    # More rules than fit in a single expression
+    rules = {"job%i" % i: ["dir%i/" % i, "!dir%i/excluded" % i] for i in range(100)}
+    matcher = jobs.JobMatcher(rules)
+    assert len(matcher.regexps) > 1
+    assert matcher("dir5/test.html") == set(["job5"])
+    assert matcher("dir99/test.html") == set(["job99"])
+    assert matcher("dir99/excluded.html") == set()
+
+
+def test_paths_from(tmpdir):
+    path = tmpdir.join("paths.txt")
+    path.write("resources/testharness.js\tsupport\ndom/historical.html\ttestharness\n\n")
+    paths = jobs.get_paths(paths_from=str(path), revish=None)
+    assert paths == set(["resources/testharness.js", "dom/historical.html"])
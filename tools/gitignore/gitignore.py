@@ -1,13 +1,12 @@
 import re
 import os
+from collections import namedtuple
 
 end_space = re.compile(r"([^\\]\s)*$")
 
 
 def fnmatch_translate(pat, path_name=False):
     parts = []
-    seq = False
-    i = 0
     if pat[0] == "/" or path_name:
         parts.append("^")
         any_char = "[^/]"
@@ -22,6 +21,20 @@ def fnmatch_translate(pat, path_name=False):
         suffix = "(?:/|$)"
     else:
         suffix = "$"
+    parts.extend(_translate_parts(pat, any_char, path_name))
+    parts.append(suffix)
+    try:
+        return re.compile("".join(parts))
+    except Exception:
+        raise
+
+
+def _translate_parts(pat, any_char, path_name):
+    """Translate the glob pat into a list of regular expression parts,
+    with any_char as the expression matching a single character"""
+    parts = []
+    seq = False
+    i = 0
     while i < len(pat):
         c = pat[i]
         if c == "\\":
@@ -68,11 +81,33 @@ def fnmatch_translate(pat, path_name=False):
 
     if seq:
         raise ValueError
-    parts.append(suffix)
-    try:
-        return re.compile("".join(parts))
-    except Exception:
-        raise
+    return parts
+
+
+def git_translate(pat):
+    """Translate a .gitignore pattern, without any leading ! or trailing /,
+    into a regular expression using the matching rules of git.
+
+    Returns a tuple of the compiled expression and whether it's anchored,
+    i.e. whether it must be matched against the path relative to the
+    directory containing the .gitignore file rather than the basename."""
+    anchored = "/" in pat
+    if pat[0] == "/":
+        pat = pat[1:]
+    parts = ["^"]
+    segments = pat.split("/")
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == "**" and anchored:
+            # A leading **/ or a /**/ matches any number of directories,
+            # and a trailing /** matches everything inside a directory
+            parts.append(".*" if last else "(?:.*/)?")
+            continue
+        parts.extend(_translate_parts(segment, "[^/]", True))
+        if not last:
+            parts.append("/")
+    parts.append("$")
+    return re.compile("".join(parts)), anchored
 
 
 def parse_line(line):
@@ -92,8 +127,87 @@ def parse_line(line):
     return invert, dir_only, fnmatch_translate(line, dir_only)
 
 
+class IgnoreRule(namedtuple("IgnoreRule", ["source", "line_number", "pattern",
+                                           "invert", "dir_only", "anchored", "regexp"])):
+    """A pattern from a .gitignore file.
+
+    :param source: Path of the .gitignore file relative to the root, or None
+                   for extra rules
+    :param line_number: Line of the pattern in the file, or None
+    :param pattern: The pattern as written, including any leading !
+    :param invert: Whether the pattern re-includes paths it matches
+    :param dir_only: Whether the pattern only matches directories
+    :param anchored: Whether the pattern matches paths relative to the
+                     .gitignore file's directory rather than basenames
+    :param regexp: Compiled regular expression for the pattern
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_line(cls, source, line_number, line):
+        line = line.rstrip()
+        if not line or line[0] == "#":
+            return None
+        pattern = line
+        invert = line[0] == "!"
+        if invert:
+            line = line[1:]
+        dir_only = line[-1] == "/"
+        if dir_only:
+            line = line[:-1]
+        if not line:
+            return None
+        try:
+            regexp, anchored = git_translate(line)
+        except ValueError:
+            # git ignores patterns it can't parse
+            return None
+        return cls(source, line_number, pattern, invert, dir_only, anchored, regexp)
+
+    def match(self, path, is_dir):
+        """Check if the rule matches path, relative to the directory of the
+        .gitignore file"""
+        if self.dir_only and not is_dir:
+            return False
+        if not self.anchored:
+            path = path.rsplit("/", 1)[-1]
+        return self.regexp.match(path) is not None
+
+
+class IgnoreFile(object):
+    """The IgnoreRules of a .gitignore file.
+
+    To avoid trying each rule in turn for the common case that a path
+    doesn't match any of them, the rules are also combined into one
+    regular expression for each kind of path they're matched against."""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.any_rule = {}
+        for is_dir in (False, True):
+            for anchored in (False, True):
+                patterns = [rule.regexp.pattern for rule in rules
+                            if rule.anchored == anchored and (is_dir or not rule.dir_only)]
+                self.any_rule[(is_dir, anchored)] = (
+                    re.compile("|".join("(?:%s)" % item for item in patterns)) if patterns else None)
+
+    def match(self, path, is_dir):
+        """Get the last rule matching path, relative to the directory of the
+        .gitignore file, or None"""
+        unanchored = self.any_rule[(is_dir, False)]
+        anchored = self.any_rule[(is_dir, True)]
+        if not ((unanchored is not None and unanchored.match(path.rsplit("/", 1)[-1])) or
+                (anchored is not None and anchored.match(path))):
+            return None
+        for rule in reversed(self.rules):
+            if rule.match(path, is_dir):
+                return rule
+        return None
+
+
 class PathFilter(object):
     def __init__(self, root, extras=None):
+        self.root = root
         if root:
             ignore_path = os.path.join(root, ".gitignore")
         else:
@@ -108,6 +222,14 @@ class PathFilter(object):
 
         if extras is None:
             extras = []
+        self.extras = extras
+        # IgnoreFiles used by match, by the directory of their .gitignore
+        # file, loaded when they're first needed
+        self.git_rules = {}
+        # Rule excluding each directory that match has seen, or None
+        self.excluded_dirs = {}
+        # Result of _ignore_files for each directory
+        self.dir_ignore_files = {}
 
         if ignore_path and os.path.exists(ignore_path):
             self._read_ignore(ignore_path)
@@ -151,3 +273,94 @@ class PathFilter(object):
             elif include and not invert and regexp.match(path):
                 include = False
         return include
+
+    def _ignore_file(self, dir_path):
+        """Get the IgnoreFile for the directory dir_path, relative to the
+        root, which for the root includes the extra rules"""
+        ignore_file = self.git_rules.get(dir_path)
+        if ignore_file is None:
+            rules = []
+            source = dir_path + "/.gitignore" if dir_path else ".gitignore"
+            ignore_path = (os.path.join(self.root, *source.split("/"))
+                           if self.root else None)
+            if ignore_path and os.path.exists(ignore_path):
+                with open(ignore_path) as f:
+                    for i, line in enumerate(f):
+                        rules.append(IgnoreRule.from_line(source, i + 1, line))
+            if not dir_path:
+                rules.extend(IgnoreRule.from_line(None, None, line) for line in self.extras)
+            ignore_file = IgnoreFile([rule for rule in rules if rule is not None])
+            self.git_rules[dir_path] = ignore_file
+        return ignore_file
+
+    def _ignore_files(self, dir_path):
+        """Get a list of (length of directory path prefix, IgnoreFile) for
+        the .gitignore files with rules applying to paths in dir_path, with
+        the deepest first"""
+        rv = self.dir_ignore_files.get(dir_path)
+        if rv is None:
+            rv = []
+            if dir_path:
+                ignore_file = self._ignore_file(dir_path)
+                if ignore_file.rules:
+                    rv.append((len(dir_path) + 1, ignore_file))
+                rv.extend(self._ignore_files(dir_path.rsplit("/", 1)[0] if "/" in dir_path else ""))
+            else:
+                ignore_file = self._ignore_file("")
+                if ignore_file.rules:
+                    rv.append((0, ignore_file))
+            self.dir_ignore_files[dir_path] = rv
+        return rv
+
+    def _match_path(self, parts, is_dir):
+        # Rules in deeper .gitignore files take precedence, and within a
+        # file the last matching rule wins
+        path = "/".join(parts)
+        for prefix_length, ignore_file in self._ignore_files("/".join(parts[:-1])):
+            rule = ignore_file.match(path[prefix_length:], is_dir)
+            if rule is not None:
+                return rule
+        return None
+
+    def _excluding_rule(self, parts):
+        """Get the rule that excludes the directory with path parts, either
+        directly or by excluding a directory containing it, or None"""
+        dir_path = "/".join(parts)
+        if dir_path in self.excluded_dirs:
+            return self.excluded_dirs[dir_path]
+        rule = None
+        if len(parts) > 1:
+            rule = self._excluding_rule(parts[:-1])
+        if rule is None:
+            rule = self._match_path(parts, True)
+            if rule is not None and rule.invert:
+                rule = None
+        self.excluded_dirs[dir_path] = rule
+        return rule
+
+    def match(self, path):
+        """Find the rule that decides whether a path is ignored, like
+        ``git check-ignore --verbose --no-index``.
+
+        Unlike calling the PathFilter, this reads the .gitignore files in
+        every directory on the path, and follows git in letting rules
+        without a trailing / match directories, and in ignoring everything
+        inside an ignored directory.
+
+        :param path: Path relative to the root, with a trailing / for
+                     directories
+        :returns: The matching IgnoreRule, which is a negation if the path is
+                  explicitly not ignored, or None if no rule matches
+        """
+        if self.trivial:
+            return None
+        if os.path.sep != "/":
+            path = path.replace(os.path.sep, "/")
+        is_dir = path[-1] == "/"
+        parts = path.rstrip("/").split("/")
+
+        if len(parts) > 1:
+            rule = self._excluding_rule(parts[:-1])
+            if rule is not None:
+                return rule
+        return self._match_path(parts, is_dir)
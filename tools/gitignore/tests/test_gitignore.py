@@ -80,3 +80,64 @@ def test_path_filter(path, expected):
     ]
     f = PathFilter(None, extras)
     assert f(path) == expected
+
+
+@pytest.fixture
+def ignore_root(tmpdir):
+    tmpdir.join(".gitignore").write("*.pyc\n"
+                                    "build/\n"
+                                    "/root-only\n"
+                                    "docs/**/*.html\n"
+                                    "!keep.pyc\n")
+    tmpdir.mkdir("a").join(".gitignore").write("# Comment\n"
+                                               "!*.pyc\n"
+                                               "data/*\n"
+                                               "!data/keep\n"
+                                               "**/generated\n")
+    return tmpdir
+
+
+match_rule_data = [
+    ("x.pyc", (".gitignore", 1, "*.pyc")),
+    ("b/x.pyc", (".gitignore", 1, "*.pyc")),
+    ("keep.pyc", (".gitignore", 5, "!keep.pyc")),
+    ("x.py", None),
+    ("build", None),
+    ("build/", (".gitignore", 2, "build/")),
+    ("build/x.py", (".gitignore", 2, "build/")),
+    ("b/build/c/x.py", (".gitignore", 2, "build/")),
+    ("root-only", (".gitignore", 3, "/root-only")),
+    ("b/root-only", None),
+    ("docs/x.html", (".gitignore", 4, "docs/**/*.html")),
+    ("docs/a/b/x.html", (".gitignore", 4, "docs/**/*.html")),
+    ("b/docs/x.html", None),
+    # Rules in nested .gitignore files take precedence
+    ("a/x.pyc", ("a/.gitignore", 2, "!*.pyc")),
+    ("a/b/x.pyc", ("a/.gitignore", 2, "!*.pyc")),
+    ("a/data/x", ("a/.gitignore", 3, "data/*")),
+    ("a/data/keep", ("a/.gitignore", 4, "!data/keep")),
+    ("a/b/data/x", None),
+    ("a/generated", ("a/.gitignore", 5, "**/generated")),
+    ("a/b/generated/x", ("a/.gitignore", 5, "**/generated")),
+    ("generated", None),
+    # Paths inside an ignored directory can't be re-included
+    ("a/build/x.pyc", (".gitignore", 2, "build/")),
+]
+
+
+@pytest.mark.parametrize("path, expected", match_rule_data)
+def test_path_filter_match(ignore_root, path, expected):
+    f = PathFilter(str(ignore_root))
+    rule = f.match(path)
+    assert ((rule.source, rule.line_number, rule.pattern) if rule else None) == expected
+    if rule is not None:
+        assert rule.invert == rule.pattern.startswith("!")
+
+
+def test_path_filter_match_extras(ignore_root):
+    f = PathFilter(str(ignore_root), extras=[".git/"])
+    rule = f.match(".git/config")
+    assert (rule.source, rule.line_number, rule.pattern, rule.invert) == (None, None, ".git/", False)
+    assert f.match("x.pyc").source == ".gitignore"
+    assert PathFilter(None, extras=["*.pyc"]).match("x.pyc").pattern == "*.pyc"
+    assert PathFilter(None).match("x.pyc") is None
@@ -3,23 +3,25 @@ from __future__ import print_function, unicode_literals
 import abc
 import argparse
 import ast
+import hashlib
 import json
+import multiprocessing
 import os
 import re
-import subprocess
 import sys
-import tempfile
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 from . import fnmatch
 from .. import localpaths
 from ..gitignore.gitignore import PathFilter
 from ..wpt import testfiles
+from ..wpt.utils import wpt_cache_dir
 
+import html5lib
+from manifest import sourcefile
 from manifest.sourcefile import SourceFile, js_meta_re, python_meta_re, space_chars, get_any_variants, get_default_any_variants
 from six import binary_type, iteritems, itervalues
-from six.moves import range
 from six.moves.urllib.parse import urlsplit, urljoin
 
 import logging
@@ -76,43 +78,6 @@ def all_filesystem_paths(repo_root, subdir=None):
                        path_filter(os.path.relpath(os.path.join(dirpath, item) + "/",
                                                    repo_root)+"/")]
 
-def _all_files_equal(paths):
-    """
-    Checks all the paths are files that are byte-for-byte identical
-
-    :param paths: the list of paths to compare
-    :returns: True if they are all identical
-    """
-    paths = list(paths)
-    if len(paths) < 2:
-        return True
-
-    first = paths.pop()
-    size = os.path.getsize(first)
-    if any(os.path.getsize(path) != size for path in paths):
-        return False
-
-    # Chunk this to avoid eating up memory and file descriptors
-    bufsize = 4096*4  # 16KB, a "reasonable" number of disk sectors
-    groupsize = 8  # Hypothesised to be large enough in the common case that everything fits in one group
-    with open(first, "rb") as first_f:
-        for start in range(0, len(paths), groupsize):
-            path_group = paths[start:start+groupsize]
-            first_f.seek(0)
-            try:
-                files = [open(x, "rb") for x in path_group]
-                for _ in range(0, size, bufsize):
-                    a = first_f.read(bufsize)
-                    for f in files:
-                        b = f.read(bufsize)
-                        if a != b:
-                            return False
-            finally:
-                for f in files:
-                    f.close()
-
-    return True
-
 
 def check_path_length(repo_root, path):
     if len(path) + 1 > 150:
@@ -140,25 +105,16 @@ def check_ahem_copy(repo_root, path):
     return []
 
 
-def check_git_ignore(repo_root, paths):
+def check_git_ignore(repo_root, paths, css_files=None):
     errors = []
-    with tempfile.TemporaryFile('w+') as f:
-        f.write('\n'.join(paths))
-        f.seek(0)
-        try:
-            matches = subprocess.check_output(
-                ["git", "check-ignore", "--verbose", "--no-index", "--stdin"], stdin=f)
-            for match in matches.strip().split('\n'):
-                match_filter, path = match.split()
-                _, _, filter_string = match_filter.split(':')
-                # If the matching filter reported by check-ignore is a special-case exception,
-                # that's fine. Otherwise, it requires a new special-case exception.
-                if filter_string[0] != '!':
-                    errors += [("IGNORED PATH", "%s matches an ignore filter in .gitignore - "
-                                "please add a .gitignore exception" % path, path, None)]
-        except subprocess.CalledProcessError:
-            # Nonzero return code means that no match exists.
-            pass
+    path_filter = PathFilter(repo_root)
+    for path in paths:
+        rule = path_filter.match(path)
+        # If the matching rule is a special-case exception, that's fine.
+        # Otherwise, it requires a new special-case exception.
+        if rule is not None and not rule.invert:
+            errors.append(("IGNORED PATH", "%s matches an ignore filter in .gitignore - "
+                           "please add a .gitignore exception" % path, path, None))
     return errors
 
 
@@ -167,7 +123,68 @@ w3c_tr_re = re.compile(r"https?\:\/\/www\.w3c?\.org\/TR\/([^/?#]+)")
 w3c_dev_re = re.compile(r"https?\:\/\/dev\.w3c?\.org\/[^/?#]+\/([^/?#]+)")
 
 
-def check_css_globally_unique(repo_root, paths):
+class CSSFileInfo(namedtuple("CSSFileInfo", ["kind", "name", "specs", "hash"])):
+    """
+    What check_css_globally_unique needs to know about a file in css/.
+
+    :param kind: "test", "reference" or "support"
+    :param name: the name that must be unique; the path from the support
+                 directory for support files, and the filename otherwise
+    :param specs: sorted list of the short names of the specs a test links
+                  to, or None if they haven't been found yet
+    :param hash: SHA-1 hash of the file contents, or None if it hasn't been
+                 computed yet
+    """
+    __slots__ = ()
+
+
+def css_file_info(path, source_file):
+    """
+    Find the CSSFileInfo of a file, or None if the file isn't in css/ or
+    isn't subject to the uniqueness checks.
+
+    :param path: the path of the file within the repository, using / as
+                 the separator
+    :param source_file: a SourceFile for the file
+    """
+    if not path.startswith("css/"):
+        return None
+
+    if source_file.name_is_non_test:
+        # If we're name_is_non_test for a reason apart from support, ignore it.
+        # We care about support because of the requirement all support files in css/ to be in
+        # a support directory; see the start of check_parsed.
+        offset = path.find("/support/")
+        if offset == -1:
+            return None
+
+        parts = source_file.dir_path.split(os.path.sep)
+        if (parts[0] in source_file.root_dir_non_test or
+            any(item in source_file.dir_non_test - {"support"} for item in parts) or
+            any(parts[:len(non_test_path)] == list(non_test_path) for non_test_path in source_file.dir_path_non_test)):
+            return None
+
+        return CSSFileInfo("support", path[offset+1:], None, None)
+    elif source_file.name_is_reference:
+        return CSSFileInfo("reference", source_file.name, None, None)
+    return CSSFileInfo("test", source_file.name, None, None)
+
+
+def css_spec_names(source_file):
+    """
+    Get the sorted short names of the specs a CSS test links to.
+    """
+    specs = set()
+    for link in source_file.spec_links:
+        for r in (drafts_csswg_re, w3c_tr_re, w3c_dev_re):
+            m = r.match(link)
+            if m:
+                specs.add(m.group(1))
+                break
+    return sorted(specs)
+
+
+def check_css_globally_unique(repo_root, paths, css_files=None):
     """
     Checks that CSS filenames are sufficiently unique
 
@@ -182,12 +199,19 @@ def check_css_globally_unique(repo_root, paths):
 
     :param repo_root: the repository root
     :param paths: list of all paths
+    :param css_files: dict of path to the CSSFileInfo already found for
+                      it when linting the file; other files are
+                      classified here
     :returns: a list of errors found in ``paths``
 
     """
+    if css_files is None:
+        css_files = {}
+
     test_files = defaultdict(set)
     ref_files = defaultdict(set)
     support_files = defaultdict(set)
+    infos = {}
 
     for path in paths:
         if os.name == "nt":
@@ -196,49 +220,41 @@ def check_css_globally_unique(repo_root, paths):
         if not path.startswith("css/"):
             continue
 
-        source_file = SourceFile(repo_root, path, "/")
-        if source_file.name_is_non_test:
-            # If we're name_is_non_test for a reason apart from support, ignore it.
-            # We care about support because of the requirement all support files in css/ to be in
-            # a support directory; see the start of check_parsed.
-            offset = path.find("/support/")
-            if offset == -1:
-                continue
-
-            parts = source_file.dir_path.split(os.path.sep)
-            if (parts[0] in source_file.root_dir_non_test or
-                any(item in source_file.dir_non_test - {"support"} for item in parts) or
-                any(parts[:len(non_test_path)] == list(non_test_path) for non_test_path in source_file.dir_path_non_test)):
-                continue
-
-            name = path[offset+1:]
-            support_files[name].add(path)
-        elif source_file.name_is_reference:
-            ref_files[source_file.name].add(path)
+        if path in css_files:
+            info = css_files[path]
         else:
-            test_files[source_file.name].add(path)
+            info = css_file_info(path, SourceFile(repo_root, path, "/"))
+        if info is None:
+            continue
+
+        infos[path] = info
+        {"test": test_files,
+         "reference": ref_files,
+         "support": support_files}[info.kind][info.name].add(path)
+
+    def content_hash(path):
+        if infos[path].hash is None:
+            infos[path] = infos[path]._replace(hash=SourceFile(repo_root, path, "/").hash)
+        return infos[path].hash
+
+    def all_files_equal(paths):
+        return len({content_hash(path) for path in paths}) == 1
 
     errors = []
 
     for name, colliding in iteritems(test_files):
         if len(colliding) > 1:
-            if not _all_files_equal([os.path.join(repo_root, x) for x in colliding]):
-                # Only compute by_spec if there are prima-facie collisions because of cost
+            if not all_files_equal(colliding):
                 by_spec = defaultdict(set)
                 for path in colliding:
-                    source_file = SourceFile(repo_root, path, "/")
-                    for link in source_file.spec_links:
-                        for r in (drafts_csswg_re, w3c_tr_re, w3c_dev_re):
-                            m = r.match(link)
-                            if m:
-                                spec = m.group(1)
-                                break
-                        else:
-                            continue
+                    specs = infos[path].specs
+                    if specs is None:
+                        specs = css_spec_names(SourceFile(repo_root, path, "/"))
+                    for spec in specs:
                         by_spec[spec].add(path)
 
                 for spec, paths in iteritems(by_spec):
-                    if not _all_files_equal([os.path.join(repo_root, x) for x in paths]):
+                    if not all_files_equal(paths):
                         for x in paths:
                             errors.append(("CSS-COLLIDING-TEST-NAME",
                                            "The filename %s in the %s testsuite is shared by: %s"
@@ -252,7 +268,7 @@ def check_css_globally_unique(repo_root, paths):
                           ("CSS-COLLIDING-SUPPORT-NAME", support_files)]:
         for name, colliding in iteritems(d):
             if len(colliding) > 1:
-                if not _all_files_equal([os.path.join(repo_root, x) for x in colliding]):
+                if not all_files_equal(colliding):
                     for x in colliding:
                         errors.append((error_name,
                                        "The filename %s is shared by: %s" % (name,
@@ -294,28 +310,104 @@ def parse_whitelist(f):
     return data, ignored_files
 
 
-def filter_whitelist_errors(data, errors):
+class GlobIndex(object):
     """
-    Filter out those errors that are whitelisted in `data`.
+    Index of fnmatch patterns, each with the set of line numbers it applies
+    to (None meaning any line), for matching many paths against them.
+
+    Patterns without wildcards go in a dict, patterns whose only wildcard
+    is a trailing ``*`` go in a trie of path components, and the remaining
+    globs are compiled into a single regular expression, so that a match
+    costs a few lookups rather than one fnmatch call per pattern.
+    Patterns and paths are expected to already be normcased.
     """
 
-    if not errors:
-        return []
+    sep = os.path.normcase("/")
+
+    def __init__(self, patterns):
+        self.exact = {}
+        # Trie nodes are (children, [(rest of prefix, lines)])
+        self.prefixes = ({}, [])
+        any_line_globs = []
+        self.line_globs = []
+
+        for pattern, lines in iteritems(patterns):
+            if "?" not in pattern and "[" not in pattern:
+                wildcards = pattern.count("*")
+                if wildcards == 0:
+                    self.exact.setdefault(pattern, set()).update(lines)
+                    continue
+                if wildcards == 1 and pattern[-1] == "*":
+                    node = self.prefixes
+                    parts = pattern[:-1].split(self.sep)
+                    for part in parts[:-1]:
+                        node = node[0].setdefault(part, ({}, []))
+                    node[1].append((parts[-1], lines))
+                    continue
+            if None in lines:
+                any_line_globs.append(pattern)
+            else:
+                self.line_globs.append((re.compile(fnmatch.translate(pattern)), lines))
+
+        self.glob = None
+        if any_line_globs:
+            self.glob = re.compile("|".join("(?:%s)" % fnmatch.translate(pattern)
+                                            for pattern in sorted(any_line_globs)))
+
+    def match(self, path, line=None):
+        """Return True if any pattern applying to line matches path"""
+        lines = self.exact.get(path)
+        if lines is not None and (None in lines or line in lines):
+            return True
+
+        node = self.prefixes
+        rest = path
+        while True:
+            children, entries = node
+            for prefix, lines in entries:
+                if rest.startswith(prefix) and (None in lines or line in lines):
+                    return True
+            part, sep, rest = rest.partition(self.sep)
+            if not sep or part not in children:
+                break
+            node = children[part]
 
-    whitelisted = [False for item in range(len(errors))]
+        if self.glob is not None and self.glob.match(path):
+            return True
+        return any(line in lines and regexp.match(path)
+                   for regexp, lines in self.line_globs)
 
-    for i, (error_type, msg, path, line) in enumerate(errors):
-        normpath = os.path.normcase(path)
+
+class Whitelist(object):
+    """
+    Whitelist data from `parse_whitelist` compiled into a GlobIndex per
+    error type.
+    """
+
+    def __init__(self, data):
         # Allow whitelisting all lint errors except the IGNORED PATH lint,
         # which explains how to fix it correctly and shouldn't be ignored.
-        if error_type in data and error_type != "IGNORED PATH":
-            wl_files = data[error_type]
-            for file_match, allowed_lines in iteritems(wl_files):
-                if None in allowed_lines or line in allowed_lines:
-                    if fnmatch.fnmatchcase(normpath, file_match):
-                        whitelisted[i] = True
+        self.indexes = {error_type: GlobIndex(wl_files)
+                        for error_type, wl_files in iteritems(data)
+                        if error_type != "IGNORED PATH"}
+
+    def is_whitelisted(self, error_type, path, line):
+        index = self.indexes.get(error_type)
+        return index is not None and index.match(os.path.normcase(path), line)
 
-    return [item for i, item in enumerate(errors) if not whitelisted[i]]
+
+def filter_whitelist_errors(data, errors):
+    """
+    Filter out those errors that are whitelisted in `data`, either the
+    data returned by `parse_whitelist` or a `Whitelist` compiled from it.
+    """
+
+    if not errors:
+        return []
+
+    whitelist = data if isinstance(data, Whitelist) else Whitelist(data)
+    return [item for item in errors
+            if not whitelist.is_whitelisted(item[0], item[2], item[3])]
 
 class Regexp(object):
     pattern = None
@@ -426,8 +518,9 @@ def check_regexp_line(repo_root, path, f):
 
     return errors
 
-def check_parsed(repo_root, path, f):
-    source_file = SourceFile(repo_root, path, "/", contents=f.read())
+def check_parsed(repo_root, path, f, source_file=None, checked_files=None):
+    if source_file is None:
+        source_file = SourceFile(repo_root, path, "/", contents=f.read())
 
     errors = []
 
@@ -480,7 +573,10 @@ def check_parsed(repo_root, path, f):
         reference_file = os.path.join(repo_root, ref_parts.path[1:])
         reference_rel = reftest_node.attrib.get("rel", "")
 
-        if not os.path.isfile(reference_file):
+        is_file = os.path.isfile(reference_file)
+        if checked_files is not None:
+            checked_files.append((reference_file, is_file))
+        if not is_file:
             errors.append(("NON-EXISTENT-REF",
                      "Reference test with a non-existent '%s' relationship reference: '%s'" % (reference_rel, href), path, None))
 
@@ -700,34 +796,229 @@ def check_path(repo_root, path):
     return errors
 
 
-def check_all_paths(repo_root, paths):
+def lint_file(repo_root, path):
+    """
+    Runs the lints that check a single path and the file's contents.
+
+    :param repo_root: the repository root
+    :param path: the path of the file within the repository
+    :returns: a tuple of the list of errors found, a list of
+              (path, is a file) for the other files whose existence
+              the errors depend on, and the CSSFileInfo of the file
+              or None
+    """
+    errors = list(check_path(repo_root, path))
+    checked_files = []
+    css_info = None
+    abs_path = os.path.join(repo_root, path)
+    if not os.path.isdir(abs_path):
+        with open(abs_path, 'rb') as f:
+            source_file = SourceFile(repo_root, path, "/", contents=f.read())
+            f.seek(0)
+            errors.extend(check_file_contents(repo_root, path, f, source_file, checked_files))
+        css_info = css_file_info(path, source_file)
+        if css_info is not None:
+            css_info = css_info._replace(hash=source_file.hash)
+            if css_info.kind == "test":
+                css_info = css_info._replace(specs=css_spec_names(source_file))
+    return errors, checked_files, css_info
+
+
+def _lint_file_worker(args):
+    return lint_file(*args)
+
+
+def lint_version():
+    """
+    Identifier for the version of the lints, which changes whenever the
+    code that finds errors in a file might have changed: any Python file
+    in the lint or manifest packages, or the version of html5lib.
+    """
+    rv = hashlib.sha1(sys.version.encode("utf8"))
+    rv.update(html5lib.__version__.encode("utf8"))
+    for module in [sys.modules[__name__], sourcefile]:
+        package_dir = os.path.dirname(os.path.abspath(module.__file__))
+        for dir_path, dir_names, file_names in os.walk(package_dir):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if not file_name.endswith(".py"):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                rv.update(os.path.relpath(path, package_dir).encode("utf8"))
+                with open(path, "rb") as f:
+                    rv.update(f.read())
+    return rv.hexdigest()
+
+
+def default_cache_path(repo_root):
+    repo_id = hashlib.sha1(os.path.abspath(repo_root).encode("utf8")).hexdigest()[:16]
+    return wpt_cache_dir("lint", "%s.json" % repo_id)
+
+
+class LintCache(object):
+    """
+    Cache of the errors found by lint_file for each path, stored in a
+    JSON file.
+
+    Entries are keyed by the SHA-1 hash of the file contents, with the
+    modification time and size of the file used to avoid reading files
+    that haven't changed, and are only used if none of the files whose
+    existence the errors depend on have been added or removed since. The
+    errors are stored before the whitelist is applied, so only a change
+    to the lints themselves invalidates the whole cache.
+
+    :param path: the path of the cache file
+    :param version: the lint version the cached errors were found with
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.files = {}
+        self.modified = False
+
+    @classmethod
+    def load(cls, path, version):
+        rv = cls(path, version)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return rv
+        if data.get("version") == version:
+            rv.files = data["files"]
+        return rv
+
+    def write(self):
+        if not self.modified:
+            return
+        dir_name = os.path.dirname(self.path)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        with open(self.path, "w") as f:
+            json.dump({"version": self.version, "files": self.files}, f, separators=(",", ":"))
+        self.modified = False
+
+    def _file_state(self, abs_path):
+        stat = os.stat(abs_path)
+        return stat.st_mtime, stat.st_size
+
+    def _content_hash(self, abs_path):
+        with open(abs_path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def get(self, repo_root, path):
+        """
+        Get the errors and CSSFileInfo cached for path, or None if the
+        cache has no entry for the current contents of the file.
+        """
+        entry = self.files.get(path)
+        if entry is None:
+            return None
+        mtime, size, content_hash, errors, checked_files, css_info = entry
+        abs_path = os.path.join(repo_root, path)
+        if [mtime, size] != list(self._file_state(abs_path)):
+            if self._content_hash(abs_path) != content_hash:
+                return None
+            entry[:2] = self._file_state(abs_path)
+            self.modified = True
+        if any(os.path.isfile(checked_path) != is_file for checked_path, is_file in checked_files):
+            return None
+        return ([tuple(error) for error in errors],
+                CSSFileInfo(*css_info) if css_info is not None else None)
+
+    def set(self, repo_root, path, errors, checked_files, css_info):
+        abs_path = os.path.join(repo_root, path)
+        mtime, size = self._file_state(abs_path)
+        self.files[path] = [mtime, size, self._content_hash(abs_path), errors, checked_files,
+                            css_info]
+        self.modified = True
+
+
+def lint_files(repo_root, paths, jobs=1, cache=None):
+    """
+    Runs lint_file for each path, in parallel if jobs is more than 1.
+
+    :param repo_root: the repository root
+    :param paths: a list of paths within the repository to lint
+    :param jobs: the number of processes to lint the files in
+    :param cache: a LintCache to get and store the errors in, or None
+    :returns: an iterator over (path, list of errors, CSSFileInfo or None)
+              for each path, in the same order as paths
+    """
+    cached = {}
+    if cache is not None:
+        for path in paths:
+            if not os.path.isdir(os.path.join(repo_root, path)):
+                entry = cache.get(repo_root, path)
+                if entry is not None:
+                    cached[path] = entry
+
+    uncached = [path for path in paths if path not in cached]
+    pool = None
+    if jobs > 1 and len(uncached) > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(_lint_file_worker,
+                            [(repo_root, path) for path in uncached],
+                            chunksize=max(1, min(64, len(uncached) // (jobs * 4))))
+    else:
+        results = (lint_file(repo_root, path) for path in uncached)
+
+    try:
+        results = iter(results)
+        for path in paths:
+            if path in cached:
+                errors, css_info = cached[path]
+            else:
+                errors, checked_files, css_info = next(results)
+                if cache is not None and not os.path.isdir(os.path.join(repo_root, path)):
+                    cache.set(repo_root, path, errors, checked_files, css_info)
+            yield path, errors, css_info
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if cache is not None:
+            cache.write()
+
+
+def check_all_paths(repo_root, paths, css_files=None):
     """
     Runs lints that check all paths globally.
 
     :param repo_root: the repository root
     :param paths: a list of all the paths within the repository
+    :param css_files: dict of path to the CSSFileInfo found when linting
+                      each file
     :returns: a list of errors found in ``f``
     """
 
     errors = []
     for paths_fn in all_paths_lints:
-        errors.extend(paths_fn(repo_root, paths))
+        errors.extend(paths_fn(repo_root, paths, css_files))
     return errors
 
 
-def check_file_contents(repo_root, path, f):
+def check_file_contents(repo_root, path, f, source_file=None, checked_files=None):
     """
     Runs lints that check the file contents.
 
     :param repo_root: the repository root
     :param path: the path of the file within the repository
     :param f: a file-like object with the file contents
+    :param source_file: a SourceFile for the file, for check_parsed to
+                        use rather than parsing the file again
+    :param checked_files: a list to which check_parsed appends (path, is
+                          a file) for each other file whose existence it
+                          checks
     :returns: a list of errors found in ``f``
     """
 
     errors = []
     for file_fn in file_lints:
-        errors.extend(file_fn(repo_root, path, f))
+        if file_fn is check_parsed:
+            errors.extend(check_parsed(repo_root, path, f, source_file, checked_files))
+        else:
+            errors.extend(file_fn(repo_root, path, f))
         f.seek(0)
     return errors
 
@@ -820,6 +1111,14 @@ def create_parser():
                         "option if the lint script exists outside the repository")
     parser.add_argument("--all", action="store_true", help="If no paths are passed, try to lint the whole "
                         "working directory, not just files that changed")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of processes to lint files in")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", default=True,
+                        help="Lint every file, rather than reusing the errors found in files "
+                        "that haven't changed since they were last linted")
+    parser.add_argument("--cache-path",
+                        help="Path to the file in which to cache the errors found in each file. "
+                        "Defaults to a file in ~/.cache/wpt/lint")
     return parser
 
 
@@ -839,15 +1138,22 @@ def main(**kwargs):
 
     paths = lint_paths(kwargs, repo_root)
 
-    return lint(repo_root, paths, output_format)
+    cache_path = None
+    if kwargs.get("cache", True):
+        cache_path = kwargs.get("cache_path") or default_cache_path(repo_root)
+
+    return lint(repo_root, paths, output_format, jobs=kwargs.get("jobs", 1),
+                cache_path=cache_path)
 
 
-def lint(repo_root, paths, output_format):
+def lint(repo_root, paths, output_format, jobs=1, cache_path=None):
     error_count = defaultdict(int)
     last = None
 
     with open(os.path.join(repo_root, "lint.whitelist")) as f:
         whitelist, ignored_files = parse_whitelist(f)
+    whitelist = Whitelist(whitelist)
+    ignored_files = GlobIndex({file_match: {None} for file_match in ignored_files})
 
     output_errors = {"json": output_errors_json,
                      "markdown": output_errors_markdown,
@@ -879,19 +1185,18 @@ def lint(repo_root, paths, output_format):
             paths.remove(path)
             continue
 
-        if any(fnmatch.fnmatch(path, file_match) for file_match in ignored_files):
+        if ignored_files.match(os.path.normcase(path)):
             paths.remove(path)
             continue
 
-        errors = check_path(repo_root, path)
+    cache = LintCache.load(cache_path, lint_version()) if cache_path is not None else None
+    css_files = {}
+    for path, errors, css_info in lint_files(repo_root, paths, jobs, cache):
         last = process_errors(errors) or last
+        if css_info is not None:
+            css_files[path] = css_info
 
-        if not os.path.isdir(abs_path):
-            with open(abs_path, 'rb') as f:
-                errors = check_file_contents(repo_root, path, f)
-                last = process_errors(errors) or last
-
-    errors = check_all_paths(repo_root, paths)
+    errors = check_all_paths(repo_root, paths, css_files)
     last = process_errors(errors) or last
 
     if output_format in ("normal", "markdown"):
@@ -902,16 +1207,9 @@ def lint(repo_root, paths, output_format):
     return sum(itervalues(error_count))
 
 path_lints = [check_path_length, check_worker_collision, check_ahem_copy]
-all_paths_lints = [check_css_globally_unique]
+all_paths_lints = [check_css_globally_unique, check_git_ignore]
 file_lints = [check_regexp_line, check_parsed, check_python_ast, check_script_metadata]
 
-# Don't break users of the lint that don't have git installed.
-try:
-    subprocess.check_output(["git", "--version"])
-    all_paths_lints += [check_git_ignore]
-except subprocess.CalledProcessError:
-    print('No git present; skipping .gitignore lint.')
-
 if __name__ == "__main__":
     args = create_parser().parse_args()
     error_count = main(**vars(args))
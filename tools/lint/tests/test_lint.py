@@ -1,14 +1,17 @@
 from __future__ import unicode_literals
 
 import os
+import shutil
 import sys
 
 import mock
+import pytest
 import six
 
 from ...localpaths import repo_root
-from .. import lint as lint_mod
-from ..lint import filter_whitelist_errors, parse_whitelist, lint, create_parser
+from .. import fnmatch, lint as lint_mod
+from ..lint import (GlobIndex, Whitelist, filter_whitelist_errors, parse_whitelist, lint,
+                    create_parser)
 
 _dummy_repo = os.path.join(os.path.dirname(__file__), "dummy")
 
@@ -53,6 +56,48 @@ def test_filter_whitelist_errors():
     assert filtered == [['INDENT TABS', '', unfilteredfile, 11]]
 
 
+@pytest.mark.parametrize("path", ["svg/test.html", "svg", "svg/", "svgs/test.html",
+                                  "svg/import/test.html", "html/svg/test.html", "a.png",
+                                  "a.png/b.html", "a.pngs", "css/test-001.html",
+                                  "css/test-01.html", "css/sub/test-001.html",
+                                  "resources/a.js", "resources", "res/a.js", ""])
+@pytest.mark.parametrize("line", [None, 1, 12])
+def test_glob_index(path, line):
+    patterns = {"svg/*": {None},
+                "svg/import/*": {12},
+                "svg/t*": {1},
+                "*": {12},
+                "*.png": {None},
+                "resources/a.js": {1},
+                "res*": {None},
+                "css/test-???.html": {None},
+                "css/*/test-[0-9]*": {12}}
+    patterns = {os.path.normcase(k): v for k, v in patterns.items()}
+    path = os.path.normcase(path)
+    expected = any(fnmatch.fnmatchcase(path, file_match) and (None in lines or line in lines)
+                   for file_match, lines in patterns.items())
+    assert GlobIndex(patterns).match(path, line) == expected
+
+
+def test_whitelist_index():
+    with open(os.path.join(repo_root, "lint.whitelist")) as f:
+        data, _ = parse_whitelist(f)
+    whitelist = Whitelist(data)
+    errors = [[error_type, "", path, line]
+              for error_type in ["CONSOLE", "SET TIMEOUT", "TRAILING WHITESPACE", "IGNORED PATH"]
+              for path in ["html/test.html", "resources/idlharness.js", "resources/chromium/a.js",
+                           "webaudio/resources/audit.js", "tools/lint/lint.py"]
+              for line in [None, 1, 39]]
+    expected = [item for item in errors
+                if not (item[0] != "IGNORED PATH" and
+                        any(fnmatch.fnmatchcase(os.path.normcase(item[2]), file_match) and
+                            (None in lines or item[3] in lines)
+                            for file_match, lines in data[item[0]].items()))]
+    assert 0 < len(expected) < len(errors)
+    assert filter_whitelist_errors(whitelist, errors) == expected
+    assert filter_whitelist_errors(data, errors) == expected
+
+
 def test_parse_whitelist():
     input_buffer = six.StringIO("""
 # Comment
@@ -427,7 +472,8 @@ def test_main_with_args():
                 m.assert_called_once_with(repo_root,
                                           [os.path.relpath(os.path.join(os.getcwd(), x), repo_root)
                                            for x in ['a', 'b', 'c']],
-                                          "normal")
+                                          "normal", jobs=1,
+                                          cache_path=lint_mod.default_cache_path(repo_root))
     finally:
         sys.argv = orig_argv
 
@@ -439,7 +485,8 @@ def test_main_no_args():
         with _mock_lint('lint', return_value=True) as m:
             with _mock_lint('changed_files', return_value=['foo', 'bar']):
                 lint_mod.main(**vars(create_parser().parse_args()))
-                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal")
+                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal", jobs=1,
+                                          cache_path=lint_mod.default_cache_path(repo_root))
     finally:
         sys.argv = orig_argv
 
@@ -451,6 +498,121 @@ def test_main_all():
         with _mock_lint('lint', return_value=True) as m:
             with _mock_lint('all_filesystem_paths', return_value=['foo', 'bar']):
                 lint_mod.main(**vars(create_parser().parse_args()))
-                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal")
+                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal", jobs=1,
+                                          cache_path=lint_mod.default_cache_path(repo_root))
     finally:
         sys.argv = orig_argv
+
+
+def test_lint_jobs(capsys):
+    paths = ["broken.html", "okay.html", "ref/non_existent_relative.html",
+             "ref/same_file_path.html", "ref/existent_relative.html"]
+    assert lint(_dummy_repo, list(paths), "json") == 3
+    expected = capsys.readouterr()[0]
+    assert lint(_dummy_repo, list(paths), "json", jobs=2) == 3
+    assert capsys.readouterr()[0] == expected
+
+
+def test_lint_cache(tmpdir, caplog):
+    repo = str(tmpdir.join("repo"))
+    shutil.copytree(_dummy_repo, repo)
+    cache_path = str(tmpdir.join("cache", "lint.json"))
+
+    assert lint(repo, ["broken.html", "okay.html"], "normal", cache_path=cache_path) == 1
+    with _mock_lint("check_file_contents") as mocked_check_file_contents:
+        assert lint(repo, ["broken.html", "okay.html"], "normal", cache_path=cache_path) == 1
+        assert not mocked_check_file_contents.called
+    assert caplog.text.count("broken.html:1") == 2
+
+    # Changing a file invalidates its entry
+    with open(os.path.join(repo, "broken.html"), "w") as f:
+        f.write("<p>fixed</p>\n")
+    with _mock_lint("check_file_contents") as mocked_check_file_contents:
+        assert lint(repo, ["broken.html", "okay.html"], "normal", cache_path=cache_path) == 0
+        assert mocked_check_file_contents.call_count == 1
+
+    # Changing the lints invalidates every entry
+    with _mock_lint("lint_version", return_value="changed"):
+        with _mock_lint("check_file_contents") as mocked_check_file_contents:
+            lint(repo, ["broken.html", "okay.html"], "normal", cache_path=cache_path)
+            assert mocked_check_file_contents.call_count == 2
+
+
+def test_lint_version(tmpdir):
+    manifest_dir = tmpdir.mkdir("manifest")
+    manifest_dir.join("sourcefile.py").write("")
+    manifest_dir.join("item.py").write("")
+    with mock.patch.object(lint_mod.sourcefile, "__file__", str(manifest_dir.join("sourcefile.py"))):
+        version = lint_mod.lint_version()
+        assert lint_mod.lint_version() == version
+
+        # Any module the lints might use invalidates the cache
+        manifest_dir.join("item.py").write("# changed")
+        changed = lint_mod.lint_version()
+        assert changed != version
+
+        manifest_dir.join("README").write("not code")
+        assert lint_mod.lint_version() == changed
+
+        with mock.patch.object(lint_mod.html5lib, "__version__", "0.0"):
+            assert lint_mod.lint_version() != changed
+
+
+def test_lint_file_checked_files():
+    errors, checked_files, css_info = lint_mod.lint_file(_dummy_repo, "ref/non_existent_relative.html")
+    assert [error[0] for error in errors] == ["NON-EXISTENT-REF"]
+    assert checked_files == [(os.path.join(_dummy_repo, "ref", "non_existent_file.html"), False)]
+    assert css_info is None
+
+    # Nothing is recorded between calls
+    assert lint_mod.lint_file(_dummy_repo, "ref/existent_relative.html")[1] == [
+        (os.path.join(_dummy_repo, "ref", "existent_relative-ref.html"), True)]
+
+
+def test_lint_cache_reference(tmpdir):
+    repo = str(tmpdir.join("repo"))
+    shutil.copytree(_dummy_repo, repo)
+    cache_path = str(tmpdir.join("lint.json"))
+    paths = ["ref/non_existent_relative.html"]
+
+    assert lint(repo, list(paths), "normal", cache_path=cache_path) == 1
+    assert lint(repo, list(paths), "normal", cache_path=cache_path) == 1
+    # Adding the missing reference invalidates the errors for the test
+    with open(os.path.join(repo, "ref", "non_existent_file.html"), "w") as f:
+        f.write("<p>ref</p>\n")
+    assert lint(repo, list(paths), "normal", cache_path=cache_path) == 0
+
+
+@pytest.mark.parametrize("paths", [["css/css-unique/not-match/a.html", "css/css-unique/a.html"],
+                                   ["css/css-unique/selectors/a.html", "css/css-unique/a.html"],
+                                   ["css/css-unique/not-match/support/a.html",
+                                    "css/css-unique/support/a.html"],
+                                   ["css/css-unique/not-match/a-ref.html",
+                                    "css/css-unique/a-ref.html"]])
+def test_check_css_globally_unique_file_info(tmpdir, paths):
+    # The files are only parsed once, when they're linted, and not at all
+    # when the lint results are cached
+    css_files = {path: lint_mod.lint_file(_dummy_repo, path)[2] for path in paths}
+    expected = lint_mod.check_css_globally_unique(_dummy_repo, paths)
+    with _mock_lint("SourceFile") as mocked_source_file:
+        assert lint_mod.check_css_globally_unique(_dummy_repo, paths, css_files) == expected
+
+        cache_path = str(tmpdir.join("lint.json"))
+        lint(_dummy_repo, list(paths), "normal", cache_path=cache_path)
+        assert mocked_source_file.call_count == len(paths)
+        lint(_dummy_repo, list(paths), "normal", cache_path=cache_path)
+        assert mocked_source_file.call_count == len(paths)
+
+
+@pytest.mark.parametrize("gitignore,expected", [("okay.*\n", 1),
+                                                ("*.html\n!okay.html\n", 0),
+                                                ("other.html\n", 0)])
+def test_lint_git_ignore(tmpdir, caplog, gitignore, expected):
+    repo = str(tmpdir.join("repo"))
+    shutil.copytree(_dummy_repo, repo)
+    with open(os.path.join(repo, ".gitignore"), "w") as f:
+        f.write(gitignore)
+    with mock.patch("subprocess.Popen") as mocked_popen:
+        assert lint(repo, ["okay.html"], "normal") == expected
+        assert not mocked_popen.called
+    assert ("IGNORED PATH" in caplog.text) == bool(expected)
@@ -0,0 +1,168 @@
+"""Index of the files that each test file might refer to.
+
+The index is stored next to the manifest, as MANIFEST.deps.json, and is
+updated along with it by ``wpt manifest``, so that the tests affected by
+a change to a support file can be found without reading every test
+file."""
+
+import json
+import os
+import re
+
+from .log import get_logger
+
+logger = get_logger()
+
+# Types of the test files that are indexed
+test_types = ["testharness", "reftest", "wdspec"]
+
+
+# Pieces of the paths in a test file that are indexed are separated by any
+# of these characters
+path_piece_re = re.compile(u"""[^\\s"'`<>()\\[\\]{},;=\\\\|*/?#&]+""")
+
+
+def read_test_file(path):
+    """Read the test file at path, decoding it according to its BOM"""
+    with open(path, "rb") as fh:
+        file_contents = fh.read()
+    if file_contents.startswith("\xfe\xff"):
+        return file_contents.decode("utf-16be", "replace")
+    elif file_contents.startswith("\xff\xfe"):
+        return file_contents.decode("utf-16le", "replace")
+    return file_contents.decode("utf8", "replace")
+
+
+def file_extension(name):
+    if "." not in name:
+        return None
+    return name.rsplit(".", 1)[1]
+
+
+def dependency_index_key(path):
+    """Name under which tests that might refer to the file at path are
+    indexed, or None if such tests aren't indexed"""
+    pieces = path_piece_re.findall(path.replace(os.path.sep, "/"))
+    if not pieces or file_extension(pieces[-1]) is None:
+        return None
+    return pieces[-1]
+
+
+class DependencyIndex(object):
+    """Index of the names of the files each test file might refer to, so
+    the tests that might be affected by changes to support files can be
+    found without reading every test file.
+
+    Each test file is indexed by the names in it that end with the
+    extension of a support file, such as ``a.js`` in
+    ``<script src="resources/a.js">``, which includes every name used in
+    src and href attributes, imports, ``META: script`` comments and url()
+    values. Entries are stored with the hash of the test file from the
+    manifest, so updating the index only reads the test files that
+    changed since it was written.
+
+    :param extensions: Support file extensions that the index covers
+    :param tests: Dictionary of {test path: [file hash, space separated names]}
+    """
+    version = 1
+
+    def __init__(self, extensions=None, tests=None):
+        self.extensions = frozenset(extensions or ())
+        self.tests = tests if tests is not None else {}
+        self.modified = False
+        self._by_name = None
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return cls()
+        if data.get("version") != cls.version:
+            return cls()
+        return cls(data["extensions"], data["tests"])
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump({"version": self.version,
+                       "extensions": sorted(self.extensions),
+                       "tests": self.tests}, f, separators=(",", ":"))
+        self.modified = False
+
+    def names(self, contents):
+        # Names can't contain whitespace, and a single string per test is
+        # much faster to load than a list
+        return u" ".join(sorted(set(item for item in path_piece_re.findall(contents)
+                                    if file_extension(item) in self.extensions)))
+
+    def update(self, tests_root, wpt_manifest, test_paths, support_paths):
+        """Update the index for the test files at test_paths, reading any
+        test files that changed since the index was last updated
+
+        :param tests_root: Path to the root of the tests
+        :param wpt_manifest: Manifest containing the test and support files
+        :param test_paths: Paths of the test files, relative to tests_root
+        :param support_paths: Paths of the support files, relative to tests_root
+        """
+        extensions = set(file_extension(os.path.basename(path)) for path in support_paths)
+        extensions.discard(None)
+        if extensions != self.extensions:
+            # The names that need to be indexed changed
+            self.extensions = frozenset(extensions)
+            self.tests = {}
+            self.modified = True
+
+        tests = {}
+        for path in test_paths:
+            file_hash = wpt_manifest.get_hash(path)
+            entry = self.tests.get(path)
+            if entry is None or entry[0] != file_hash:
+                try:
+                    contents = read_test_file(os.path.join(tests_root, path))
+                except IOError:
+                    continue
+                entry = [file_hash, self.names(contents)]
+                self.modified = True
+            tests[path] = entry
+
+        if len(tests) != len(self.tests):
+            self.modified = True
+        self.tests = tests
+        self._by_name = None
+
+    def get(self, name):
+        """Get the paths of the test files that contain name"""
+        if self._by_name is None:
+            self._by_name = {}
+            for path, (_, names) in self.tests.iteritems():
+                for item in names.split():
+                    self._by_name.setdefault(item, []).append(path)
+        return self._by_name.get(name, [])
+
+
+def dependency_index_path(manifest_path):
+    return os.path.splitext(manifest_path)[0] + ".deps.json"
+
+
+def update_dependency_index(tests_root, wpt_manifest, manifest_path):
+    """Update the DependencyIndex for wpt_manifest, which is stored next to
+    manifest_path, writing it if it changed.
+
+    Only the test files that changed since the index was last updated are
+    read, though building the index for the first time reads every test
+    file.
+
+    :returns: The updated DependencyIndex
+    """
+    index_path = dependency_index_path(manifest_path)
+    index = DependencyIndex.load(index_path)
+    test_paths = set(path for _, path, _ in wpt_manifest.itertypes(*test_types))
+    support_paths = set(path for _, path, _ in wpt_manifest.itertypes("support"))
+    index.update(tests_root, wpt_manifest, test_paths, support_paths)
+    if index.modified:
+        try:
+            index.write(index_path)
+        except IOError as e:
+            logger.warning("Failed to write dependency index: %s" % e)
+    return index
@@ -59,6 +59,12 @@ class Manifest(object):
                     for test in tests:
                         yield test
 
+    def get_hash(self, path):
+        """Get the hash of the file at path when the manifest was last
+        updated, or None if the file isn't in the manifest"""
+        entry = self._path_hash.get(path)
+        return entry[0] if entry is not None else None
+
     @property
     def reftest_nodes_by_url(self):
         if self._reftest_nodes_by_url is None:
@@ -4,6 +4,7 @@ import os
 
 import manifest
 from . import vcs
+from .dependencies import update_dependency_index
 from .log import get_logger
 from .download import download_from_github
 
@@ -50,6 +51,9 @@ def update_from_cli(**kwargs):
     if changed:
         manifest.write(m, path)
 
+    if kwargs.get("dependency_index", True):
+        update_dependency_index(tests_root, m, path)
+
 
 def abs_path(path):
     return os.path.abspath(os.path.expanduser(path))
@@ -73,6 +77,9 @@ def create_parser():
     parser.add_argument(
         "--no-download", dest="download", action="store_false", default=True,
         help="Never attempt to download the manifest.")
+    parser.add_argument(
+        "--no-dependency-index", dest="dependency_index", action="store_false", default=True,
+        help="Don't update the index of the files each test refers to, used by wpt tests-affected.")
     return parser
 
 
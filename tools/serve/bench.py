@@ -0,0 +1,616 @@
+"""Load-generation benchmark for wptserve.
+
+Starts a set of WebTestHttpd servers in a child process, serving a
+generated document root, and drives them from a pool of local client
+threads, each holding its own persistent connection per scheme. The
+request mix covers the main server paths: static files, range
+requests, .sub. templates, .py handlers, pipes, HTTPS and HTTP/2.
+
+For each scenario the requests per second and p50/p99 latency are
+reported, together with the peak resident set size of the server
+process."""
+
+from __future__ import print_function, division
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from multiprocessing import Event, Pipe, Process
+
+from six import iteritems
+from six.moves import http_client
+
+from localpaths import repo_root
+
+default_key_path = os.path.join(repo_root, "tools", "certs", "web-platform.test.key")
+default_cert_path = os.path.join(repo_root, "tools", "certs", "web-platform.test.pem")
+
+
+# Name, scheme, path, extra request headers, relative weight
+scenarios = [
+    ("static", "http", "/static.html", [], 30),
+    ("static-large", "http", "/large.bin", [], 5),
+    ("range", "http", "/large.bin", [("Range", "bytes=1024-65535")], 10),
+    ("sub", "http", "/template.sub.html", [], 15),
+    ("python", "http", "/handler.py?value=1", [], 15),
+    ("pipe-headers", "http", "/static.html?pipe=header(X-Bench,1)|status(200)", [], 5),
+    ("trickle", "http", "/static.html?pipe=trickle(1024:d0.001:r2)", [], 2),
+    ("https-static", "https", "/static.html", [], 10),
+    ("https-sub", "https", "/template.sub.html", [], 5),
+    ("h2-static", "http2", "/static.html", [], 5),
+    ("h2-python", "http2", "/handler.py?value=2", [], 3),
+    ("h2-multiplex-static", "http2", "/static.html", [], 3),
+    ("h2-multiplex-delay", "http2", "/delay.py?ms=20", [], 2),
+]
+
+# Scenarios for which each HTTP/2 client sends several concurrent
+# streams on its connection rather than a single request
+multiplexed_scenarios = set(["h2-multiplex-static", "h2-multiplex-delay"])
+
+doc_root_files = {
+    "static.html": (b"<!doctype html>\n<title>static</title>\n" +
+                    b"<p>" + b"x" * 4096 + b"</p>\n"),
+    "large.bin": bytes(bytearray(i % 256 for i in range(1024 * 1024))),
+    "template.sub.html": (b"<!doctype html>\n<title>{{host}}</title>\n" +
+                          b"<script src='http://{{host}}:{{ports[http][0]}}/x.js'></script>\n" +
+                          b"<p>{{GET[value]}} {{uuid()}}</p>\n" * 20),
+    "handler.py": (b"def main(request, response):\n"
+                   b"    value = request.GET.first(\"value\", \"0\")\n"
+                   b"    return [(\"Content-Type\", \"text/plain\")], \"value=%s\" % value\n"),
+    "delay.py": (b"import time\n"
+                 b"def main(request, response):\n"
+                 b"    time.sleep(float(request.GET.first(\"ms\", \"0\")) / 1000)\n"
+                 b"    return \"delayed\"\n"),
+}
+
+
+def create_doc_root(path):
+    """Write the files used by the benchmark scenarios into path."""
+    for name, data in iteritems(doc_root_files):
+        with open(os.path.join(path, name), "wb") as f:
+            f.write(data)
+
+
+def get_rss(pid):
+    """Get the resident set size of process pid in bytes, or None if it
+    can't be determined on this platform."""
+    try:
+        with open("/proc/%i/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = int(round(pct / 100. * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def serve(doc_root, schemes, key_path, cert_path, conn, stop):
+    """Entry point for the server process.
+
+    Starts one server for each scheme in schemes, sends a dict of
+    {scheme: port} back over conn, and runs until stop is set. Finally
+    sends a dict of {scheme: TLS handshake statistics} for the TLS
+    servers."""
+    from wptserve import server as wptserve
+
+    servers = []
+    try:
+        ports = {}
+        for scheme in schemes:
+            kwargs = {}
+            if scheme in ("https", "http2"):
+                kwargs = {"use_ssl": True,
+                          "key_file": key_path,
+                          "certificate": cert_path}
+            if scheme == "http2":
+                kwargs["http2"] = True
+                kwargs["handler_cls"] = wptserve.Http2WebTestRequestHandler
+            httpd = wptserve.WebTestHttpd(host="127.0.0.1",
+                                          port=0,
+                                          doc_root=doc_root,
+                                          **kwargs)
+            httpd.start(block=False)
+            servers.append(httpd)
+            ports[scheme] = httpd.port
+        conn.send(ports)
+    except Exception:
+        conn.send(traceback.format_exc())
+        raise
+
+    stop.wait()
+    tls = {}
+    for scheme, httpd in zip(schemes, servers):
+        if httpd.use_ssl:
+            tls[scheme] = httpd.handshake_stats.to_dict()
+        httpd.stop()
+    conn.send(tls)
+
+
+class ServerProcess(object):
+    def __init__(self, doc_root, schemes, key_path=default_key_path,
+                 cert_path=default_cert_path):
+        self.doc_root = doc_root
+        self.schemes = schemes
+        self.key_path = key_path
+        self.cert_path = cert_path
+        self.proc = None
+        self.stop = Event()
+        self.ports = None
+        self.tls_stats = None
+        self._conn = None
+
+    def __enter__(self):
+        self._conn, child_conn = Pipe()
+        parent_conn = self._conn
+        self.proc = Process(target=serve,
+                            args=(self.doc_root, self.schemes, self.key_path,
+                                  self.cert_path, child_conn, self.stop))
+        self.proc.daemon = True
+        self.proc.start()
+        if not parent_conn.poll(30):
+            self.proc.terminate()
+            raise ValueError("Timed out waiting for benchmark servers to start")
+        ports = parent_conn.recv()
+        if not isinstance(ports, dict):
+            self.proc.join()
+            raise ValueError("Failed to start benchmark servers:\n%s" % ports)
+        self.ports = ports
+        return self
+
+    def __exit__(self, *args):
+        self.stop.set()
+        if self._conn.poll(10):
+            self.tls_stats = self._conn.recv()
+        self.proc.join(10)
+        if self.proc.is_alive():
+            self.proc.terminate()
+            self.proc.join()
+
+    @property
+    def pid(self):
+        return self.proc.pid
+
+
+class RssSampler(object):
+    """Periodically sample the RSS of a process, keeping the peak value."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        rss = get_rss(self.pid)
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+        return rss
+
+    def run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.sample()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+class Http1Client(object):
+    def __init__(self, host, port, use_ssl, timeout):
+        if use_ssl:
+            context = ssl._create_unverified_context()
+            self.conn = http_client.HTTPSConnection(host, port, timeout=timeout,
+                                                    context=context)
+        else:
+            self.conn = http_client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, path, headers):
+        try:
+            self.conn.request("GET", path, headers=dict(headers))
+            resp = self.conn.getresponse()
+            length = self.read_body(resp)
+        except Exception:
+            self.close()
+            raise
+        if resp.will_close:
+            self.close()
+        return resp.status, length
+
+    def read_body(self, resp):
+        length = 0
+        while True:
+            try:
+                data = resp.read(65536)
+            except ssl.SSLError as e:
+                # Responses without a Content-Length are terminated by the
+                # server closing the socket, which it does without sending
+                # a TLS close_notify
+                if resp.will_close and "EOF" in str(e).upper():
+                    return length
+                raise
+            if not data:
+                return length
+            length += len(data)
+
+    def close(self):
+        self.conn.close()
+
+
+class Http2Client(object):
+    """Minimal HTTP/2 client on a single connection, sending either one
+    request at a time or a batch of concurrent streams."""
+
+    def __init__(self, host, port, timeout):
+        from h2.config import H2Configuration
+        from h2.connection import H2Connection
+
+        self.host = host
+        self.port = port
+        context = ssl._create_unverified_context()
+        context.set_alpn_protocols(["h2"])
+        sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock = context.wrap_socket(sock, server_hostname=host)
+        self.conn = H2Connection(config=H2Configuration(client_side=True))
+        self.conn.initiate_connection()
+        self.sock.sendall(self.conn.data_to_send())
+
+    def request(self, path, headers):
+        status, length, _ = self.request_many(path, headers, 1)[0]
+        return status, length
+
+    def request_many(self, path, headers, streams):
+        """Send streams concurrent requests for path on the connection.
+
+        :returns: A list of (status, length, latency) tuples, one per stream"""
+        from h2 import events
+
+        request_headers = [(":method", "GET"),
+                           (":path", path),
+                           (":scheme", "https"),
+                           (":authority", "%s:%i" % (self.host, self.port))]
+        request_headers.extend((name.lower(), value) for name, value in headers)
+
+        pending = {}
+        results = []
+        start = time.time()
+        for _ in range(streams):
+            stream_id = self.conn.get_next_available_stream_id()
+            self.conn.send_headers(stream_id, request_headers, end_stream=True)
+            pending[stream_id] = [None, 0]
+        self.sock.sendall(self.conn.data_to_send())
+
+        while pending:
+            data = self.sock.recv(65535)
+            if not data:
+                raise IOError("Connection closed by server")
+            for event in self.conn.receive_data(data):
+                response = pending.get(getattr(event, "stream_id", None))
+                if response is None:
+                    continue
+                if isinstance(event, events.ResponseReceived):
+                    for name, value in event.headers:
+                        if name in (b":status", ":status"):
+                            response[0] = int(value)
+                elif isinstance(event, events.DataReceived):
+                    response[1] += len(event.data)
+                    self.conn.acknowledge_received_data(event.flow_controlled_length,
+                                                        event.stream_id)
+                elif isinstance(event, events.StreamEnded):
+                    del pending[event.stream_id]
+                    results.append((response[0], response[1], time.time() - start))
+                elif isinstance(event, events.StreamReset):
+                    raise IOError("Stream %i reset by server" % event.stream_id)
+                elif isinstance(event, events.ConnectionTerminated):
+                    raise IOError("Connection terminated by server")
+            self.sock.sendall(self.conn.data_to_send())
+        return results
+
+    def close(self):
+        try:
+            self.conn.close_connection()
+            self.sock.sendall(self.conn.data_to_send())
+        except Exception:
+            pass
+        self.sock.close()
+
+
+class ScenarioStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.bytes = 0
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        self.bytes += other.bytes
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        return OrderedDict([
+            ("requests", len(latencies)),
+            ("errors", self.errors),
+            ("req_per_sec", len(latencies) / elapsed if elapsed else 0),
+            ("p50_ms", _ms(percentile(latencies, 50))),
+            ("p99_ms", _ms(percentile(latencies, 99))),
+            ("bytes", self.bytes),
+        ])
+
+
+def _ms(value):
+    if value is None:
+        return None
+    return value * 1000
+
+
+class Worker(threading.Thread):
+    """Client thread that issues requests drawn from the weighted scenario
+    mix until either its request budget is used or the deadline passes."""
+
+    def __init__(self, index, host, ports, mix, requests, deadline, timeout, seed,
+                 h2_streams=8):
+        threading.Thread.__init__(self, name="bench-client-%i" % index)
+        self.daemon = True
+        self.host = host
+        self.ports = ports
+        self.mix = mix
+        self.requests = requests
+        self.deadline = deadline
+        self.timeout = timeout
+        self.h2_streams = h2_streams
+        self.random = random.Random(seed + index)
+        self.clients = {}
+        self.stats = {}
+
+    def get_client(self, scheme):
+        client = self.clients.get(scheme)
+        if client is None:
+            port = self.ports[scheme]
+            if scheme == "http2":
+                client = Http2Client(self.host, port, self.timeout)
+            else:
+                client = Http1Client(self.host, port, scheme == "https", self.timeout)
+            self.clients[scheme] = client
+        return client
+
+    def choose(self):
+        value = self.random.random() * self.mix[-1][0]
+        for cumulative_weight, scenario in self.mix:
+            if value < cumulative_weight:
+                return scenario
+        return self.mix[-1][1]
+
+    def run(self):
+        count = 0
+        while ((self.requests is None or count < self.requests) and
+               (self.deadline is None or time.time() < self.deadline)):
+            name, scheme, path, headers, _ = self.choose()
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = ScenarioStats(name)
+            start = time.time()
+            try:
+                client = self.get_client(scheme)
+                if name in multiplexed_scenarios:
+                    results = client.request_many(path, headers, self.h2_streams)
+                else:
+                    status, length = client.request(path, headers)
+                    results = [(status, length, time.time() - start)]
+            except Exception:
+                stats.errors += 1
+                self.clients.pop(scheme, None)
+            else:
+                for status, length, latency in results:
+                    if status is None or status >= 400:
+                        stats.errors += 1
+                    else:
+                        stats.latencies.append(latency)
+                        stats.bytes += length
+            count += 1
+        for client in self.clients.values():
+            client.close()
+
+
+def select_scenarios(names=None, include_http2=True):
+    rv = []
+    for scenario in scenarios:
+        name, scheme = scenario[:2]
+        if names and name not in names:
+            continue
+        if scheme == "http2" and not include_http2:
+            continue
+        rv.append(scenario)
+    if names:
+        unknown = set(names) - set(item[0] for item in scenarios)
+        if unknown:
+            raise ValueError("Unknown scenarios: %s" % ", ".join(sorted(unknown)))
+    return rv
+
+
+def http2_supported():
+    return getattr(ssl, "HAS_ALPN", False)
+
+
+def run_benchmark(selected, concurrency=16, requests=None, duration=10.,
+                  timeout=10., seed=0, doc_root=None, h2_streams=8):
+    """Run the benchmark and return a dictionary of results.
+
+    :param selected: List of scenario tuples to run
+    :param concurrency: Number of client threads, each with its own connection
+                        per scheme
+    :param requests: Number of requests per client, or None to run for
+                     duration seconds
+    :param duration: Length of the run in seconds, used when requests is None
+    :param timeout: Socket timeout for each client connection
+    :param seed: Seed for the pseudo-random request mix
+    :param doc_root: Document root to serve, or None to generate one
+    :param h2_streams: Number of concurrent streams each client sends for
+                       the multiplexed HTTP/2 scenarios"""
+    if not selected:
+        raise ValueError("No scenarios selected")
+
+    tmp_dir = None
+    if doc_root is None:
+        tmp_dir = doc_root = tempfile.mkdtemp()
+        create_doc_root(doc_root)
+
+    mix = []
+    total_weight = 0
+    for scenario in selected:
+        total_weight += scenario[4]
+        mix.append((total_weight, scenario))
+
+    schemes = sorted(set(scenario[1] for scenario in selected))
+
+    try:
+        with ServerProcess(doc_root, schemes) as server:
+            with RssSampler(server.pid) as rss:
+                start_rss = rss.peak
+                deadline = None if requests is not None else time.time() + duration
+                workers = [Worker(i, "127.0.0.1", server.ports, mix, requests,
+                                  deadline, timeout, seed, h2_streams)
+                           for i in range(concurrency)]
+                start = time.time()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.time() - start
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    per_scenario = OrderedDict()
+    total = ScenarioStats("total")
+    for scenario in selected:
+        stats = ScenarioStats(scenario[0])
+        for worker in workers:
+            if scenario[0] in worker.stats:
+                stats.merge(worker.stats[scenario[0]])
+        per_scenario[scenario[0]] = stats.summary(elapsed)
+        total.merge(stats)
+
+    return OrderedDict([
+        ("concurrency", concurrency),
+        ("h2_streams", h2_streams),
+        ("elapsed_s", elapsed),
+        ("total", total.summary(elapsed)),
+        ("scenarios", per_scenario),
+        ("server_rss_start", start_rss),
+        ("server_rss_peak", rss.peak),
+        ("tls", server.tls_stats),
+    ])
+
+
+def format_results(results):
+    def fmt(value, spec):
+        return "-" if value is None else spec % value
+
+    def rss_mb(value):
+        return fmt(value / (1024. * 1024) if value is not None else None, "%.1f MB")
+
+    lines = ["%-20s %9s %7s %10s %9s %9s" % ("scenario", "requests", "errors",
+                                             "req/s", "p50 ms", "p99 ms")]
+    rows = list(results["scenarios"].items()) + [("total", results["total"])]
+    for name, data in rows:
+        lines.append("%-20s %9i %7i %10.1f %9s %9s" % (name,
+                                                       data["requests"],
+                                                       data["errors"],
+                                                       data["req_per_sec"],
+                                                       fmt(data["p50_ms"], "%.2f"),
+                                                       fmt(data["p99_ms"], "%.2f")))
+    lines.append("")
+    lines.append("clients: %i, elapsed: %.2fs" % (results["concurrency"], results["elapsed_s"]))
+    lines.append("server RSS: start %s, peak %s" % (rss_mb(results["server_rss_start"]),
+                                                    rss_mb(results["server_rss_peak"])))
+    for scheme, stats in sorted((results["tls"] or {}).items()):
+        lines.append("%s TLS handshakes: %i (%i resumed, %i failed), mean %s, max %s" %
+                     (scheme, stats["handshakes"], stats["resumed"], stats["failed"],
+                      fmt(stats["mean_ms"], "%.2f ms"), fmt(stats["max_ms"], "%.2f ms")))
+    return "\n".join(lines)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Benchmark wptserve throughput and latency")
+    parser.add_argument("--concurrency", "-c", action="store", type=int, default=16,
+                        help="Number of concurrent client connections per scheme")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--duration", "-d", action="store", type=float, default=10.,
+                       help="Length of the run in seconds")
+    group.add_argument("--requests", "-n", action="store", type=int, default=None,
+                       help="Number of requests per client connection; overrides --duration")
+    parser.add_argument("--scenario", action="append", dest="scenarios",
+                        choices=[item[0] for item in scenarios],
+                        help="Scenario to include in the request mix (default: all)")
+    parser.add_argument("--no-h2", action="store_false", dest="http2", default=True,
+                        help="Exclude HTTP/2 scenarios")
+    parser.add_argument("--h2-streams", action="store", type=int, default=8,
+                        help="Number of concurrent streams per connection for the "
+                        "h2-multiplex scenarios")
+    parser.add_argument("--timeout", action="store", type=float, default=10.,
+                        help="Client socket timeout in seconds")
+    parser.add_argument("--seed", action="store", type=int, default=0,
+                        help="Seed for the request mix")
+    parser.add_argument("--json", action="store", dest="json_path",
+                        help="Path to write results as JSON")
+    return parser
+
+
+def run(**kwargs):
+    include_http2 = kwargs["http2"] and http2_supported()
+    if kwargs["http2"] and not include_http2:
+        print("HTTP/2 scenarios skipped; ssl module lacks ALPN support", file=sys.stderr)
+    selected = select_scenarios(kwargs["scenarios"], include_http2=include_http2)
+
+    results = run_benchmark(selected,
+                            concurrency=kwargs["concurrency"],
+                            requests=kwargs["requests"],
+                            duration=kwargs["duration"],
+                            timeout=kwargs["timeout"],
+                            seed=kwargs["seed"],
+                            h2_streams=kwargs["h2_streams"])
+
+    print(format_results(results))
+
+    if kwargs["json_path"]:
+        with open(kwargs["json_path"], "w") as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if results["total"]["errors"] else 0
+
+
+def main():
+    kwargs = vars(get_parser().parse_args())
+    return run(**kwargs)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
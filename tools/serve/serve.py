@@ -9,14 +9,14 @@ import logging
 import os
 import platform
 import socket
+import ssl
 import sys
 import threading
 import time
 import traceback
-from six.moves import urllib
 import uuid
 from collections import defaultdict, OrderedDict
-from multiprocessing import Process, Event
+from multiprocessing import Process, Event, Pipe
 
 from localpaths import repo_root
 from six.moves import reload_module
@@ -25,7 +25,7 @@ from manifest.sourcefile import read_script_metadata, js_meta_re, parse_variants
 from wptserve import server as wptserve, handlers
 from wptserve import stash
 from wptserve import config
-from wptserve.logger import set_logger
+from wptserve.logger import get_logger, set_logger
 from wptserve.handlers import filesystem_path, wrap_pipeline
 from wptserve.utils import get_port, HTTPException, http2_compatible
 from mod_pywebsocket import standalone as pywebsocket
@@ -381,37 +381,82 @@ class ServerProc(object):
         self.proc = None
         self.daemon = None
         self.stop = Event()
+        self.startup_time = None
+        self.startup_error = None
+        self._ready_conn = None
+        self._start_time = None
 
     def start(self, init_func, host, port, paths, routes, bind_address, config, **kwargs):
+        self._ready_conn, child_conn = Pipe(duplex=False)
+        self._start_time = time.time()
         self.proc = Process(target=self.create_daemon,
                             args=(init_func, host, port, paths, routes, bind_address,
-                                  config),
+                                  config, child_conn),
                             kwargs=kwargs)
         self.proc.daemon = True
         self.proc.start()
+        child_conn.close()
 
     def create_daemon(self, init_func, host, port, paths, routes, bind_address,
-                      config, **kwargs):
+                      config, ready_conn, **kwargs):
         try:
             self.daemon = init_func(host, port, paths, routes, bind_address, config, **kwargs)
         except socket.error:
             print("Socket error on port %s" % port, file=sys.stderr)
+            ready_conn.send(("error", "Socket error on port %s" % port))
             raise
         except Exception:
             print(traceback.format_exc(), file=sys.stderr)
+            ready_conn.send(("error", traceback.format_exc()))
             raise
 
         if self.daemon:
             try:
                 self.daemon.start(block=False)
+                # The listening socket is bound and, for TLS servers, the
+                # certificates are loaded by this point
+                ready_conn.send(("ready", None))
+                ready_conn.close()
                 try:
                     self.stop.wait()
                 except KeyboardInterrupt:
                     pass
             except Exception:
                 print(traceback.format_exc(), file=sys.stderr)
+                ready_conn.send(("error", traceback.format_exc()))
                 raise
 
+    def wait_ready(self, timeout=None):
+        """Wait for the server process to report that it is accepting
+        connections.
+
+        :param timeout: Maximum time to wait in seconds, or None to wait
+                        indefinitely.
+        :returns: True if the server is ready, False if it failed to start
+                  or didn't start within the timeout, in which case
+                  startup_error is set to a description of the failure."""
+        if self.startup_time is not None:
+            return True
+        if self.startup_error is not None:
+            return False
+
+        status = None
+        if self._ready_conn.poll(timeout):
+            try:
+                status, data = self._ready_conn.recv()
+            except EOFError:
+                data = "Server process exited with code %s" % self.proc.exitcode
+        else:
+            data = "Timed out waiting for server to start"
+
+        if status == "ready":
+            self.startup_time = time.time() - self._start_time
+            self._ready_conn.close()
+            return True
+
+        self.startup_error = data
+        return False
+
     def wait(self):
         self.stop.set()
         self.proc.join()
@@ -426,44 +471,37 @@ class ServerProc(object):
 
 
 def check_subdomains(config):
-    paths = config.paths
-    bind_address = config.bind_address
-    aliases = config.aliases
+    """Check that all the configured domains resolve to the server host.
 
+    Rather than starting a server, this binds a listening socket in the
+    current process and checks that a connection can be made to it using
+    each domain name."""
     host = config.server_host
-    port = get_port()
-    logger.debug("Going to use port %d to check subdomains" % port)
-
-    wrapper = ServerProc()
-    wrapper.start(start_http_server, host, port, paths, build_routes(aliases),
-                  bind_address, config)
-
-    connected = False
-    for i in range(10):
-        try:
-            urllib.request.urlopen("http://%s:%d/" % (host, port))
-            connected = True
-            break
-        except urllib.error.URLError:
-            time.sleep(1)
-
-    if not connected:
-        logger.critical("Failed to connect to test server on http://%s:%s. "
-                        "You may need to edit /etc/hosts or similar, see README.md." % (host, port))
-        sys.exit(1)
+    bind_host = host if config.bind_address else ""
 
-    for domain in config.domains_set:
-        if domain == host:
-            continue
-
-        try:
-            urllib.request.urlopen("http://%s:%d/" % (domain, port))
-        except Exception:
-            logger.critical("Failed probing domain %s. "
-                            "You may need to edit /etc/hosts or similar, see README.md." % domain)
-            sys.exit(1)
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listen_socket.bind((bind_host, 0))
+        listen_socket.listen(len(config.domains_set) + 1)
+        port = listen_socket.getsockname()[1]
+        logger.debug("Going to use port %d to check subdomains" % port)
 
-    wrapper.wait()
+        for domain in [host] + sorted(config.domains_set - {host}):
+            try:
+                probe = socket.create_connection((domain, port), timeout=5)
+            except (socket.error, UnicodeError):
+                if domain == host:
+                    logger.critical("Failed to connect to test server on http://%s:%s. "
+                                    "You may need to edit /etc/hosts or similar, see README.md." %
+                                    (host, port))
+                else:
+                    logger.critical("Failed probing domain %s. "
+                                    "You may need to edit /etc/hosts or similar, see README.md." %
+                                    domain)
+                sys.exit(1)
+            probe.close()
+    finally:
+        listen_socket.close()
 
 
 def make_hosts_file(config, host):
@@ -558,6 +596,33 @@ def start_http2_server(host, port, paths, routes, bind_address, config, ssl_conf
                                  encrypt_after_connect=ssl_config["encrypt_after_connect"],
                                  latency=kwargs.get("latency"),
                                  http2=True)
+
+
+class TimedWebSocketServer(pywebsocket.WebSocketServer):
+    """pywebsocket server that records the time taken by each TLS handshake.
+
+    pywebsocket performs the handshake in get_request, which is only
+    called once a connection is ready to accept, so timing the whole
+    call gives the handshake time. The TLS sockets themselves are still
+    set up by pywebsocket, so unlike the HTTP servers these don't share
+    an SSLContext and sessions are not resumed.
+    """
+    def __init__(self, options):
+        self.handshake_stats = wptserve.HandshakeStats()
+        pywebsocket.WebSocketServer.__init__(self, options)
+
+    def get_request(self):
+        start = time.time()
+        try:
+            rv = pywebsocket.WebSocketServer.get_request(self)
+        except ssl.SSLError:
+            self.handshake_stats.record_failure()
+            raise
+        self.handshake_stats.record(time.time() - start,
+                                    getattr(rv[0], "session_reused", False))
+        return rv
+
+
 class WebSocketDaemon(object):
     def __init__(self, host, port, doc_root, handlers_root, log_level, bind_address,
                  ssl_config):
@@ -589,7 +654,12 @@ class WebSocketDaemon(object):
         opts, args = pywebsocket._parse_args_and_config(cmd_args)
         opts.cgi_directories = []
         opts.is_executable_method = None
-        self.server = pywebsocket.WebSocketServer(opts)
+        if ssl_config is not None and tls_module == pywebsocket._TLS_BY_STANDARD_MODULE:
+            self.server = TimedWebSocketServer(opts)
+            self.handshake_stats = self.server.handshake_stats
+        else:
+            self.server = pywebsocket.WebSocketServer(opts)
+            self.handshake_stats = None
         ports = [item[0].getsockname()[1] for item in self.server._sockets]
         assert all(item == ports[0] for item in ports)
         self.port = ports[0]
@@ -617,6 +687,9 @@ class WebSocketDaemon(object):
                 self.server.server_close()
                 self.server_thread.join()
                 self.server_thread = None
+                if self.handshake_stats is not None:
+                    get_logger().info("wss server on %s:%s: %s" %
+                                      (self.host, self.port, self.handshake_stats))
             except AttributeError:
                 pass
             self.started = False
@@ -662,10 +735,35 @@ def start(config, routes, **kwargs):
     return servers
 
 
-def iter_procs(servers):
+def wait_for_servers(servers, timeout=60):
+    """Wait for all the servers returned by start() to report that they are
+    ready.
+
+    The servers start in parallel, so the total time taken is that of the
+    slowest server.
+
+    :param servers: Dictionary of servers, as returned by start()
+    :param timeout: Maximum time in seconds to wait for all the servers
+    :returns: List of (scheme, port, error) tuples for each server that
+              failed to start"""
+    failed = []
+    deadline = time.time() + timeout
+    for scheme, scheme_servers in servers.items():
+        for port, server in scheme_servers:
+            if not server.wait_ready(max(deadline - time.time(), 0)):
+                failed.append((scheme, port, server.startup_error))
+    return failed
+
+
+def iter_servers(servers):
     for servers in servers.values():
         for port, server in servers:
-            yield server.proc
+            yield server
+
+
+def iter_procs(servers):
+    for server in iter_servers(servers):
+        yield server.proc
 
 
 def build_config(override_path=None, **kwargs):
@@ -802,6 +900,8 @@ def run(**kwargs):
 
         bind_address = config["bind_address"]
 
+        start_time = time.time()
+
         if config["check_subdomains"]:
             check_subdomains(config)
 
@@ -813,6 +913,21 @@ def run(**kwargs):
         with stash.StashServer(stash_address, authkey=str(uuid.uuid4())):
             servers = start(config, build_routes(config["aliases"]), **kwargs)
 
+            failed = wait_for_servers(servers)
+            for scheme, port, error in failed:
+                logger.critical("Failed to start %s server on port %s:\n%s" % (scheme, port, error))
+            if failed:
+                for server in iter_servers(servers):
+                    server.kill()
+                sys.exit(1)
+
+            logger.info("Started %i servers in %.2fs" %
+                        (len(list(iter_procs(servers))), time.time() - start_time))
+            for scheme, scheme_servers in sorted(servers.items()):
+                for port, server in scheme_servers:
+                    logger.debug("%s server on port %s ready after %.2fs" %
+                                 (scheme, port, server.startup_time))
+
             try:
                 while any(item.is_alive() for item in iter_procs(servers)):
                     for item in iter_procs(servers):
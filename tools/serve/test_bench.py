@@ -0,0 +1,38 @@
+import pytest
+
+import localpaths  # noqa: flake8
+from . import bench
+
+
+def test_percentile():
+    values = list(range(101))
+    assert bench.percentile(values, 50) == 50
+    assert bench.percentile(values, 99) == 99
+    assert bench.percentile([], 50) is None
+
+
+def test_select_scenarios():
+    selected = bench.select_scenarios(["static", "h2-static"], include_http2=False)
+    assert [item[0] for item in selected] == ["static"]
+
+    with pytest.raises(ValueError):
+        bench.select_scenarios(["nonexistent"])
+
+
+def test_run_benchmark():
+    selected = bench.select_scenarios(["static", "range", "sub", "python", "https-static"])
+    results = bench.run_benchmark(selected, concurrency=2, requests=10)
+    assert results["total"]["errors"] == 0
+    assert results["total"]["requests"] == 20
+    assert set(results["scenarios"].keys()) == {"static", "range", "sub", "python", "https-static"}
+
+
+@pytest.mark.skipif(not bench.http2_supported(), reason="ssl module lacks ALPN support")
+def test_run_benchmark_h2_multiplex():
+    selected = bench.select_scenarios(["h2-static", "h2-multiplex-delay"])
+    results = bench.run_benchmark(selected, concurrency=2, requests=4, h2_streams=4)
+    assert results["total"]["errors"] == 0
+    scenarios = results["scenarios"]
+    # Each multiplexed request is counted once per stream
+    assert (scenarios["h2-static"]["requests"] +
+            scenarios["h2-multiplex-delay"]["requests"] // 4) == 8
@@ -1,3 +1,4 @@
+import logging
 import pickle
 import platform
 import os
@@ -81,3 +82,47 @@ def test_pickle():
     # Ensure that the config object can be pickled
     with ConfigBuilder() as c:
         pickle.dumps(c)
+
+
+class DummyDaemon(object):
+    def start(self, block=False):
+        pass
+
+
+def start_dummy_server(*args, **kwargs):
+    return DummyDaemon()
+
+
+def start_broken_server(*args, **kwargs):
+    raise ValueError("broken server")
+
+
+def test_server_proc_ready():
+    proc = serve.ServerProc()
+    proc.start(start_dummy_server, "127.0.0.1", 0, {}, [], True, None)
+    try:
+        assert proc.wait_ready(10)
+        assert proc.startup_time is not None
+        assert proc.startup_error is None
+    finally:
+        proc.kill()
+
+
+def test_server_proc_error():
+    proc = serve.ServerProc()
+    proc.start(start_broken_server, "127.0.0.1", 0, {}, [], True, None)
+    try:
+        assert not proc.wait_ready(10)
+        assert "broken server" in proc.startup_error
+        assert proc.startup_time is None
+    finally:
+        proc.kill()
+
+
+def test_check_subdomains_unresolved(monkeypatch):
+    monkeypatch.setattr(serve, "logger", logging.getLogger("test_serve"), raising=False)
+    with ConfigBuilder(browser_host="localhost",
+                       alternate_hosts={"alt": "nonexistent.invalid"},
+                       server_host="127.0.0.1") as c:
+        with pytest.raises(SystemExit):
+            serve.check_subdomains(c)
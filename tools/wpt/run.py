@@ -62,6 +62,11 @@ def args_general(kwargs):
     kwargs.set_if_none("metadata_root", wpt_root)
     kwargs.set_if_none("manifest_update", True)
     kwargs.set_if_none("manifest_download", True)
+    kwargs.set_if_none("openssl_cert_dir", utils.wpt_cache_dir("certs"))
+    kwargs.set_if_none("metadata_cache_dir", utils.wpt_cache_dir("metadata"),
+                       extra_cond=lambda kwargs: not kwargs["no_metadata_cache"])
+    kwargs.set_if_none("reftest_screenshot_cache_dir", utils.wpt_cache_dir("screenshots"),
+                       extra_cond=lambda kwargs: kwargs["reftest_screenshot_cache"])
 
     if kwargs["ssl_type"] in (None, "pregenerated"):
         cert_root = os.path.join(wpt_root, "tools", "certs")
@@ -9,6 +9,9 @@ from collections import OrderedDict
 from six import iteritems
 
 from ..manifest import manifest, update
+from ..manifest.dependencies import (DependencyIndex, dependency_index_key,  # noqa: F401
+                                     dependency_index_path, read_test_file,
+                                     update_dependency_index)
 
 here = os.path.dirname(__file__)
 wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir))
@@ -202,8 +205,12 @@ def _init_manifest_cache():
 load_manifest = _init_manifest_cache()
 
 
-def affected_testfiles(files_changed, skip_tests, manifest_path=None):
-    """Determine and return list of test files that reference changed files."""
+def affected_testfiles(files_changed, skip_tests, manifest_path=None, scan=False):
+    """Determine and return list of test files that reference changed files.
+
+    Test files are found using the DependencyIndex stored next to the
+    manifest, which is brought up to date first, unless scan is True, in
+    which case every test file is read."""
     affected_testfiles = set()
     # Exclude files that are in the repo root, because
     # they are not part of any test.
@@ -212,12 +219,12 @@ def affected_testfiles(files_changed, skip_tests, manifest_path=None):
     wpt_manifest = load_manifest(manifest_path)
 
     test_types = ["testharness", "reftest", "wdspec"]
-    support_files = {os.path.join(wpt_root, path)
-                     for _, path, _ in wpt_manifest.itertypes("support")}
+    support_paths = set(path for _, path, _ in wpt_manifest.itertypes("support"))
+    support_files = {os.path.join(wpt_root, path) for path in support_paths}
     wdspec_test_files = {os.path.join(wpt_root, path)
                          for _, path, _ in wpt_manifest.itertypes("wdspec")}
-    test_files = {os.path.join(wpt_root, path)
-                  for _, path, _ in wpt_manifest.itertypes(*test_types)}
+    test_paths = set(path for _, path, _ in wpt_manifest.itertypes(*test_types))
+    test_files = {os.path.join(wpt_root, path) for path in test_paths}
 
     nontests_changed = nontests_changed.intersection(support_files)
 
@@ -252,34 +259,50 @@ def affected_testfiles(files_changed, skip_tests, manifest_path=None):
                     break
         return affected
 
-    for root, dirs, fnames in os.walk(wpt_root):
-        # Walk top_level_subdir looking for test files containing either the
-        # relative filepath or absolute filepath to the changed files.
-        if root == wpt_root:
-            for dir_name in skip_tests:
-                dirs.remove(dir_name)
-        for fname in fnames:
-            test_full_path = os.path.join(root, fname)
-            # Skip any file that's not a test file.
-            if test_full_path not in test_files:
-                continue
-            if affected_by_wdspec(test_full_path):
-                affected_testfiles.add(test_full_path)
-                continue
-
-            with open(test_full_path, "rb") as fh:
-                file_contents = fh.read()
-                if file_contents.startswith("\xfe\xff"):
-                    file_contents = file_contents.decode("utf-16be", "replace")
-                elif file_contents.startswith("\xff\xfe"):
-                    file_contents = file_contents.decode("utf-16le", "replace")
-                else:
-                    file_contents = file_contents.decode("utf8", "replace")
-                for full_path, repo_path in nontest_changed_paths:
-                    rel_path = os.path.relpath(full_path, root).replace(os.path.sep, "/")
-                    if rel_path in file_contents or repo_path in file_contents:
-                        affected_testfiles.add(test_full_path)
-                        continue
+    def affected_by_contents(test_full_path):
+        # Check for either the relative filepath or absolute filepath to
+        # the changed files.
+        root = os.path.dirname(test_full_path)
+        try:
+            file_contents = read_test_file(test_full_path)
+        except IOError:
+            return False
+        for full_path, repo_path in nontest_changed_paths:
+            rel_path = os.path.relpath(full_path, root).replace(os.path.sep, "/")
+            if rel_path in file_contents or repo_path in file_contents:
+                return True
+        return False
+
+    if scan:
+        candidates = []
+        for root, dirs, fnames in os.walk(wpt_root):
+            # Walk top_level_subdir looking for test files
+            if root == wpt_root:
+                for dir_name in skip_tests:
+                    dirs.remove(dir_name)
+            candidates.extend(os.path.join(root, fname) for fname in fnames)
+    else:
+        candidates = set(item for item in wdspec_test_files if os.path.exists(item))
+        index_keys = set(dependency_index_key(repo_path)
+                         for _, repo_path in nontest_changed_paths)
+        if None in index_keys:
+            # Tests referring to this file aren't indexed, so check them all
+            candidates |= test_files
+        elif index_keys:
+            if manifest_path is None:
+                manifest_path = os.path.join(wpt_root, "MANIFEST.json")
+            index = update_dependency_index(wpt_root, wpt_manifest, manifest_path)
+            for key in index_keys:
+                candidates.update(os.path.join(wpt_root, path) for path in index.get(key))
+        candidates = sorted(item for item in candidates
+                            if os.path.relpath(item, wpt_root).split(os.sep)[0] not in skip_tests)
+
+    for test_full_path in candidates:
+        # Skip any file that's not a test file.
+        if test_full_path not in test_files:
+            continue
+        if affected_by_wdspec(test_full_path) or affected_by_contents(test_full_path):
+            affected_testfiles.add(test_full_path)
 
     return tests_changed, affected_testfiles
 
@@ -311,6 +334,10 @@ def get_parser_affected():
                         action="store",
                         default=wpt_root,
                         help="Directory that will contain MANIFEST.json")
+    parser.add_argument("--scan", action="store_true",
+                        help="Read every test file to find the tests affected by changed "
+                        "support files, rather than using the index of the files they "
+                        "refer to")
     return parser
 
 
@@ -339,7 +366,8 @@ def run_tests_affected(**kwargs):
     tests_changed, dependents = affected_testfiles(
         changed,
         set(["conformance-checkers", "docs", "tools"]),
-        manifest_path=manifest_path
+        manifest_path=manifest_path,
+        scan=kwargs["scan"]
     )
 
     message = "{path}"
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from tools.manifest import dependencies, manifest, update, vcs
+from tools.wpt import testfiles
+
+
+@pytest.fixture
+def tests_root(tmpdir, monkeypatch):
+    root = tmpdir.mkdir("tests")
+    a = root.mkdir("a")
+    a.join("test.html").write('<script src="/resources/testharness.js"></script>'
+                              '<script src="support/a.js?pipe=sub"></script>')
+    a.join("style.html").write('<link rel=match href="style-ref.html">'
+                               '<link rel=stylesheet href=/a/support/b.css>')
+    a.join("style-ref.html").write('<p>ref</p>')
+    a.join("worker.any.js").write('// META: script=support/a.js\n'
+                                  'fetch("support/data")')
+    a.join("unrelated.html").write('<script src="/resources/testharness.js"></script>'
+                                   '<script>var a = document.body.clientWidth;</script>')
+    support = a.mkdir("support")
+    support.join("a.js").write("")
+    support.join("b.css").write("")
+    support.join("data").write("")
+    root.mkdir("resources").join("testharness.js").write("")
+
+    monkeypatch.setattr(testfiles, "wpt_root", str(root))
+    monkeypatch.setattr(testfiles, "load_manifest", lambda manifest_path: load(root))
+    return root
+
+
+def load(root):
+    wpt_manifest = manifest.Manifest()
+    wpt_manifest.update(vcs.FileSystem(str(root), "/"))
+    return wpt_manifest
+
+
+def affected(tests_root, manifest_path, changed, scan=False):
+    tests_changed, dependents = testfiles.affected_testfiles(
+        [os.path.join(str(tests_root), *item.split("/")) for item in changed],
+        set(), manifest_path, scan=scan)
+    return sorted(os.path.relpath(item, str(tests_root)).replace(os.path.sep, "/")
+                  for item in dependents)
+
+
+@pytest.mark.parametrize("changed,expected", [
+    (["a/support/a.js"], ["a/test.html", "a/worker.any.js"]),
+    (["a/support/b.css"], ["a/style.html"]),
+    (["a/support/data"], ["a/worker.any.js"]),
+    (["a/support/a.js", "a/support/b.css"], ["a/style.html", "a/test.html", "a/worker.any.js"]),
+])
+def test_affected_testfiles(tmpdir, tests_root, changed, expected):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    assert affected(tests_root, manifest_path, changed, scan=True) == expected
+    assert affected(tests_root, manifest_path, changed) == expected
+
+
+def test_dependency_index_update(tmpdir, tests_root, monkeypatch):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    assert affected(tests_root, manifest_path, ["a/support/b.css"]) == ["a/style.html"]
+
+    index = testfiles.DependencyIndex.load(testfiles.dependency_index_path(manifest_path))
+    assert index.extensions == {"css", "html", "js"}
+    assert sorted(index.get("b.css")) == [os.path.join("a", "style.html")]
+    assert index.tests[os.path.join("a", "unrelated.html")][1] == "testharness.js"
+
+    tests_root.join("a", "unrelated.html").write('<script src="/resources/testharness.js"></script>'
+                                                 '<link rel=stylesheet href="support/b.css">')
+    read = []
+    read_test_file = testfiles.read_test_file
+    for module in [testfiles, dependencies]:
+        monkeypatch.setattr(module, "read_test_file",
+                            lambda path: read.append(path) or read_test_file(path))
+    assert affected(tests_root, manifest_path, ["a/support/b.css"]) == ["a/style.html",
+                                                                        "a/unrelated.html"]
+    # The index is only updated for the changed test, and only the tests
+    # that refer to b.css are read to check their references
+    index_reads = [item for item in read if read.count(item) == 2]
+    assert index_reads == [os.path.join(str(tests_root), "a", "unrelated.html")] * 2
+    assert sorted(set(read)) == [os.path.join(str(tests_root), "a", item)
+                                 for item in ["style.html", "unrelated.html"]]
+
+
+def test_manifest_update_writes_index(tmpdir, tests_root):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    update.update_from_cli(tests_root=str(tests_root), path=manifest_path, download=False,
+                           url_base="/", work=True)
+    index = dependencies.DependencyIndex.load(dependencies.dependency_index_path(manifest_path))
+    assert sorted(index.get("a.js")) == [os.path.join("a", "test.html"),
+                                         os.path.join("a", "worker.any.js")]
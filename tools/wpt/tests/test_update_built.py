@@ -0,0 +1,116 @@
+import os
+import sys
+
+import pytest
+
+from tools.wpt import update_built
+
+generator_script = """
+import os, sys
+name = sys.argv[1]
+with open("runs.log", "a") as f:
+    f.write(name + "\\n")
+with open(os.path.join(name, "input.txt")) as f:
+    data = f.read()
+if data == "fail":
+    sys.exit(1)
+if not os.path.exists(os.path.join(name, "out")):
+    os.mkdir(os.path.join(name, "out"))
+with open(os.path.join(name, "out", "upper.txt"), "w") as f:
+    f.write(data.upper())
+with open(os.path.join(name, "out", "static.txt"), "w") as f:
+    f.write("static")
+"""
+
+
+@pytest.fixture
+def root(tmpdir):
+    tmpdir.join("gen.py").write(generator_script)
+    for name in ["a", "b"]:
+        tmpdir.mkdir(name).join("input.txt").write(name)
+    return tmpdir
+
+
+def generators():
+    return [update_built.Generator(name, [sys.executable, "gen.py", name], "",
+                                   ["gen.py", "%s/input.txt" % name], [name])
+            for name in ["a", "b"]]
+
+
+def runs(root):
+    path = root.join("runs.log")
+    rv = sorted(path.read().split()) if path.exists() else []
+    if path.exists():
+        path.remove()
+    return rv
+
+
+def mtimes(root, generator):
+    _, outputs = update_built.generator_files(str(root), generator)
+    return {path: os.stat(os.path.join(str(root), path)).st_mtime for path in outputs}
+
+
+def test_update_built(root):
+    state_path = str(root.join("state", "state.json"))
+    assert update_built.update_built(str(root), generators(), state_path, jobs=2)
+    assert runs(root) == ["a", "b"]
+    assert root.join("a", "out", "upper.txt").read() == "A"
+
+    # Nothing has changed, so nothing runs
+    assert update_built.update_built(str(root), generators(), state_path, jobs=2)
+    assert runs(root) == []
+
+    # Changing an input reruns only the generators that use it
+    root.join("b", "input.txt").write("changed")
+    assert update_built.update_built(str(root), generators(), state_path)
+    assert runs(root) == ["b"]
+    assert root.join("b", "out", "upper.txt").read() == "CHANGED"
+
+    # Changing an output reruns its generator to restore it
+    root.join("a", "out", "upper.txt").write("edited")
+    assert update_built.update_built(str(root), generators(), state_path)
+    assert runs(root) == ["a"]
+    assert root.join("a", "out", "upper.txt").read() == "A"
+
+    root.join("gen.py").write("\n", mode="a")
+    assert update_built.update_built(str(root), generators(), state_path, names=["b"])
+    assert runs(root) == ["b"]
+
+
+def test_update_built_mtimes(root):
+    assert update_built.update_built(str(root), generators(), None)
+    before = mtimes(root, generators()[0])
+    for path in before:
+        os.utime(os.path.join(str(root), path), (1000000000, 1000000000))
+    before = mtimes(root, generators()[0])
+
+    root.join("a", "input.txt").write("new")
+    assert update_built.update_built(str(root), generators(), None, force=True)
+    assert runs(root) == ["a", "a", "b", "b"]
+    after = mtimes(root, generators()[0])
+    # Only the outputs whose contents changed have a new mtime
+    assert [path for path in before if after[path] != before[path]] == ["a/out/upper.txt"]
+
+
+def test_update_built_failure(root):
+    state_path = str(root.join("state.json"))
+    root.join("a", "input.txt").write("fail")
+    assert not update_built.update_built(str(root), generators(), state_path)
+    assert runs(root) == ["a", "b"]
+    # Failed generators run again next time
+    assert not update_built.update_built(str(root), generators(), state_path)
+    assert runs(root) == ["a"]
+
+
+def test_generator_files_ignored(root):
+    root.join(".gitignore").write("*.pyc\n__pycache__/\n")
+    tools = root.mkdir("tools")
+    tools.join("util.py").write("")
+    tools.join("util.pyc").write("")
+    tools.mkdir("__pycache__").join("util.cpython-37.pyc").write("")
+    tools.join(".gitignore").write("*.tmp\n")
+    tools.join("build.tmp").write("")
+    generator = update_built.Generator("c", [sys.executable, "gen.py", "c"], "",
+                                       ["tools"], ["c"])
+    inputs, outputs = update_built.generator_files(str(root), generator)
+    assert inputs == {"tools/util.py"}
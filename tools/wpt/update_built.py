@@ -0,0 +1,337 @@
+"""Regenerate the built tests that are checked in to the repository.
+
+Each generator declares the files it reads and the paths it writes.
+After a generator has run, the hashes of its inputs and outputs are
+recorded, and the generator is only run again once one of them has
+changed. The generators that do need to run are run in parallel, and
+any output whose content is unchanged by a run keeps its previous
+modification time, so a rebuild with nothing to do finishes quickly and
+leaves the tree untouched."""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from multiprocessing.pool import ThreadPool
+
+from ..gitignore.gitignore import PathFilter
+from .utils import wpt_cache_dir
+
+here = os.path.dirname(__file__)
+wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir))
+
+logger = logging.getLogger()
+
+
+class Generator(object):
+    """A script that writes built tests.
+
+    :param name: Name of the generator
+    :param command: List of command arguments to run the generator
+    :param cwd: Directory to run the command in, relative to the root
+    :param inputs: Files or directories, relative to the root, that the
+                   output depends on
+    :param outputs: Files or directories, relative to the root, that
+                    the generator writes to; any inputs inside these
+                    aren't treated as outputs
+    """
+
+    def __init__(self, name, command, cwd, inputs, outputs):
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.inputs = inputs
+        self.outputs = outputs
+
+
+# The html5lib generator also reads the upstream html5lib tests, which
+# aren't tracked here; use --force to pick up changes to them.
+generators = [
+    Generator("2dcontext", ["sh", "./build.sh"], "2dcontext/tools",
+              ["2dcontext/tools"],
+              ["2dcontext"]),
+    Generator("assumptions", ["sh", "./build.sh"], "infrastructure/assumptions/tools",
+              ["infrastructure/assumptions/tools", "fonts/Ahem.ttf"],
+              ["infrastructure/assumptions/ahem.html",
+               "infrastructure/assumptions/ahem-ref.html",
+               "infrastructure/assumptions/ahem-notref.html"]),
+    Generator("html", ["sh", "./build.sh"], "html/tools",
+              ["html/tools"],
+              ["html/syntax/parsing"]),
+    Generator("offscreen-canvas", ["sh", "./build.sh"], "offscreen-canvas/tools",
+              ["offscreen-canvas/tools",
+               "2dcontext/tools/gentestutils.py",
+               "2dcontext/tools/spec.yaml"],
+              ["offscreen-canvas"]),
+    Generator("mimesniff", [sys.executable, "generated-mime-types.py"],
+              "mimesniff/mime-types/resources",
+              ["mimesniff/mime-types/resources/generated-mime-types.py"],
+              ["mimesniff/mime-types/resources/generated-mime-types.json"]),
+    Generator("referrer-policy", [sys.executable, "generic/tools/generate.py"], "referrer-policy",
+              ["referrer-policy/generic/tools",
+               "referrer-policy/generic/template",
+               "referrer-policy/spec.src.json"],
+              ["referrer-policy"]),
+    Generator("mixed-content", [sys.executable, "generic/tools/generate.py"], "mixed-content",
+              ["mixed-content/generic/tools",
+               "mixed-content/generic/template",
+               "mixed-content/spec.src.json"],
+              ["mixed-content"]),
+]
+
+
+def walk_files(root, paths, exclude=(), path_filter=None):
+    """Get the set of files within paths, relative to root, skipping
+    hidden files and directories, such as virtualenvs, anything within
+    the paths in exclude and, given a PathFilter for root, anything that
+    its .gitignore files ignore, such as .pyc files"""
+    rv = set()
+    exclude = tuple(exclude)
+    for path in paths:
+        abs_path = os.path.join(root, path)
+        if os.path.isfile(abs_path):
+            rv.add(path)
+            continue
+        for dir_path, dir_names, file_names in os.walk(abs_path):
+            rel_dir = os.path.relpath(dir_path, root).replace(os.path.sep, "/")
+            dir_names[:] = [item for item in dir_names
+                            if not item.startswith(".") and
+                            not _in_paths("%s/%s" % (rel_dir, item), exclude) and
+                            not _ignored("%s/%s/" % (rel_dir, item), path_filter)]
+            for name in file_names:
+                rel_path = "%s/%s" % (rel_dir, name)
+                if (not name.startswith(".") and
+                    not _in_paths(rel_path, exclude) and
+                    not _ignored(rel_path, path_filter)):
+                    rv.add(rel_path)
+    return rv
+
+
+def _ignored(path, path_filter):
+    if path_filter is None:
+        return False
+    rule = path_filter.match(path)
+    return rule is not None and not rule.invert
+
+
+def _in_paths(path, paths):
+    return any(path == item or path.startswith(item + "/") for item in paths)
+
+
+class FileHashes(object):
+    """SHA-1 hashes of files, which are only reread when their modification
+    time or size has changed since they were last hashed.
+
+    :param root: Directory the paths are relative to
+    :param entries: Dict of path to [mtime, size, hash] from a previous run
+    """
+
+    def __init__(self, root, entries=None):
+        self.root = root
+        self.entries = entries if entries is not None else {}
+
+    def stat(self, path):
+        try:
+            return os.stat(os.path.join(self.root, path))
+        except OSError:
+            return None
+
+    def get(self, path):
+        """Get the hash of the file at path, or None if it doesn't exist"""
+        stat = self.stat(path)
+        if stat is None:
+            self.entries.pop(path, None)
+            return None
+        entry = self.entries.get(path)
+        if entry is not None and entry[:2] == [stat.st_mtime, stat.st_size]:
+            return entry[2]
+        with open(os.path.join(self.root, path), "rb") as f:
+            file_hash = hashlib.sha1(f.read()).hexdigest()
+        self.entries[path] = [stat.st_mtime, stat.st_size, file_hash]
+        return file_hash
+
+    def get_all(self, paths):
+        return {path: self.get(path) for path in paths}
+
+
+class BuildState(object):
+    """Hashes of the inputs and outputs of each generator after it last
+    ran, stored in a JSON file.
+
+    :param path: Path of the state file
+    """
+
+    def __init__(self, path, generators=None, files=None):
+        self.path = path
+        self.generators = generators if generators is not None else {}
+        self.files = files if files is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return cls(path)
+        return cls(path, data["generators"], data["files"])
+
+    def write(self):
+        dir_name = os.path.dirname(self.path)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        with open(self.path, "w") as f:
+            json.dump({"generators": self.generators, "files": self.files}, f,
+                      separators=(",", ":"))
+
+
+def default_state_path(root):
+    repo_id = hashlib.sha1(os.path.abspath(root).encode("utf8")).hexdigest()[:16]
+    return wpt_cache_dir("update-built", "%s.json" % repo_id)
+
+
+def generator_files(root, generator):
+    """Get the sets of input and output files of a generator, leaving out
+    files that aren't tracked because they're ignored by git"""
+    path_filter = PathFilter(root)
+    inputs = walk_files(root, generator.inputs, path_filter=path_filter)
+    outputs = walk_files(root, generator.outputs, exclude=generator.inputs,
+                         path_filter=path_filter)
+    return inputs, outputs
+
+
+def is_up_to_date(root, generator, state, hashes):
+    """Check if a generator's inputs and outputs are the same as when it
+    last ran"""
+    recorded = state.generators.get(generator.name)
+    if recorded is None or recorded["command"] != generator.command:
+        return False
+    inputs, outputs = generator_files(root, generator)
+    return (hashes.get_all(inputs) == recorded["inputs"] and
+            hashes.get_all(outputs) == recorded["outputs"])
+
+
+def run_generator(root, generator, hashes):
+    """Run a generator, restoring the modification time of each output
+    that it rewrote with the same content.
+
+    :returns: A tuple of the generator, the command's exit status and
+              output, and a dict of counts of the changed, new, removed
+              and unchanged output files
+    """
+    _, outputs = generator_files(root, generator)
+    before = {}
+    for path in outputs:
+        stat = hashes.stat(path)
+        if stat is not None:
+            before[path] = (hashes.get(path), stat.st_atime, stat.st_mtime)
+
+    logger.info("Running %s generator" % generator.name)
+    proc = subprocess.Popen(generator.command,
+                            cwd=os.path.join(root, generator.cwd),
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    output = proc.communicate()[0]
+
+    _, outputs = generator_files(root, generator)
+    counts = {"changed": 0, "new": 0, "removed": len(set(before) - outputs), "unchanged": 0}
+    for path in outputs:
+        if path not in before:
+            counts["new"] += 1
+            continue
+        old_hash, atime, mtime = before[path]
+        if hashes.get(path) != old_hash:
+            counts["changed"] += 1
+            continue
+        counts["unchanged"] += 1
+        if hashes.stat(path).st_mtime != mtime:
+            os.utime(os.path.join(root, path), (atime, mtime))
+            hashes.entries.pop(path, None)
+    return generator, proc.returncode, output, counts
+
+
+def update_built(root, generators, state_path=None, jobs=1, force=False, names=None):
+    """Run the generators whose inputs or outputs have changed since they
+    last ran.
+
+    :param root: The repository root
+    :param generators: List of Generators
+    :param state_path: Path of the file recording the state after each
+                       generator ran, or None to always run the generators
+    :param jobs: Number of generators to run at once
+    :param force: Run the generators even if they're up to date
+    :param names: Names of the generators to consider, or None for all
+    :returns: True if all the generators that ran succeeded
+    """
+    state = BuildState.load(state_path) if state_path is not None else BuildState(None)
+    hashes = FileHashes(root, state.files)
+
+    if names:
+        generators = [item for item in generators if item.name in names]
+    to_run = []
+    for generator in generators:
+        if not force and is_up_to_date(root, generator, state, hashes):
+            logger.info("%s is up to date" % generator.name)
+        else:
+            to_run.append(generator)
+
+    # Hashes are only updated from the main thread, once each generator
+    # has finished
+    success = True
+    pool = ThreadPool(max(1, min(jobs, len(to_run))))
+    try:
+        results = pool.imap_unordered(lambda generator: run_generator(root, generator,
+                                                                      FileHashes(root, dict(hashes.entries))),
+                                      to_run)
+        for generator, returncode, output, counts in results:
+            if returncode != 0:
+                logger.error("%s generator failed with status %i:\n%s" %
+                             (generator.name, returncode, output.decode("utf8", "replace")))
+                state.generators.pop(generator.name, None)
+                success = False
+                continue
+            logger.info("%s: %i changed, %i new, %i removed, %i unchanged files" %
+                        (generator.name, counts["changed"], counts["new"], counts["removed"],
+                         counts["unchanged"]))
+            inputs, outputs = generator_files(root, generator)
+            state.generators[generator.name] = {"command": generator.command,
+                                                "inputs": hashes.get_all(inputs),
+                                                "outputs": hashes.get_all(outputs)}
+    finally:
+        pool.close()
+        pool.join()
+
+    if state_path is not None:
+        state.files = {path: hashes.entries[path]
+                       for item in state.generators.values()
+                       for key in ("inputs", "outputs")
+                       for path in item[key]
+                       if path in hashes.entries}
+        state.write()
+    return success
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("names", nargs="*",
+                        help="Generators to run (default: all of %s)" %
+                        ", ".join(item.name for item in generators))
+    parser.add_argument("--jobs", "-j", type=int, default=len(generators),
+                        help="Number of generators to run at once")
+    parser.add_argument("--force", action="store_true",
+                        help="Run the generators even if their inputs and outputs are unchanged")
+    parser.add_argument("--state-path", action="store",
+                        help="Path of the file recording the state of each generator "
+                        "(default: %s)" % default_state_path(wpt_root))
+    return parser
+
+
+def run(**kwargs):
+    state_path = kwargs.get("state_path") or default_state_path(wpt_root)
+    if not update_built(wpt_root, generators, state_path, jobs=kwargs["jobs"],
+                        force=kwargs["force"], names=kwargs["names"]):
+        return 1
+    return 0
@@ -34,6 +34,13 @@ class Kwargs(dict):
             logger.info("Set %s to %s" % (desc, value))
 
 
+def wpt_cache_dir(*parts):
+    """Get the path of parts within the per-user wpt cache directory,
+    $XDG_CACHE_HOME/wpt, or ~/.cache/wpt if XDG_CACHE_HOME isn't set."""
+    cache_root = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_root, "wpt", *parts)
+
+
 def call(*args):
     """Log terminal command, invoke it as a subprocess.
 
@@ -1,9 +1,11 @@
 import json
 import os
 import platform
+import shutil
 import signal
 import subprocess
 import sys
+import tempfile
 
 import mozinfo
 import mozleak
@@ -164,6 +166,10 @@ class FirefoxBrowser(Browser):
         self.runner = None
         self.debug_info = debug_info
         self.profile = None
+        # The prefs and certificate database are the same for every start,
+        # so they are only created once and then copied into each new profile
+        self.prefs = None
+        self.cert_db_template = None
         self.symbols_path = symbols_path
         self.stackwalk_binary = stackwalk_binary
         self.ca_certificate_path = ca_certificate_path
@@ -216,9 +222,10 @@ class FirefoxBrowser(Browser):
         if self.chaos_mode_flags is not None:
             env["MOZ_CHAOSMODE"] = str(self.chaos_mode_flags)
 
-        preferences = self.load_prefs()
+        if self.prefs is None:
+            self.prefs = self.load_prefs()
 
-        self.profile = FirefoxProfile(preferences=preferences)
+        self.profile = FirefoxProfile(preferences=self.prefs)
         self.profile.set_preferences({"marionette.port": self.marionette_port,
                                       "dom.disable_open_during_load": False,
                                       "network.dns.localDomains": ",".join(self.config.domains_set),
@@ -364,6 +371,9 @@ class FirefoxBrowser(Browser):
 
     def cleanup(self, force=False):
         self.stop(force)
+        if self.cert_db_template is not None:
+            shutil.rmtree(self.cert_db_template, ignore_errors=True)
+            self.cert_db_template = None
 
     def executor_browser(self):
         assert self.marionette_port is not None
@@ -388,13 +398,27 @@ class FirefoxBrowser(Browser):
                              test=test)
 
     def setup_ssl(self):
-        """Create a certificate database to use in the test profile. This is configured
+        """Copy a certificate database into the test profile. This is configured
         to trust the CA Certificate that has signed the web-platform.test server
         certificate."""
         if self.certutil_binary is None:
             self.logger.info("--certutil-binary not supplied; Firefox will not check certificates")
             return
 
+        if self.cert_db_template is None:
+            cert_db_path = tempfile.mkdtemp(prefix="wpt-certdb-")
+            try:
+                self.create_cert_db(cert_db_path)
+            except Exception:
+                shutil.rmtree(cert_db_path, ignore_errors=True)
+                raise
+            self.cert_db_template = cert_db_path
+
+        for name in os.listdir(self.cert_db_template):
+            shutil.copy2(os.path.join(self.cert_db_template, name), self.profile.profile)
+
+    def create_cert_db(self, cert_db_path):
+        """Create a certificate database in cert_db_path, using certutil"""
         self.logger.info("Setting up ssl")
 
         # Make sure the certutil libraries from the source tree are loaded when using a
@@ -422,13 +446,11 @@ class FirefoxBrowser(Browser):
                                                                stderr=subprocess.STDOUT),
                                        " ".join(cmd))
 
-        pw_path = os.path.join(self.profile.profile, ".crtdbpw")
+        pw_path = os.path.join(cert_db_path, ".crtdbpw")
         with open(pw_path, "w") as f:
             # Use empty password for certificate db
             f.write("\n")
 
-        cert_db_path = self.profile.profile
-
         # Create a new certificate db
         certutil("-N", "-d", cert_db_path, "-f", pw_path)
 
@@ -4,7 +4,6 @@ import multiprocessing
 import signal
 import socket
 import sys
-import time
 
 from mozlog import get_default_logger, handlers, proxy
 
@@ -197,14 +196,22 @@ class TestEnvironment(object):
         return route_builder.get_routes()
 
     def ensure_started(self):
-        # Pause for a while to ensure that the server has a chance to start
-        for _ in xrange(60):
+        # Each server process signals once it is listening, so wait for all
+        # of those signals rather than polling the ports
+        logger = get_default_logger()
+        failed = serve.wait_for_servers(self.servers, timeout=30)
+        for scheme, port, error in failed:
+            logger.critical("Failed to start %s server on port %s:\n%s" %
+                            (scheme, port, error))
+        if not failed:
             failed = self.test_servers()
-            if not failed:
-                return
-            time.sleep(0.5)
-        raise EnvironmentError("Servers failed to start: %s" %
-                               ", ".join("%s:%s" % item for item in failed))
+        if failed:
+            raise EnvironmentError("Servers failed to start: %s" %
+                                   ", ".join("%s:%s" % item[:2] for item in failed))
+        startup_times = [server.startup_time for servers in self.servers.itervalues()
+                         for _, server in servers]
+        if startup_times:
+            logger.info("Servers started in %.2fs" % max(startup_times))
 
     def test_servers(self):
         failed = []
@@ -1,3 +1,4 @@
+import base64
 import hashlib
 import httplib
 import os
@@ -6,7 +7,11 @@ import traceback
 import socket
 import urlparse
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 
+from .. import imagecompare
+from ..screenshotcache import (PersistentScreenshotCache, ScreenshotCache,
+                               SharedScreenshotStore, get_browser_id)
 from ..testrunner import Stop
 from protocol import Protocol, BaseProtocolPart
 
@@ -16,6 +21,11 @@ here = os.path.split(__file__)[0]
 # should force a timeout
 extra_timeout = 5  # seconds
 
+# Number of screenshots, and of images decoded from screenshots, that each
+# reftest executor keeps for comparing and logging differences
+max_kept_screenshots = 16
+max_kept_images = 4
+
 
 def executor_kwargs(test_type, server_config, cache_manager, run_info_data,
                     **kwargs):
@@ -28,7 +38,13 @@ def executor_kwargs(test_type, server_config, cache_manager, run_info_data,
                        "debug_info": kwargs["debug_info"]}
 
     if test_type == "reftest":
-        executor_kwargs["screenshot_cache"] = cache_manager.dict()
+        persistent_cache = None
+        if kwargs.get("reftest_screenshot_cache_dir"):
+            browser_id = get_browser_id(run_info_data, kwargs.get("binary"))
+            persistent_cache = PersistentScreenshotCache(kwargs["reftest_screenshot_cache_dir"],
+                                                         browser_id)
+        executor_kwargs["screenshot_cache"] = ScreenshotCache(SharedScreenshotStore(),
+                                                              persistent_cache)
 
     if test_type == "wdspec":
         executor_kwargs["binary"] = kwargs.get("binary")
@@ -173,7 +189,7 @@ class TestExecutor(object):
 
         self.last_environment = test.environment
 
-        self.runner.send_message("test_ended", test, result)
+        self.runner.send_message("test_ended", test.id, result)
 
     def server_url(self, protocol):
         return "%s://%s:%s" % (protocol,
@@ -224,6 +240,12 @@ class RefTestExecutor(TestExecutor):
 
         self.screenshot_cache = screenshot_cache
 
+    def teardown(self):
+        persistent_cache = getattr(self.screenshot_cache, "persistent", None)
+        if persistent_cache is not None:
+            persistent_cache.log_stats(self.logger)
+        TestExecutor.teardown(self)
+
 
 class RefTestImplementation(object):
     def __init__(self, executor):
@@ -234,7 +256,19 @@ class RefTestImplementation(object):
         # and the screenshot was taken from the cache so that we may
         # retrieve the screenshot from the cache directly in the future
         self.screenshot_cache = self.executor.screenshot_cache
+        # Optional on-disk cache of screenshot hashes from earlier runs, which
+        # is only used for references, not for the test being run
+        self.persistent_cache = getattr(self.screenshot_cache, "persistent", None)
+        self.test = None
         self.message = None
+        # Screenshots taken by this process, keyed like screenshot_cache,
+        # and the images decoded from them, keyed by screenshot hash, so
+        # that differing screenshots can be compared and logged without
+        # taking them again
+        self.screenshots = OrderedDict()
+        self.images = OrderedDict()
+        # Differences found by the last pixel comparison
+        self.diff = None
 
     def setup(self):
         pass
@@ -246,36 +280,124 @@ class RefTestImplementation(object):
     def logger(self):
         return self.executor.logger
 
+    def _remember(self, store, key, value, limit):
+        store.pop(key, None)
+        store[key] = value
+        while len(store) > limit:
+            store.popitem(last=False)
+
     def get_hash(self, test, viewport_size, dpi):
         key = (test.url, viewport_size, dpi)
+        cached = self.screenshot_cache.get(key)
+
+        if cached is None:
+            persistent_key = None
+            hash_value = None
+            if self.persistent_cache is not None and test is not self.test:
+                persistent_key = self.persistent_cache.key(test, viewport_size, dpi)
+                if persistent_key is not None:
+                    hash_value = self.persistent_cache.get(persistent_key)
+
+            if hash_value is not None:
+                screenshot = None
+            else:
+                success, data = self.executor.screenshot(test, viewport_size, dpi)
 
-        if key not in self.screenshot_cache:
-            success, data = self.executor.screenshot(test, viewport_size, dpi)
+                if not success:
+                    return False, data
 
-            if not success:
-                return False, data
+                screenshot = data
+                hash_value = hashlib.sha1(screenshot).hexdigest()
+                self._remember(self.screenshots, key, screenshot, max_kept_screenshots)
 
-            screenshot = data
-            hash_value = hashlib.sha1(screenshot).hexdigest()
+                if persistent_key is not None:
+                    self.persistent_cache.set(persistent_key, hash_value)
 
             self.screenshot_cache[key] = (hash_value, None)
 
             rv = (hash_value, screenshot)
         else:
-            rv = self.screenshot_cache[key]
+            rv = cached
+            if rv[1] is None and key in self.screenshots:
+                rv = (rv[0], self.screenshots[key])
 
         self.message.append("%s %s" % (test.url, rv[0]))
         return True, rv
 
-    def is_pass(self, lhs_hash, rhs_hash, relation):
+    def get_image(self, screenshot):
+        """Get the Image for a base64 encoded PNG screenshot, or None if it
+        can't be decoded"""
+        key = hashlib.sha1(screenshot).hexdigest()
+        image = self.images.get(key)
+        if image is None:
+            try:
+                image = imagecompare.decode_png(base64.b64decode(screenshot))
+            except (TypeError, ValueError) as e:
+                self.logger.warning("Failed to decode screenshot: %s" % e)
+                return None
+        self._remember(self.images, key, image, max_kept_images)
+        return image
+
+    def get_differences(self, nodes, screenshots):
+        """Compare the pixels of the screenshots of nodes, taking any
+        screenshots that are only known by their hash. Returns an
+        imagecompare.ImageDiff, or None if the screenshots can't be
+        compared."""
+        images = []
+        for i, node in enumerate(nodes):
+            if screenshots[i] is None:
+                success, screenshot = self.retake_screenshot(node, self.test.viewport_size,
+                                                             self.test.dpi)
+                if not success:
+                    return None
+                screenshots[i] = screenshot
+            image = self.get_image(screenshots[i])
+            if image is None:
+                return None
+            images.append(image)
+        return imagecompare.compare(*images)
+
+    def is_pass(self, nodes, hashes, screenshots, relation, fuzzy=None):
+        """Check whether the screenshots of the pair of nodes have the
+        relation relation.
+
+        Screenshots with different hashes are compared pixel by pixel when
+        there are allowed differences. With fuzzy ((min, max) max
+        difference, (min, max) total pixels) ranges the screenshots are
+        considered equal if their differences are within the ranges, so
+        identical screenshots only match when both minimums are 0, and
+        without them if no pixels differ. Otherwise they're only compared
+        for a == relation, when NumPy is available, to find identical
+        pixels encoded differently and to report the differences;
+        decoding in pure Python takes too long to do for every failure."""
         assert relation in ("==", "!=")
-        self.message.append("Testing %s %s %s" % (lhs_hash, relation, rhs_hash))
-        return ((relation == "==" and lhs_hash == rhs_hash) or
-                (relation == "!=" and lhs_hash != rhs_hash))
+        self.message.append("Testing %s %s %s" % (hashes[0], relation, hashes[1]))
+        self.diff = None
+        if hashes[0] == hashes[1]:
+            diff = imagecompare.ImageDiff(0, 0, None)
+        elif fuzzy is None and (relation == "!=" or not imagecompare.accelerated):
+            return relation == "!="
+        else:
+            diff = self.get_differences(nodes, screenshots)
+            if diff is None:
+                return relation == "!="
+            self.diff = diff
+
+        if diff.pixels_different:
+            self.message.append("Found %i pixels different, maximum difference per channel %i" %
+                                (diff.pixels_different, diff.max_difference))
+        if fuzzy is not None:
+            (min_max_diff, max_max_diff), (min_pixels, max_pixels) = fuzzy
+            equal = (min_max_diff <= diff.max_difference <= max_max_diff and
+                     min_pixels <= diff.pixels_different <= max_pixels)
+        else:
+            equal = diff.pixels_different == 0
+        return equal if relation == "==" else not equal
 
     def run_test(self, test):
         viewport_size = test.viewport_size
         dpi = test.dpi
+        self.test = test
         self.message = []
 
         # Depth-first search of reference tree, with the goal
@@ -287,6 +409,7 @@ class RefTestImplementation(object):
             screenshots = [None, None]
 
             nodes, relation = stack.pop()
+            fuzzy = test.fuzzy.get(nodes[1].url, test.fuzzy.get(None))
 
             for i, node in enumerate(nodes):
                 success, data = self.get_hash(node, viewport_size, dpi)
@@ -295,7 +418,7 @@ class RefTestImplementation(object):
 
                 hashes[i], screenshots[i] = data
 
-            if self.is_pass(hashes[0], hashes[1], relation):
+            if self.is_pass(nodes, hashes, screenshots, relation, fuzzy):
                 if nodes[1].references:
                     stack.extend(list(((nodes[1], item[0]), item[1]) for item in reversed(nodes[1].references)))
                 else:
@@ -312,10 +435,15 @@ class RefTestImplementation(object):
 
         log_data = [{"url": nodes[0].url, "screenshot": screenshots[0]}, relation,
                     {"url": nodes[1].url, "screenshot": screenshots[1]}]
+        extra = {"reftest_screenshots": log_data}
+        if self.diff is not None:
+            extra["reftest_diff"] = {"max_difference": self.diff.max_difference,
+                                     "pixels_different": self.diff.pixels_different,
+                                     "bounds": self.diff.bounds}
 
         return {"status": "FAIL",
                 "message": "\n".join(self.message),
-                "extra": {"reftest_screenshots": log_data}}
+                "extra": extra}
 
     def retake_screenshot(self, node, viewport_size, dpi):
         success, data = self.executor.screenshot(node, viewport_size, dpi)
@@ -325,6 +453,7 @@ class RefTestImplementation(object):
         key = (node.url, viewport_size, dpi)
         hash_val, _ = self.screenshot_cache[key]
         self.screenshot_cache[key] = hash_val, data
+        self._remember(self.screenshots, key, data, max_kept_screenshots)
         return True, data
 
 
@@ -0,0 +1,291 @@
+"""Pixel comparison of reftest screenshots.
+
+Screenshots are PNG images, which are decoded into Image objects holding
+8-bit RGBA pixel data. The decoder only uses zlib, and handles the
+non-interlaced 8 and 16 bit images that browsers produce; when NumPy is
+available it's used to speed up decoding and comparing the images."""
+
+import struct
+import zlib
+from collections import namedtuple
+from itertools import izip
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Whether decoding and comparing images is fast enough to do for every
+# reftest with differing screenshots, rather than only when needed
+accelerated = numpy is not None
+
+png_signature = b"\x89PNG\r\n\x1a\n"
+
+# Number of channels for each PNG colour type
+channel_counts = {0: 1,  # Greyscale
+                  2: 3,  # RGB
+                  3: 1,  # Palette index
+                  4: 2,  # Greyscale and alpha
+                  6: 4}  # RGBA
+
+
+class ImageDiff(namedtuple("ImageDiff", ["max_difference", "pixels_different", "bounds"])):
+    """Differences between two images.
+
+    :param max_difference: The largest difference in any one channel of any pixel
+    :param pixels_different: The number of pixels with any difference
+    :param bounds: (left, top, right, bottom) bounds of the area containing
+                   differences, with right and bottom exclusive, or None if the
+                   images are the same
+    """
+    __slots__ = ()
+
+
+class Image(object):
+    """Decoded image.
+
+    :param width: Width of the image in pixels
+    :param height: Height of the image in pixels
+    :param pixels: bytearray of RGBA values for each pixel, row by row
+    """
+
+    def __init__(self, width, height, pixels):
+        assert len(pixels) == width * height * 4
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    if pb <= pc:
+        return b
+    return c
+
+
+def _unfilter_row(filter_type, row, prior, bpp):
+    """Reverse the PNG filter of type filter_type for the bytearray row in
+    place, given the already unfiltered row before it"""
+    length = len(row)
+    if filter_type == 0:
+        return
+    elif filter_type == 1:
+        if numpy is not None:
+            # The running sum of each channel wraps around, like the filter
+            data = numpy.frombuffer(row, dtype=numpy.uint8).reshape(-1, bpp)
+            row[:] = numpy.cumsum(data, axis=0, dtype=numpy.uint8).tobytes()
+            return
+        for i in xrange(bpp, length):
+            row[i] = (row[i] + row[i - bpp]) & 0xff
+    elif filter_type == 2:
+        if numpy is not None:
+            row[:] = (numpy.frombuffer(row, dtype=numpy.uint8) +
+                      numpy.frombuffer(prior, dtype=numpy.uint8)).tobytes()
+            return
+        for i in xrange(length):
+            row[i] = (row[i] + prior[i]) & 0xff
+    elif filter_type == 3:
+        # Each byte depends on the unfiltered byte one pixel before it, so
+        # these filters can't be vectorised. Instead each channel is
+        # unfiltered separately, keeping the previous pixel's values in
+        # locals rather than indexing the row.
+        for channel in xrange(bpp):
+            values = []
+            append = values.append
+            left = 0
+            for x, up in izip(row[channel::bpp], prior[channel::bpp]):
+                left = (x + ((left + up) >> 1)) & 0xff
+                append(left)
+            row[channel::bpp] = bytearray(values)
+    elif filter_type == 4:
+        for channel in xrange(bpp):
+            values = []
+            append = values.append
+            left = up_left = 0
+            for x, up in izip(row[channel::bpp], prior[channel::bpp]):
+                # _paeth(left, up, up_left), inlined
+                pa = up - up_left
+                pb = left - up_left
+                pc = pa + pb
+                if pa < 0:
+                    pa = -pa
+                if pb < 0:
+                    pb = -pb
+                if pc < 0:
+                    pc = -pc
+                if pa <= pb and pa <= pc:
+                    left = (x + left) & 0xff
+                elif pb <= pc:
+                    left = (x + up) & 0xff
+                else:
+                    left = (x + up_left) & 0xff
+                append(left)
+                up_left = up
+            row[channel::bpp] = bytearray(values)
+    else:
+        raise ValueError("Unknown PNG filter type %i" % filter_type)
+
+
+def _to_rgba(data, channels, palette, transparency):
+    """Convert unfiltered 8-bit samples with channels samples per pixel
+    to RGBA"""
+    if channels == 4:
+        return data
+    pixel_count = len(data) // channels
+    rv = bytearray(pixel_count * 4)
+    if channels == 3:
+        rv[0::4] = data[0::3]
+        rv[1::4] = data[1::3]
+        rv[2::4] = data[2::3]
+        rv[3::4] = b"\xff" * pixel_count
+    elif channels == 2:
+        rv[0::4] = rv[1::4] = rv[2::4] = data[0::2]
+        rv[3::4] = data[1::2]
+    elif palette is None:
+        rv[0::4] = rv[1::4] = rv[2::4] = data
+        rv[3::4] = b"\xff" * pixel_count
+    else:
+        # Map the palette indices through a translation table per channel
+        if len(palette) % 3:
+            raise ValueError("Invalid PNG palette")
+        entries = len(palette) // 3
+        alpha = bytearray(transparency or b"")[:entries]
+        alpha += b"\xff" * (256 - len(alpha))
+        data = bytes(data)
+        for i in xrange(3):
+            table = bytearray(palette[i::3]) + b"\x00" * (256 - entries)
+            rv[i::4] = data.translate(bytes(table))
+        rv[3::4] = data.translate(bytes(alpha))
+    return rv
+
+
+def decode_png(data):
+    """Decode the PNG image in the string data into an Image.
+
+    Raises ValueError if data isn't a PNG image that can be decoded."""
+    if not data.startswith(png_signature):
+        raise ValueError("Not a PNG image")
+
+    header = None
+    palette = None
+    transparency = None
+    idat = []
+    pos = len(png_signature)
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += length + 12
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif chunk_type == b"PLTE":
+            palette = chunk
+        elif chunk_type == b"tRNS":
+            transparency = chunk
+        elif chunk_type == b"IDAT":
+            idat.append(chunk)
+        elif chunk_type == b"IEND":
+            break
+
+    if header is None or not idat:
+        raise ValueError("Incomplete PNG image")
+    width, height, bit_depth, colour_type, _, _, interlace = header
+    if colour_type not in channel_counts:
+        raise ValueError("Unknown PNG colour type %i" % colour_type)
+    if bit_depth not in (8, 16) or (colour_type == 3 and bit_depth != 8):
+        raise ValueError("Unsupported PNG bit depth %i" % bit_depth)
+    if interlace:
+        raise ValueError("Interlaced PNG images aren't supported")
+    if colour_type == 3 and palette is None:
+        raise ValueError("PNG image has no palette")
+
+    try:
+        raw = zlib.decompress(b"".join(idat))
+    except zlib.error as e:
+        raise ValueError("Invalid PNG image data: %s" % e)
+
+    channels = channel_counts[colour_type]
+    bpp = channels * bit_depth // 8
+    stride = width * bpp
+    if len(raw) < (stride + 1) * height:
+        raise ValueError("Truncated PNG image data")
+
+    samples = bytearray(stride * height)
+    prior = bytearray(stride)
+    for y in xrange(height):
+        start = y * (stride + 1)
+        row = bytearray(raw[start + 1:start + 1 + stride])
+        _unfilter_row(ord(raw[start]), row, prior, bpp)
+        samples[y * stride:(y + 1) * stride] = row
+        prior = row
+
+    if bit_depth == 16:
+        # Keep the most significant byte of each sample
+        samples = samples[0::2]
+
+    return Image(width, height, _to_rgba(samples, channels, palette,
+                                         transparency if colour_type == 3 else None))
+
+
+def _compare_rows(image_0, image_1):
+    stride = image_0.width * 4
+    pixels_0 = image_0.pixels
+    pixels_1 = image_1.pixels
+    max_difference = 0
+    pixels_different = 0
+    left, top, right, bottom = image_0.width, None, 0, 0
+    for y in xrange(image_0.height):
+        start = y * stride
+        row_0 = pixels_0[start:start + stride]
+        row_1 = pixels_1[start:start + stride]
+        if row_0 == row_1:
+            continue
+        if top is None:
+            top = y
+        bottom = y + 1
+        for x in xrange(image_0.width):
+            i = x * 4
+            if row_0[i:i + 4] == row_1[i:i + 4]:
+                continue
+            pixels_different += 1
+            left = min(left, x)
+            right = max(right, x + 1)
+            max_difference = max(max_difference,
+                                 abs(row_0[i] - row_1[i]),
+                                 abs(row_0[i + 1] - row_1[i + 1]),
+                                 abs(row_0[i + 2] - row_1[i + 2]),
+                                 abs(row_0[i + 3] - row_1[i + 3]))
+    return ImageDiff(max_difference, pixels_different, (left, top, right, bottom))
+
+
+def _compare_arrays(image_0, image_1):
+    shape = (image_0.height, image_0.width, 4)
+    data_0 = numpy.frombuffer(image_0.pixels, dtype=numpy.uint8).reshape(shape)
+    data_1 = numpy.frombuffer(image_1.pixels, dtype=numpy.uint8).reshape(shape)
+    difference = numpy.abs(data_0.astype(numpy.int16) - data_1).max(axis=2)
+    ys, xs = numpy.nonzero(difference)
+    return ImageDiff(int(difference.max()), len(xs),
+                     (int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1))
+
+
+def compare(image_0, image_1):
+    """Compare the pixels of two Images, returning an ImageDiff.
+
+    Images of different sizes are treated as differing at every pixel."""
+    if image_0.size != image_1.size:
+        width = max(image_0.width, image_1.width)
+        height = max(image_0.height, image_1.height)
+        return ImageDiff(255, width * height, (0, 0, width, height))
+    if image_0.pixels == image_1.pixels:
+        return ImageDiff(0, 0, None)
+    if numpy is not None:
+        return _compare_arrays(image_0, image_1)
+    return _compare_rows(image_0, image_1)
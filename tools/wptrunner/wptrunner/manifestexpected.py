@@ -82,6 +82,68 @@ def lsan_allowed(node):
     return rv
 
 
+def fuzzy_prop(node):
+    """Fuzzy reftest match.
+
+    This is either a single string or a list of strings, each of the form
+
+      [reference ":"] <prop> ";" <prop>
+      prop = [("maxDifference" | "totalPixels") "="] <digits> ["-" <digits>]
+
+    giving the allowed range of the largest difference in any channel of
+    any pixel, and of the number of pixels that differ, for comparisons
+    with the reference, or with any reference if none is given. Without
+    names, the first prop is maxDifference and the second is totalPixels.
+    A single number allows exactly that value, so for example
+
+      maxDifference=0-2;totalPixels=0-300
+
+    allows up to 300 pixels to differ by at most 2 in each channel.
+
+    Returns a dictionary of {reference or None: ((min max difference,
+    max max difference), (min total pixels, max total pixels))}, with
+    references as written in the metadata, or None if no fuzzy match
+    is set"""
+    try:
+        value = node.get("fuzzy")
+    except KeyError:
+        return None
+    if isinstance(value, (str, unicode)):
+        value = [value]
+    rv = {}
+    for item in value:
+        reference, ranges = parse_fuzzy(item)
+        rv[reference] = ranges
+    return rv
+
+
+def parse_fuzzy(item):
+    """Parse a single fuzzy reftest match string into a (reference, ranges)
+    tuple"""
+    reference = None
+    if ":" in item:
+        reference, item = item.rsplit(":", 1)
+        reference = reference.strip()
+    names = ["maxDifference", "totalPixels"]
+    parts = item.split(";")
+    if len(parts) != 2:
+        raise ValueError("Invalid fuzzy value %s" % item)
+    ranges = {}
+    for i, part in enumerate(parts):
+        if "=" in part:
+            name, part = part.split("=", 1)
+            name = name.strip()
+            if name not in names:
+                raise ValueError("Unknown fuzzy property %s" % name)
+        else:
+            name = names[i]
+        if name in ranges:
+            raise ValueError("Duplicate fuzzy property %s" % name)
+        values = [int(value) for value in part.split("-", 1)]
+        ranges[name] = (values[0], values[-1])
+    return reference, (ranges["maxDifference"], ranges["totalPixels"])
+
+
 class ExpectedManifest(ManifestItem):
     def __init__(self, name, test_path, url_base):
         """Object representing all the tests in a particular manifest
@@ -156,6 +218,10 @@ class ExpectedManifest(ManifestItem):
     def lsan_allowed(self):
         return lsan_allowed(self)
 
+    @property
+    def fuzzy(self):
+        return fuzzy_prop(self)
+
 
 class DirectoryManifest(ManifestItem):
     @property
@@ -190,6 +256,10 @@ class DirectoryManifest(ManifestItem):
     def lsan_allowed(self):
         return lsan_allowed(self)
 
+    @property
+    def fuzzy(self):
+        return fuzzy_prop(self)
+
 
 class TestNode(ManifestItem):
     def __init__(self, name):
@@ -251,6 +321,10 @@ class TestNode(ManifestItem):
     def lsan_allowed(self):
         return lsan_allowed(self)
 
+    @property
+    def fuzzy(self):
+        return fuzzy_prop(self)
+
     def append(self, node):
         """Add a subtest to the current test
 
@@ -281,7 +355,7 @@ class SubtestNode(TestNode):
         return True
 
 
-def get_manifest(metadata_root, test_path, url_base, run_info):
+def get_manifest(metadata_root, test_path, url_base, run_info, cache=None):
     """Get the ExpectedManifest for a particular test path, or None if there is no
     metadata stored for that test path.
 
@@ -290,8 +364,18 @@ def get_manifest(metadata_root, test_path, url_base, run_info):
     :param url_base: Base url for serving the tests in this manifest
     :param run_info: Dictionary of properties of the test run for which the expectation
                      values should be computed.
+    :param cache: Optional MetadataCache for metadata_root
     """
     manifest_path = expected.expected_path(metadata_root, test_path)
+    if cache is not None:
+        ast = cache.get(manifest_path)
+        if ast is None:
+            return None
+        return static.compile_ast(ast,
+                                  run_info,
+                                  data_cls_getter=data_cls_getter,
+                                  test_path=test_path,
+                                  url_base=url_base)
     try:
         with open(manifest_path) as f:
             return static.compile(f,
@@ -303,14 +387,22 @@ def get_manifest(metadata_root, test_path, url_base, run_info):
         return None
 
 
-def get_dir_manifest(path, run_info):
+def get_dir_manifest(path, run_info, cache=None):
     """Get the ExpectedManifest for a particular test path, or None if there is no
     metadata stored for that test path.
 
     :param path: Full path to the ini file
     :param run_info: Dictionary of properties of the test run for which the expectation
                      values should be computed.
+    :param cache: Optional MetadataCache for the metadata root containing path
     """
+    if cache is not None:
+        ast = cache.get(path)
+        if ast is None:
+            return None
+        return static.compile_ast(ast,
+                                  run_info,
+                                  data_cls_getter=lambda x,y: DirectoryManifest)
     try:
         with open(path) as f:
             return static.compile(f,
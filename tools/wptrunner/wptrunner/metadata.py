@@ -1,6 +1,10 @@
+import multiprocessing
 import os
+import re
 import shutil
+import sys
 import tempfile
+import time
 import uuid
 from collections import defaultdict, namedtuple
 
@@ -12,6 +16,7 @@ import wptmanifest
 import wpttest
 from expected import expected_path
 from vcs import git
+from wptmanifest.condition import freeze
 manifest = None  # Module that will be imported relative to test_root
 manifestitem = None
 
@@ -35,13 +40,23 @@ def load_test_manifests(serve_root, test_paths):
 def update_expected(test_paths, serve_root, log_file_names,
                     rev_old=None, rev_new="HEAD", ignore_existing=False,
                     sync_root=None, property_order=None, boolean_properties=None,
-                    stability=None):
+                    stability=None, full=False, processes=None):
     """Update the metadata files for web-platform-tests based on
     the results obtained in a previous run or runs
 
     If stability is not None, assume log_file_names refers to logs from repeated
-    test jobs, disable tests that don't behave as expected on all runs"""
+    test jobs, disable tests that don't behave as expected on all runs
 
+    Unless full is True, only the expectation files for tests with results in
+    the logs are loaded, and only the files whose expectations changed are
+    written. If full is True, every expectation file is loaded and the metadata
+    directory is rewritten, which also removes expectations for tests that no
+    longer exist.
+
+    The logs are read using up to processes worker processes, by default one
+    per CPU."""
+
+    start_time = time.time()
     manifests = load_test_manifests(serve_root, test_paths)
 
     id_test_map = update_from_logs(manifests,
@@ -49,7 +64,9 @@ def update_expected(test_paths, serve_root, log_file_names,
                                    ignore_existing=ignore_existing,
                                    property_order=property_order,
                                    boolean_properties=boolean_properties,
-                                   stability=stability)
+                                   stability=stability,
+                                   full=full,
+                                   processes=processes)
 
     by_test_manifest = defaultdict(list)
     while id_test_map:
@@ -58,7 +75,10 @@ def update_expected(test_paths, serve_root, log_file_names,
 
     for test_manifest, expected in by_test_manifest.iteritems():
         metadata_path = manifests[test_manifest]["metadata_path"]
-        write_changes(metadata_path, expected)
+        if full:
+            write_changes(metadata_path, expected)
+        else:
+            write_modified(metadata_path, expected)
         if stability is not None:
             for tree in expected:
                 if not tree.modified:
@@ -70,9 +90,37 @@ def update_expected(test_paths, serve_root, log_file_names,
                         if test.new_disabled:
                             print "disabled: %s" % test.root.test_path
 
+    log_update_stats(by_test_manifest, time.time() - start_time)
+
     return by_test_manifest
 
 
+def max_rss():
+    """Peak resident memory of this process in MB, or None if unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    if sys.platform == "darwin":
+        return rss / (1024 * 1024)
+    return rss / 1024
+
+
+def log_update_stats(by_test_manifest, elapsed):
+    trees = set()
+    for expected in by_test_manifest.itervalues():
+        trees.update(expected)
+    modified = sum(1 for tree in trees if tree.modified)
+    msg = ("Loaded %i expectation files and updated %i in %.1fs" %
+           (len(trees), modified, elapsed))
+    rss = max_rss()
+    if rss is not None:
+        msg += ", peak memory %i MB" % rss
+    logger.info(msg)
+
+
 def do_delayed_imports(serve_root):
     global manifest, manifestitem
     from manifest import manifest, item as manifestitem
@@ -141,23 +189,133 @@ def update_from_logs(manifests, *log_filenames, **kwargs):
     property_order = kwargs.get("property_order")
     boolean_properties = kwargs.get("boolean_properties")
     stability = kwargs.get("stability")
+    full = kwargs.get("full", False)
+    processes = kwargs.get("processes")
 
-    id_test_map = {}
-
-    for test_manifest, paths in manifests.iteritems():
-        id_test_map.update(create_test_tree(
-            paths["metadata_path"],
-            test_manifest,
-            property_order=property_order,
-            boolean_properties=boolean_properties))
+    loader = TestTreeLoader(manifests,
+                            property_order=property_order,
+                            boolean_properties=boolean_properties)
+    if full:
+        loader.load_all()
 
     updater = ExpectedUpdater(manifests,
-                              id_test_map,
+                              loader.id_test_map,
                               ignore_existing=ignore_existing)
-    for log_filename in log_filenames:
-        with open(log_filename) as f:
-            updater.update_from_log(f)
-    return coalesce_results(id_test_map, stability)
+    # Each summary is applied as soon as it's available, loading the
+    # expectations for any new tests it has results for first
+    for summary in iter_log_summaries(log_filenames, processes):
+        if not full:
+            loader.load(get_test_ids(summary))
+        updater.update_from_summary(summary)
+    return coalesce_results(loader.id_test_map, stability)
+
+
+# Matches the lines of a log with an action that summarize_log keeps
+summary_action_re = re.compile(r'"action":\s*"(?:suite_start|test_start|test_status|test_end|'
+                               r'assertion_count|lsan_leak)"')
+
+
+def summarize_log(log_file):
+    """Reduce a raw log to the results of each test.
+
+    The summary is a list with an entry for each suite_start in the log,
+    of (run_info, tests, lsan_leaks). tests is a dict of test id to a tuple
+    of lists of the (subtest, status) results, the statuses and the
+    assertion counts of that test with that run_info, in log order.
+    lsan_leaks is a list of (dir_id, frames, allowed_match). Results
+    that aren't between a test_start and a test_end for the test are
+    dropped, and lines with other actions, like log messages and process
+    output, aren't decoded at all.
+
+    :param log_file: File object for a log in the raw mozlog format
+    """
+    rv = []
+    tests = None
+    lsan_leaks = None
+    started = set()
+    # Statuses and subtest names repeat across tests and runs, so share
+    # one copy of each string
+    strings = {}
+    shared = strings.setdefault
+    for line in log_file:
+        if not summary_action_re.search(line):
+            continue
+        data = json.loads(line)
+        action = data["action"]
+        if action == "suite_start" or tests is None:
+            tests = {}
+            lsan_leaks = []
+            rv.append((data["run_info"] if action == "suite_start" else None,
+                       tests, lsan_leaks))
+            if action == "suite_start":
+                continue
+        if action == "lsan_leak":
+            lsan_leaks.append((lsan_dir_id(data), data["frames"], data.get("allowed_match")))
+            continue
+
+        test_id = data["test"]
+        if action == "test_start":
+            started.add(test_id)
+            if test_id not in tests:
+                tests[test_id] = ([], [], [])
+            continue
+        if test_id not in started:
+            continue
+        results = tests.get(test_id)
+        if results is None:
+            # The test started before the latest suite_start
+            results = tests[test_id] = ([], [], [])
+        if action == "test_status":
+            results[0].append((shared(data["subtest"], data["subtest"]),
+                               shared(data["status"], data["status"])))
+        elif action == "test_end":
+            # A SKIP status isn't recorded and doesn't end the test
+            if data["status"] != "SKIP":
+                results[1].append(shared(data["status"], data["status"]))
+                started.discard(test_id)
+        elif action == "assertion_count":
+            results[2].append(data["count"])
+    return rv
+
+
+def summarize_log_file(log_filename):
+    with open(log_filename) as f:
+        return summarize_log(f)
+
+
+def iter_log_summaries(log_filenames, processes=None):
+    """Summarize each of the logs at log_filenames, using up to processes
+    worker processes so that large logs are decoded in parallel.
+
+    :returns: An iterator over the summaries in the same order as
+              log_filenames, each produced as soon as its log has been
+              read
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(log_filenames))
+    if processes <= 1:
+        for item in log_filenames:
+            yield summarize_log_file(item)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        for summary in pool.imap(summarize_log_file, log_filenames, chunksize=1):
+            yield summary
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_test_ids(summary):
+    """Get the set of ids of the tests, and of the __dir__ metadata for
+    leak results, that the updater needs expectations for to apply a log
+    summary"""
+    rv = set()
+    for _, tests, lsan_leaks in summary:
+        rv.update(tests.iterkeys())
+        rv.update(item[0] for item in lsan_leaks)
+    return rv
 
 
 def coalesce_results(id_test_map, stability):
@@ -211,31 +369,40 @@ def write_new_expected(metadata_path, expected):
     # Serialize the data back to a file
     for tree in expected:
         if not tree.is_empty:
-            manifest_str = wptmanifest.serialize(tree.node, skip_empty_data=True)
-            assert manifest_str != ""
+            write_expected(metadata_path, tree)
+
+
+def write_modified(metadata_path, expected):
+    """Write the modified expectation files in place, removing those with no
+    remaining expectations"""
+    for tree in expected:
+        if not tree.modified:
+            continue
+        if tree.is_empty:
             path = expected_path(metadata_path, tree.test_path)
-            dir = os.path.split(path)[0]
-            if not os.path.exists(dir):
-                os.makedirs(dir)
-            with open(path, "wb") as f:
-                f.write(manifest_str)
+            if os.path.exists(path):
+                os.unlink(path)
+        else:
+            write_expected(metadata_path, tree)
+
+
+def write_expected(metadata_path, tree):
+    manifest_str = wptmanifest.serialize(tree.node, skip_empty_data=True)
+    assert manifest_str != ""
+    path = expected_path(metadata_path, tree.test_path)
+    dir = os.path.split(path)[0]
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+    with open(path, "wb") as f:
+        f.write(manifest_str)
 
 
 class ExpectedUpdater(object):
     def __init__(self, test_manifests, id_test_map, ignore_existing=False):
         self.id_test_map = id_test_map
         self.ignore_existing = ignore_existing
-        self.run_info = None
-        self.action_map = {"suite_start": self.suite_start,
-                           "test_start": self.test_start,
-                           "test_status": self.test_status,
-                           "test_end": self.test_end,
-                           "assertion_count": self.assertion_count,
-                           "lsan_leak": self.lsan_leak}
         self.tests_visited = {}
 
-        self.test_cache = {}
-
         self.types_by_path = {}
         for manifest in test_manifests.iterkeys():
             for test_type, path, _ in manifest:
@@ -243,124 +410,143 @@ class ExpectedUpdater(object):
                     self.types_by_path[path] = wpttest.manifest_test_cls[test_type]
 
     def update_from_log(self, log_file):
-        self.run_info = None
-        action_map = self.action_map
-        for line in log_file:
-            data = json.loads(line)
-            action = data["action"]
-            if action in action_map:
-                action_map[action](data)
-
-    def suite_start(self, data):
-        self.run_info = data["run_info"]
-
-    def test_start(self, data):
-        test_id = data["test"]
+        self.update_from_summary(summarize_log(log_file))
+
+    def update_from_summary(self, summary):
+        """Apply the results in a log summary from summarize_log"""
+        for run_info, tests, lsan_leaks in summary:
+            if run_info is not None:
+                run_info = freeze(run_info)
+            for test_id, (subtest_results, statuses, assertion_counts) in tests.iteritems():
+                self.test_results(run_info, test_id, subtest_results, statuses, assertion_counts)
+            for dir_id, frames, allowed_match in lsan_leaks:
+                self.lsan_leak(run_info, dir_id, frames, allowed_match)
+
+    def test_results(self, run_info, test_id, subtest_results, statuses, assertion_counts):
         try:
-            expected_node = self.id_test_map[test_id].expected.get_test(test_id)
+            test = self.id_test_map[test_id].expected.get_test(test_id)
         except KeyError:
             print "Test not found %s, skipping" % test_id
             return
-        self.test_cache[test_id] = expected_node
 
         if test_id not in self.tests_visited:
             if self.ignore_existing:
-                expected_node.clear("expected")
+                test.clear("expected")
             self.tests_visited[test_id] = set()
 
-    def test_status(self, data):
-        test_id = data["test"]
-        test = self.test_cache.get(test_id)
-        if test is None:
-            return
         test_cls = self.types_by_path[test.root.test_path]
+        for subtest_name, status in subtest_results:
+            self.tests_visited[test_id].add(subtest_name)
+            subtest = test.get_subtest(subtest_name)
+            subtest.set_result(run_info, test_cls.subtest_result_cls(subtest_name, status, None))
 
-        subtest = test.get_subtest(data["subtest"])
+        for count in assertion_counts:
+            test.set_asserts(run_info, count)
 
-        self.tests_visited[test_id].add(data["subtest"])
+        for status in statuses:
+            test.set_result(run_info, test_cls.result_cls(status, None))
 
-        result = test_cls.subtest_result_cls(
-            data["subtest"],
-            data["status"],
-            None)
+    def lsan_leak(self, run_info, dir_id, frames, allowed_match):
+        expected_node = self.id_test_map[dir_id].expected
 
-        subtest.set_result(self.run_info, result)
+        expected_node.set_lsan(run_info, (frames, allowed_match))
 
-    def test_end(self, data):
-        test_id = data["test"]
-        test = self.test_cache.get(test_id)
-        if test is None:
-            return
-        test_cls = self.types_by_path[test.root.test_path]
 
-        if data["status"] == "SKIP":
-            return
+def lsan_dir_id(data):
+    """Get the id of the __dir__ metadata for an lsan_leak log entry"""
+    dir_path = data.get("scope", "/")
+    dir_id = os.path.join(dir_path, "__dir__").replace(os.path.sep, "/")
+    if dir_id.startswith("/"):
+        dir_id = dir_id[1:]
+    return dir_id
 
-        result = test_cls.result_cls(
-            data["status"],
-            None)
-        test.set_result(self.run_info, result)
-        del self.test_cache[test_id]
 
-    def assertion_count(self, data):
-        test_id = data["test"]
-        test = self.test_cache.get(test_id)
-        if test is None:
-            return
+class TestTreeLoader(object):
+    """Loads the expectation manifests for tests on demand.
 
-        test.set_asserts(self.run_info, data["count"])
+    :param manifests: Dict of test manifest to its paths, as for
+                      update_from_logs
+    :param property_order: Order of the run_info properties used to
+                           group conditions
+    :param boolean_properties: run_info properties that are booleans
+    """
+    exclude_types = frozenset(["stub", "helper", "manual", "support", "conformancechecker"])
 
-    def lsan_leak(self, data):
-        dir_path = data.get("scope", "/")
-        dir_id = os.path.join(dir_path, "__dir__").replace(os.path.sep, "/")
-        if dir_id.startswith("/"):
-            dir_id = dir_id[1:]
-        expected_node = self.id_test_map[dir_id].expected
+    def __init__(self, manifests, property_order=None, boolean_properties=None):
+        self.property_order = property_order
+        self.boolean_properties = boolean_properties
+        # Map of test id to (manifest, test, expectation_data)
+        self.id_test_map = {}
+        # Map of each test and __dir__ id to the manifest, metadata path,
+        # test path and tests of the expectation file it's in
+        self.files = {}
+
+        all_types = [item.item_type for item in manifestitem.__dict__.itervalues()
+                     if type(item) == type and
+                     issubclass(item, manifestitem.ManifestItem) and
+                     item.item_type is not None]
+        include_types = set(all_types) - self.exclude_types
+        for test_manifest, paths in manifests.iteritems():
+            metadata_path = paths["metadata_path"]
+            for _, test_path, tests in test_manifest.itertypes(*include_types):
+                file_info = (test_manifest, metadata_path, test_path, tests)
+                for test in tests:
+                    self.files[test.id] = file_info
+
+                dir_path = os.path.split(test_path)[0].replace(os.path.sep, "/")
+                while True:
+                    if dir_path:
+                        dir_id = dir_path + "/__dir__"
+                    else:
+                        dir_id = "__dir__"
+                    dir_id = (test_manifest.url_base + dir_id).lstrip("/")
+                    if dir_id in self.files:
+                        break
+                    self.files[dir_id] = (test_manifest, metadata_path, dir_id, [])
+                    if not dir_path:
+                        break
+                    dir_path = dir_path.rsplit("/", 1)[0] if "/" in dir_path else ""
+
+    def load(self, test_ids):
+        """Load the expectations for each of test_ids that haven't already
+        been loaded, along with the other tests in the same files"""
+        for test_id in test_ids:
+            if test_id in self.id_test_map or test_id not in self.files:
+                continue
+            test_manifest, metadata_path, test_path, tests = self.files[test_id]
+            expected_data = load_or_create_expected(test_manifest, metadata_path, test_path,
+                                                    tests, self.property_order,
+                                                    self.boolean_properties)
+            item = TestItem(test_manifest, expected_data)
+            if tests:
+                for test in tests:
+                    self.id_test_map[test.id] = item
+            else:
+                self.id_test_map[test_id] = item
 
-        expected_node.set_lsan(self.run_info, (data["frames"], data.get("allowed_match")))
+    def load_all(self):
+        self.load(self.files.iterkeys())
 
 
 def create_test_tree(metadata_path, test_manifest, property_order=None,
-                     boolean_properties=None):
+                     boolean_properties=None, test_ids=None):
     """Create a map of expectation manifests for all tests in test_manifest,
     reading existing manifests under manifest_path
 
+    :param test_ids: Set of test and __dir__ ids to load expectations for,
+                     or None to load expectations for every test. An
+                     expectation file is loaded if any test in its file
+                     is included.
     :returns: A map of test_id to (manifest, test, expectation_data)
     """
-    id_test_map = {}
-    exclude_types = frozenset(["stub", "helper", "manual", "support", "conformancechecker"])
-    all_types = [item.item_type for item in manifestitem.__dict__.itervalues()
-                 if type(item) == type and
-                 issubclass(item, manifestitem.ManifestItem) and
-                 item.item_type is not None]
-    include_types = set(all_types) - exclude_types
-    for _, test_path, tests in test_manifest.itertypes(*include_types):
-        expected_data = load_or_create_expected(test_manifest, metadata_path, test_path, tests,
-                                                property_order, boolean_properties)
-        for test in tests:
-            id_test_map[test.id] = TestItem(test_manifest, expected_data)
-
-        dir_path = os.path.split(test_path)[0].replace(os.path.sep, "/")
-        while True:
-            if dir_path:
-                dir_id = dir_path + "/__dir__"
-            else:
-                dir_id = "__dir__"
-            dir_id = (test_manifest.url_base + dir_id).lstrip("/")
-            if dir_id not in id_test_map:
-                expected_data = load_or_create_expected(test_manifest,
-                                                        metadata_path,
-                                                        dir_id,
-                                                        [],
-                                                        property_order,
-                                                        boolean_properties)
-
-                id_test_map[dir_id] = TestItem(test_manifest, expected_data)
-            if not dir_path:
-                break
-            dir_path = dir_path.rsplit("/", 1)[0] if "/" in dir_path else ""
-
-    return id_test_map
+    loader = TestTreeLoader({test_manifest: {"metadata_path": metadata_path}},
+                            property_order=property_order,
+                            boolean_properties=boolean_properties)
+    if test_ids is None:
+        loader.load_all()
+    else:
+        loader.load(test_ids)
+    return loader.id_test_map
 
 
 def load_or_create_expected(test_manifest, metadata_path, test_path, tests, property_order=None,
@@ -0,0 +1,178 @@
+"""Cache of parsed expectation metadata.
+
+Loading the expectation metadata for a run means looking for an .ini
+file for every test path and parsing each file that exists with the
+wptmanifest parser. MetadataCache lists each metadata directory that
+is looked in once to find its .ini files, so test paths without
+metadata don't cost a failed open(), and keeps the parsed AST of each
+file, keyed by the file's mtime and size, in a file that is reused by
+later runs. The ASTs are stored as nested tuples with marshal, which is
+much faster to load than pickling the node objects, and are only turned
+back into nodes when requested.
+
+Conditional expressions are left in the cached ASTs, so one cache serves
+runs with any run_info. The cache is discarded whenever the wptmanifest
+parser or node classes change."""
+
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import threading
+
+from wptmanifest import node as wptnode, parser as wptparser
+from wptmanifest.parser import parse
+
+
+node_classes = {name: getattr(wptnode, name) for name in dir(wptnode)
+                if isinstance(getattr(wptnode, name), type) and
+                issubclass(getattr(wptnode, name), wptnode.Node)}
+
+
+def cache_version():
+    """
+    Identifier for the format of the cached ASTs, which changes whenever
+    the ASTs produced for a file might have changed: the source of the
+    wptmanifest parser and node modules, or of this module, or the Python
+    version, which determines the marshal format.
+    """
+    rv = hashlib.sha1(sys.version.encode("utf8"))
+    for module in [wptparser, wptnode, sys.modules[__name__]]:
+        path = os.path.splitext(os.path.abspath(module.__file__))[0] + ".py"
+        rv.update(os.path.basename(path).encode("utf8"))
+        with open(path, "rb") as f:
+            rv.update(f.read())
+    return rv.hexdigest()
+
+
+def to_tuple(node):
+    """Convert a wptmanifest AST into nested (class name, data, children)
+    tuples"""
+    return (node.__class__.__name__,
+            node.data,
+            tuple(to_tuple(child) for child in node.children))
+
+
+def from_tuple(item, parent=None, _new=object.__new__, _classes=node_classes):
+    """Build a wptmanifest AST from the output of to_tuple"""
+    cls_name, data, children = item
+    # The node constructors and append() methods check invariants that
+    # already held when the tree was parsed, so bypass them
+    node = _new(_classes[cls_name])
+    node.data = data
+    node.parent = parent
+    node.children = [from_tuple(child, node) for child in children]
+    return node
+
+
+class MetadataCache(object):
+    """Index of the .ini files under a metadata root, with their parsed ASTs.
+
+    :param metadata_root: Absolute path to the root of the metadata directory
+    :param cache_path: Path of the file in which to store the parsed ASTs
+                       between runs, or None to only cache them in memory
+    :param logger: Logger used to report an unreadable cache file
+    """
+    version = cache_version()
+
+    def __init__(self, metadata_root, cache_path=None, logger=None):
+        self.metadata_root = metadata_root
+        self._root_prefix = os.path.join(metadata_root, "")
+        self.cache_path = cache_path
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.dirs = {}
+        self._entries = {}
+        self._modified = False
+        if cache_path is not None:
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "rb") as f:
+                data = marshal.load(f)
+            if data.get("version") != self.version:
+                raise ValueError("Unsupported metadata cache version %s" % data.get("version"))
+            self._entries = data["files"]
+        except (IOError, EOFError, ValueError, TypeError, KeyError, AttributeError) as e:
+            if self.logger is not None:
+                self.logger.warning("Ignoring invalid metadata cache %s: %s" % (self.cache_path, e))
+            self._entries = {}
+
+    def save(self):
+        """Write the cache file, if anything changed, replacing the file
+        atomically"""
+        if self.cache_path is None:
+            return
+        with self.lock:
+            if not self._modified:
+                return
+            # Drop entries for files that have been removed from the
+            # directories that were listed
+            for rel_path in list(self._entries.iterkeys()):
+                rel_dir, file_name = os.path.split(rel_path)
+                names = self.dirs.get(rel_dir)
+                if names is not None and file_name not in names:
+                    del self._entries[rel_path]
+            dir_name = os.path.dirname(self.cache_path)
+            if dir_name and not os.path.exists(dir_name):
+                os.makedirs(dir_name)
+            fd, tmp_path = tempfile.mkstemp(dir=dir_name or None, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    marshal.dump({"version": self.version, "files": self._entries}, f)
+                os.rename(tmp_path, self.cache_path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+            self._modified = False
+
+    def ini_files(self, rel_dir):
+        """Set of the names of the .ini files in the directory rel_dir,
+        relative to the metadata root"""
+        names = self.dirs.get(rel_dir)
+        if names is None:
+            try:
+                names = set(item for item in os.listdir(os.path.join(self.metadata_root, rel_dir))
+                            if item.endswith(".ini"))
+            except OSError:
+                names = set()
+            self.dirs[rel_dir] = names
+        return names
+
+    def _rel_path(self, path):
+        if path.startswith(self._root_prefix):
+            return os.path.normpath(path[len(self._root_prefix):])
+        return os.path.normpath(os.path.relpath(path, self.metadata_root))
+
+    def get(self, path):
+        """Get the AST for the metadata file at the absolute path path, or None
+        if there is no such file"""
+        rel_path = self._rel_path(path)
+        rel_dir, file_name = os.path.split(rel_path)
+        if file_name not in self.ini_files(rel_dir):
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        mtime, size = stat.st_mtime, stat.st_size
+        with self.lock:
+            entry = self._entries.get(rel_path)
+        if entry is not None and entry[0] == mtime and entry[1] == size:
+            return from_tuple(entry[2])
+        with open(path) as f:
+            ast = parse(f)
+        with self.lock:
+            self._entries[rel_path] = (mtime, size, to_tuple(ast))
+            self._modified = True
+        return ast
+
+
+def cache_path(cache_dir, metadata_root):
+    """Path of the cache file to use for metadata_root in cache_dir"""
+    key = hashlib.sha1(os.path.abspath(metadata_root).encode("utf8")).hexdigest()[:16]
+    return os.path.join(cache_dir, "metadata-%s.cache" % key)
@@ -0,0 +1,458 @@
+"""On-disk cache of reference screenshot hashes, shared between runs.
+
+Reftests compare the hash of a screenshot of the test against the hash
+of a screenshot of each of its references, and many reference files are
+shared by dozens of tests. Within a run, screenshot hashes are cached by
+URL, but each run renders every reference again. PersistentScreenshotCache
+keeps the hashes of reference screenshots on disk, keyed by everything
+that could change the rendering that wptrunner knows about: the URL, the
+content of the reference file and of the files it loads, the browser, and
+the viewport size, dpi, protocol and prefs the screenshot is taken with.
+
+Files a reference loads are found by scanning it for src and href
+attributes, CSS url() values and @import rules, following references from
+HTML, SVG, XML and CSS files. References that load something whose content
+can't be known from the files on disk, like a URL with a query string or a
+Python handler, are never cached.
+
+Within a run, the hashes are shared between the test runner processes
+through a SharedScreenshotStore in shared memory."""
+
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import urlparse
+import uuid
+
+# Files that are scanned for the files they load in turn
+scanned_extensions = frozenset([".htm", ".html", ".xht", ".xhtml", ".svg", ".xml", ".css"])
+
+dependency_res = [re.compile(r"""\b(?:src|href)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""",
+                             re.IGNORECASE),
+                  re.compile(r"""\burl\(\s*(?:"([^"]*)"|'([^']*)'|([^\s"')]+))\s*\)""",
+                             re.IGNORECASE),
+                  re.compile(r"""@import\s+(?:"([^"]*)"|'([^']*)'|([^\s"';]+))""",
+                             re.IGNORECASE)]
+
+# Limit on the number of files a reference can depend on for it to be cached
+max_dependencies = 500
+
+
+class Uncacheable(Exception):
+    pass
+
+
+def get_dependency_urls(data):
+    """Get the URLs of the resources loaded by the HTML, SVG or CSS document
+    data, as written in the document"""
+    rv = []
+    for dependency_re in dependency_res:
+        for match in dependency_re.finditer(data):
+            rv.append(next(item for item in match.groups() if item is not None))
+    return rv
+
+
+class PersistentScreenshotCache(object):
+    """Store of screenshot hashes for reference files, in files under path.
+
+    :param path: Directory in which to store the screenshot hashes
+    :param browser_id: String identifying the browser build, such as the
+                       product and version, which is part of every key
+    """
+    version = 1
+
+    def __init__(self, path, browser_id):
+        self.path = path
+        self.browser_id = browser_id
+        self.lock = threading.Lock()
+        # Map of path to ((mtime, size), content hash, dependency URLs)
+        self._files = {}
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+    def __getstate__(self):
+        # The cache is sent to the test runner processes; they rebuild the
+        # lock and their own file hashes
+        return {"path": self.path, "browser_id": self.browser_id}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["browser_id"])
+
+    def _file_info(self, path):
+        stat = os.stat(path)
+        file_id = (stat.st_mtime, stat.st_size)
+        with self.lock:
+            cached = self._files.get(path)
+        if cached is not None and cached[0] == file_id:
+            return cached[1], cached[2]
+        with open(path, "rb") as f:
+            data = f.read()
+        content_hash = hashlib.sha1(data).hexdigest()
+        dependencies = []
+        if os.path.splitext(path)[1].lower() in scanned_extensions:
+            dependencies = get_dependency_urls(data)
+        with self.lock:
+            self._files[path] = (file_id, content_hash, dependencies)
+        return content_hash, dependencies
+
+    def _resolve(self, tests_root, path, dependency_url):
+        """Get the path of the file that dependency_url, found in the file
+        at path, refers to, or None if it isn't loaded from a file"""
+        dependency_url = dependency_url.strip()
+        if not dependency_url or dependency_url.startswith("#"):
+            return None
+        parts = urlparse.urlsplit(dependency_url)
+        if parts.scheme in ("data", "about", "javascript", "mailto"):
+            return None
+        if parts.scheme or parts.netloc or parts.query or "{{" in dependency_url:
+            raise Uncacheable("%s isn't a local file" % dependency_url)
+        url_path = urlparse.unquote(parts.path)
+        if url_path.startswith("/"):
+            if tests_root is None:
+                raise Uncacheable("Can't resolve %s" % dependency_url)
+            rv = os.path.join(tests_root, *url_path.split("/"))
+        else:
+            rv = os.path.join(os.path.dirname(path), *url_path.split("/"))
+        rv = os.path.normpath(rv)
+        if rv.endswith(".py") or ".sub." in os.path.basename(rv) or os.path.isdir(rv):
+            raise Uncacheable("%s is generated by the server" % dependency_url)
+        return rv
+
+    def content_hash(self, abs_path, url):
+        """Hash of the contents of the file at abs_path and every file that
+        it loads, or None if that isn't known
+
+        :param abs_path: Absolute path to a reference file
+        :param url: URL of the reference file, used to find the tests root
+                    for dependencies with an absolute path
+        """
+        url_path = urlparse.urlsplit(url).path
+        if abs_path.replace(os.path.sep, "/").endswith(url_path):
+            tests_root = abs_path[:len(abs_path) - len(url_path)]
+        else:
+            tests_root = None
+
+        if ".sub." in os.path.basename(abs_path):
+            return None
+
+        hashes = {}
+        queue = [abs_path]
+        try:
+            while queue:
+                path = queue.pop()
+                if path in hashes:
+                    continue
+                if len(hashes) >= max_dependencies:
+                    raise Uncacheable("Too many dependencies")
+                if not path.endswith(".headers"):
+                    # The server adds the headers in these files to the response
+                    queue.append(path + ".headers")
+                    queue.append(os.path.join(os.path.dirname(path), "__dir__.headers"))
+                try:
+                    content_hash, dependency_urls = self._file_info(path)
+                except (IOError, OSError):
+                    # Record missing files, so the key changes if they're added
+                    hashes[path] = None
+                    continue
+                hashes[path] = content_hash
+                for dependency_url in dependency_urls:
+                    dependency_path = self._resolve(tests_root, path, dependency_url)
+                    if dependency_path is not None:
+                        queue.append(dependency_path)
+        except Uncacheable:
+            return None
+
+        rv = hashlib.sha1()
+        for path, content_hash in sorted(hashes.iteritems()):
+            rv.update("%s %s\n" % (os.path.relpath(path, os.path.dirname(abs_path)), content_hash))
+        return rv.hexdigest()
+
+    def key(self, test, viewport_size, dpi):
+        """Get the cache key for a screenshot of test, or None if screenshots
+        of the test can't be cached
+
+        :param test: TestDescriptor for a reference
+        """
+        if test.abs_path is None:
+            self.uncacheable += 1
+            return None
+        content_hash = self.content_hash(test.abs_path, test.url)
+        if content_hash is None:
+            self.uncacheable += 1
+            return None
+        environment = test.environment or {}
+        data = [self.version,
+                test.url,
+                content_hash,
+                self.browser_id,
+                viewport_size,
+                dpi,
+                environment.get("protocol"),
+                sorted((environment.get("prefs") or {}).items())]
+        return hashlib.sha1(json.dumps(data)).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """Get the screenshot hash stored for key, or None"""
+        try:
+            with open(self._entry_path(key)) as f:
+                rv = f.read().strip()
+        except IOError:
+            rv = None
+        if rv:
+            self.hits += 1
+            return rv
+        self.misses += 1
+        return None
+
+    def set(self, key, hash_value):
+        """Store the screenshot hash for key, replacing the file atomically so
+        that concurrent test runner processes don't see partial entries"""
+        path = self._entry_path(key)
+        dir_name = os.path.dirname(path)
+        try:
+            if not os.path.exists(dir_name):
+                os.makedirs(dir_name)
+        except OSError:
+            # Another process may have just created it
+            if not os.path.isdir(dir_name):
+                raise
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(hash_value)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def log_stats(self, logger):
+        """Log the hit rate since the last time the stats were logged"""
+        lookups = self.hits + self.misses
+        if lookups or self.uncacheable:
+            logger.info("Reference screenshot cache: %i hits, %i misses (%.0f%% hit rate), "
+                        "%i uncacheable" % (self.hits,
+                                            self.misses,
+                                            100. * self.hits / lookups if lookups else 0,
+                                            self.uncacheable))
+        self.hits = self.misses = self.uncacheable = 0
+
+
+class SharedScreenshotStore(object):
+    """Bounded store of (url, viewport_size, dpi): (screenshot hash,
+    screenshot) in shared memory, for use by all the test runner processes
+    in a run.
+
+    Entries are kept in a set-associative table: each key can be stored in
+    one of ways slots of the set that its digest selects, and adding a key
+    to a full set replaces its least recently used entry. Screenshots are
+    stored in a separate pool of fixed-size blocks, which are reused in least
+    recently used order; screenshots larger than a block are dropped, and
+    read back as None. All access is under a lock shared by the processes,
+    but no data is pickled or sent to another process.
+
+    The memory is shared with the test runner processes when they are
+    forked, or on Windows by name when the store is unpickled in the test
+    runner process.
+
+    :param sets: Number of sets in the table of entries
+    :param ways: Number of entries in each set
+    :param blocks: Number of screenshots that can be stored
+    :param block_size: Maximum size of a screenshot in bytes
+    """
+    # Counter used to order entries by when they were last used
+    header_fmt = ">Q"
+    # Key digest, last used counter, hash length, hash, screenshot block or -1
+    entry_fmt = ">16sQB64si"
+    # Key digest, last used counter, screenshot length
+    block_fmt = ">16sQI"
+    max_hash_length = 64
+
+    def __init__(self, sets=4096, ways=8, blocks=32, block_size=1024 * 1024,
+                 lock=None, tagname=None):
+        self.sets = sets
+        self.ways = ways
+        self.blocks = blocks
+        self.block_size = block_size
+        self.lock = lock if lock is not None else multiprocessing.Lock()
+
+        self.entry_size = struct.calcsize(self.entry_fmt)
+        self.block_header_size = struct.calcsize(self.block_fmt)
+        self.entries_offset = struct.calcsize(self.header_fmt)
+        self.block_headers_offset = self.entries_offset + sets * ways * self.entry_size
+        self.blocks_offset = self.block_headers_offset + blocks * self.block_header_size
+        self.size = self.blocks_offset + blocks * block_size
+
+        # Anonymous shared memory is zero filled, which is an empty store.
+        # Pages are only allocated as they are written to.
+        if sys.platform == "win32":
+            self.tagname = tagname if tagname is not None else "wpt-%s" % uuid.uuid4().hex
+            self.data = mmap.mmap(-1, self.size, tagname=self.tagname)
+        else:
+            self.tagname = None
+            self.data = mmap.mmap(-1, self.size)
+
+    def __getstate__(self):
+        if self.tagname is None:
+            raise TypeError("SharedScreenshotStore can only be shared with forked processes")
+        return {"sets": self.sets, "ways": self.ways, "blocks": self.blocks,
+                "block_size": self.block_size, "lock": self.lock, "tagname": self.tagname}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _digest(self, key):
+        url, viewport_size, dpi = key
+        if isinstance(url, unicode):
+            url = url.encode("utf8")
+        return hashlib.md5("%s %r %r" % (url, viewport_size, dpi)).digest()
+
+    def _next_counter(self):
+        counter, = struct.unpack_from(self.header_fmt, self.data, 0)
+        counter += 1
+        struct.pack_into(self.header_fmt, self.data, 0, counter)
+        return counter
+
+    def _entry_offsets(self, digest):
+        set_index = struct.unpack_from(">I", digest)[0] % self.sets
+        start = self.entries_offset + set_index * self.ways * self.entry_size
+        return xrange(start, start + self.ways * self.entry_size, self.entry_size)
+
+    def _find(self, digest):
+        """Get the offset of the entry for digest, or None"""
+        offsets = self._entry_offsets(digest)
+        start = offsets[0]
+        end = offsets[-1] + self.entry_size
+        offset = self.data.find(digest, start, end)
+        while offset != -1:
+            if (offset - start) % self.entry_size == 0:
+                return offset
+            offset = self.data.find(digest, offset + 1, end)
+        return None
+
+    def _block_offset(self, block):
+        return self.block_headers_offset + block * self.block_header_size
+
+    def _free_block(self, block, digest):
+        offset = self._block_offset(block)
+        if self.data[offset:offset + 16] == digest:
+            struct.pack_into(self.block_fmt, self.data, offset, b"", 0, 0)
+
+    def _read(self, offset):
+        digest, _, hash_length, hash_value, block = struct.unpack_from(self.entry_fmt,
+                                                                       self.data, offset)
+        struct.pack_into(">Q", self.data, offset + 16, self._next_counter())
+        screenshot = None
+        if block >= 0:
+            block_offset = self._block_offset(block)
+            owner, _, length = struct.unpack_from(self.block_fmt, self.data, block_offset)
+            # The block may have been reused for another screenshot since
+            if owner == digest:
+                struct.pack_into(">Q", self.data, block_offset + 16, self._next_counter())
+                start = self.blocks_offset + block * self.block_size
+                screenshot = self.data[start:start + length]
+        return hash_value[:hash_length], screenshot
+
+    def _write_screenshot(self, digest, screenshot):
+        """Store screenshot in the least recently used block, returning the
+        block, or -1 if it's too large to store"""
+        if len(screenshot) > self.block_size:
+            return -1
+        block = min(xrange(self.blocks),
+                    key=lambda item: struct.unpack_from(">Q", self.data,
+                                                        self._block_offset(item) + 16)[0])
+        struct.pack_into(self.block_fmt, self.data, self._block_offset(block),
+                         digest, self._next_counter(), len(screenshot))
+        start = self.blocks_offset + block * self.block_size
+        self.data[start:start + len(screenshot)] = screenshot
+        return block
+
+    def __contains__(self, key):
+        digest = self._digest(key)
+        with self.lock:
+            return self._find(digest) is not None
+
+    def __getitem__(self, key):
+        digest = self._digest(key)
+        with self.lock:
+            offset = self._find(digest)
+            if offset is None:
+                raise KeyError(key)
+            return self._read(offset)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        hash_value, screenshot = value
+        if len(hash_value) > self.max_hash_length:
+            raise ValueError("Screenshot hash %s is too long" % hash_value)
+        digest = self._digest(key)
+        with self.lock:
+            offset = self._find(digest)
+            if offset is None:
+                # Replace the least recently used entry in the set
+                offset = min(self._entry_offsets(digest),
+                             key=lambda item: struct.unpack_from(">Q", self.data, item + 16)[0])
+            old_digest, _, _, _, old_block = struct.unpack_from(self.entry_fmt, self.data, offset)
+            if old_block >= 0:
+                self._free_block(old_block, old_digest)
+            block = -1
+            if screenshot is not None:
+                block = self._write_screenshot(digest, screenshot)
+            struct.pack_into(self.entry_fmt, self.data, offset, digest, self._next_counter(),
+                             len(hash_value), hash_value, block)
+
+
+class ScreenshotCache(object):
+    """Cache of (url, viewport_size, dpi): (screenshot hash, screenshot) for a
+    run, shared between the test runner processes.
+
+    :param run_cache: Dictionary, or SharedScreenshotStore, holding the
+                      cached screenshots
+    :param persistent: PersistentScreenshotCache to look up screenshot hashes
+                       from earlier runs in, or None
+    """
+
+    def __init__(self, run_cache, persistent=None):
+        self.run_cache = run_cache
+        self.persistent = persistent
+
+    def __contains__(self, key):
+        return key in self.run_cache
+
+    def __getitem__(self, key):
+        return self.run_cache[key]
+
+    def get(self, key, default=None):
+        return self.run_cache.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.run_cache[key] = value
+
+
+def get_browser_id(run_info, binary=None):
+    """String identifying the browser for run_info and binary, which is
+    part of every key in a PersistentScreenshotCache"""
+    rv = [run_info.get("product"), run_info.get("browser_version")]
+    if binary is not None and os.path.exists(binary):
+        # Without a version, a rebuilt browser at the same path is only
+        # distinguished by its file
+        stat = os.stat(binary)
+        rv.extend([os.path.abspath(binary), stat.st_mtime, stat.st_size])
+    for key in ["os", "version", "processor", "bits", "debug"]:
+        rv.append(run_info.get(key))
+    return json.dumps(rv)
@@ -1,16 +1,18 @@
 import hashlib
 import json
 import os
+import threading
 import urlparse
 from abc import ABCMeta, abstractmethod
 from Queue import Empty
 from collections import defaultdict, OrderedDict, deque
-from multiprocessing import Queue
 
 import manifestinclude
 import manifestexpected
+import metadatacache
 import wpttest
 from mozlog import structured
+from wptmanifest.condition import freeze
 
 manifest = None
 manifest_update = None
@@ -27,9 +29,10 @@ def do_delayed_imports():
 
 
 class TestChunker(object):
-    def __init__(self, total_chunks, chunk_number):
+    def __init__(self, total_chunks, chunk_number, durations=None):
         self.total_chunks = total_chunks
         self.chunk_number = chunk_number
+        self.durations = durations
         assert self.chunk_number <= self.total_chunks
         self.logger = structured.get_default_logger()
         assert self.logger
@@ -72,6 +75,31 @@ class DirectoryHashChunker(TestChunker):
 
 
 class EqualTimeChunker(TestChunker):
+    def _test_time(self, test, default_duration):
+        """Estimated time to run a test; the recorded duration if there is
+        one, otherwise the test's timeout, scaled by default_duration if
+        that is not None"""
+        if self.durations and test.id in self.durations:
+            return self.durations[test.id]
+        time = test.default_timeout if test.timeout != "long" else test.long_timeout
+        if default_duration is not None:
+            time *= float(default_duration) / test.default_timeout
+        return time
+
+    def _default_duration(self, manifest_items):
+        """Mean recorded duration of the tests in manifest_items, used to
+        estimate the duration of tests with no timing data, or None if there
+        is no timing data for any of the tests"""
+        if not self.durations:
+            return None
+        known = [self.durations[test.id]
+                 for _, _, tests in manifest_items
+                 for test in tests
+                 if test.id in self.durations]
+        if not known:
+            return None
+        return float(sum(known)) / len(known)
+
     def _group_by_directory(self, manifest_items):
         """Split the list of manifest items into a ordered dict that groups tests in
         so that anything in the same subdirectory beyond a depth of 3 is in the same
@@ -89,6 +117,7 @@ class EqualTimeChunker(TestChunker):
 
         by_dir = OrderedDict()
         total_time = 0
+        default_duration = self._default_duration(manifest_items)
 
         for i, (test_type, test_path, tests) in enumerate(manifest_items):
             test_dir = tuple(os.path.split(test_path)[0].split(os.path.sep)[:3])
@@ -97,8 +126,7 @@ class EqualTimeChunker(TestChunker):
                 by_dir[test_dir] = PathData(test_dir)
 
             data = by_dir[test_dir]
-            time = sum(test.default_timeout if test.timeout !=
-                       "long" else test.long_timeout for test in tests)
+            time = sum(self._test_time(test, default_duration) for test in tests)
             data.time += time
             total_time += time
             data.tests.append((test_type, test_path, tests))
@@ -208,8 +236,30 @@ class EqualTimeChunker(TestChunker):
 
         assert self._all_tests(by_dir) == self._chunked_tests(chunks)
 
+        self._log_balance(manifest_items, chunks)
+
         return self._get_tests(chunks)
 
+    def _log_balance(self, manifest_items, chunks):
+        """Log the estimated duration of each chunk, and how much of the
+        estimate is based on recorded timing data"""
+        test_ids = set(test.id for _, _, tests in manifest_items for test in tests)
+        if self.durations:
+            known = len(test_ids & set(self.durations.iterkeys()))
+        else:
+            known = 0
+        self.logger.info("Chunk estimates use timing data for %i/%i tests" %
+                         (known, len(test_ids)))
+        for i, chunk in chunks.iteritems():
+            count = sum(len(tests) for path in chunk.paths for _, _, tests in path.tests)
+            self.logger.info("Chunk %i%s: %i tests, estimated %.0fs" %
+                             (i + 1, " (this chunk)" if i + 1 == self.chunk_number else "",
+                              count, chunk.time))
+        if self.expected_time:
+            max_time = max(chunk.time for chunk in chunks.itervalues())
+            self.logger.info("Chunk balance: longest chunk is %.2fx the mean" %
+                             (max_time / self.expected_time))
+
     @staticmethod
     def _all_tests(by_dir):
         """Return a set of all tests in the manifest from a grouping by directory"""
@@ -467,10 +517,14 @@ class TestLoader(object):
                  total_chunks=1,
                  chunk_number=1,
                  include_https=True,
-                 skip_timeout=False):
+                 skip_timeout=False,
+                 durations=None,
+                 metadata_cache_dir=None):
 
         self.test_types = test_types
         self.run_info = run_info
+        # Shared by all the metadata files so condition results are memoised
+        self.metadata_run_info = freeze(run_info)
 
         self.manifest_filters = manifest_filters if manifest_filters is not None else []
         self.meta_filters = meta_filters if meta_filters is not None else []
@@ -489,13 +543,20 @@ class TestLoader(object):
                         "hash": HashChunker,
                         "dir_hash": DirectoryHashChunker,
                         "equal_time": EqualTimeChunker}[chunk_type](total_chunks,
-                                                                    chunk_number)
+                                                                    chunk_number,
+                                                                    durations=durations)
 
         self._test_ids = None
 
         self.directory_manifests = {}
 
+        # Parsed expectation metadata for each metadata path. With a
+        # metadata_cache_dir the parsed files are kept for later runs.
+        self.metadata_cache_dir = metadata_cache_dir
+        self.metadata_caches = {}
+
         self._load_tests()
+        self.save_metadata_caches()
 
     @property
     def test_ids(self):
@@ -513,14 +574,34 @@ class TestLoader(object):
 
         return wpttest.from_manifest(manifest_test, inherit_metadata, test_metadata)
 
+    def get_metadata_cache(self, metadata_path):
+        if metadata_path not in self.metadata_caches:
+            cache_path = None
+            if self.metadata_cache_dir is not None:
+                cache_path = metadatacache.cache_path(self.metadata_cache_dir, metadata_path)
+            self.metadata_caches[metadata_path] = metadatacache.MetadataCache(
+                metadata_path, cache_path, structured.get_default_logger())
+        return self.metadata_caches[metadata_path]
+
+    def save_metadata_caches(self):
+        for cache in self.metadata_caches.itervalues():
+            try:
+                cache.save()
+            except (IOError, OSError) as e:
+                logger = structured.get_default_logger()
+                if logger is not None:
+                    logger.warning("Failed to write metadata cache %s: %s" % (cache.cache_path, e))
+
     def load_dir_metadata(self, test_manifest, metadata_path, test_path):
         rv = []
+        cache = self.get_metadata_cache(metadata_path)
         path_parts = os.path.dirname(test_path).split(os.path.sep)
         for i in xrange(len(path_parts) + 1):
             path = os.path.join(metadata_path, os.path.sep.join(path_parts[:i]), "__dir__.ini")
             if path not in self.directory_manifests:
                 self.directory_manifests[path] = manifestexpected.get_dir_manifest(path,
-                                                                                   self.run_info)
+                                                                                   self.metadata_run_info,
+                                                                                   cache=cache)
             manifest = self.directory_manifests[path]
             if manifest is not None:
                 rv.append(manifest)
@@ -529,7 +610,8 @@ class TestLoader(object):
     def load_metadata(self, test_manifest, metadata_path, test_path):
         inherit_metadata = self.load_dir_metadata(test_manifest, metadata_path, test_path)
         test_metadata = manifestexpected.get_manifest(
-            metadata_path, test_path, test_manifest.url_base, self.run_info)
+            metadata_path, test_path, test_manifest.url_base, self.metadata_run_info,
+            cache=self.get_metadata_cache(metadata_path))
         return inherit_metadata, test_metadata
 
     def iter_tests(self):
@@ -584,6 +666,68 @@ class TestLoader(object):
         return groups
 
 
+class TestQueue(object):
+    """Queue of (tests, metadata) groups shared by the TestRunnerManagers.
+
+    Groups are handed out in order. Once every group has been handed
+    out, a manager asking for more work is given the in-progress group
+    with the most tests remaining, and takes tests from the same deque
+    as the manager already running that group. This stops one long group
+    leaving the other managers idle at the end of a run.
+
+    The managers are threads in the same process, so the tests are not
+    copied."""
+
+    def __init__(self, groups, steal=True):
+        self._lock = threading.Lock()
+        self._pending = deque(groups)
+        self._active = []
+        self.steal = steal
+
+    def get(self, block=False):
+        with self._lock:
+            while self._pending:
+                group, metadata = self._pending.popleft()
+                if group:
+                    self._active.append((group, metadata))
+                    return group, metadata
+            if self.steal:
+                self._active = [item for item in self._active if item[0]]
+                if self._active:
+                    return max(self._active, key=lambda item: len(item[0]))
+            raise Empty
+
+    def empty(self):
+        with self._lock:
+            return (not any(group for group, _ in self._pending) and
+                    not (self.steal and any(group for group, _ in self._active)))
+
+
+def estimate_duration(test, durations=None):
+    """Estimated time in seconds to run a test, from a mapping of test id
+    to previously measured duration if one is available, or otherwise
+    from its timeout"""
+    if durations and test.id in durations:
+        return durations[test.id]
+    return test.timeout
+
+
+def order_groups(groups, durations=None):
+    """Sort a list of (tests, metadata) groups so that the groups expected to
+    take longest come first, and the tests within each group likewise.
+    The sort is stable so, in the absence of timing data, tests with the
+    same timeout stay in manifest order."""
+    def key(test):
+        return -estimate_duration(test, durations)
+
+    rv = []
+    for group, metadata in groups:
+        tests = sorted(group, key=key)
+        rv.append((sum(key(test) for test in tests), deque(tests), metadata))
+    rv.sort(key=lambda item: item[0])
+    return [(group, metadata) for _, group, metadata in rv]
+
+
 class TestSource(object):
     __metaclass__ = ABCMeta
 
@@ -618,7 +762,6 @@ class GroupedSource(TestSource):
 
     @classmethod
     def make_queue(cls, tests, **kwargs):
-        test_queue = Queue()
         groups = []
 
         state = {}
@@ -632,29 +775,21 @@ class GroupedSource(TestSource):
             group.append(test)
             test.update_metadata(metadata)
 
-        for item in groups:
-            test_queue.put(item)
-        return test_queue
+        return TestQueue(order_groups(groups, kwargs.get("durations")))
 
 
 class SingleTestSource(TestSource):
     @classmethod
     def make_queue(cls, tests, **kwargs):
-        test_queue = Queue()
-        processes = kwargs["processes"]
-        queues = [deque([]) for _ in xrange(processes)]
-        metadatas = [cls.group_metadata(None) for _ in xrange(processes)]
+        # All the tests are in a single group that every manager takes
+        # tests from, so work is balanced without restarting browsers
+        metadata = cls.group_metadata(None)
+        group = deque()
         for test in tests:
-            idx = hash(test.id) % processes
-            group = queues[idx]
-            metadata = metadatas[idx]
             group.append(test)
             test.update_metadata(metadata)
 
-        for item in zip(queues, metadatas):
-            test_queue.put(item)
-
-        return test_queue
+        return TestQueue(order_groups([(group, metadata)], kwargs.get("durations")))
 
 
 class PathGroupedSource(GroupedSource):
@@ -2,9 +2,11 @@ from __future__ import unicode_literals
 
 import multiprocessing
 import threading
+import time
 import traceback
 from Queue import Empty
 from collections import namedtuple
+from contextlib import contextmanager
 from multiprocessing import Process, current_process, Queue
 
 from mozlog import structuredlog
@@ -239,6 +241,44 @@ class BrowserManager(object):
         return self.browser.is_alive()
 
 
+class SpareRunner(object):
+    """A browser and TestRunner process that are started in the background
+    while the active ones run tests, so that a restart only has to wait for
+    the active browser to stop.
+
+    The spare has its own queues; when it is swapped in its BrowserManager,
+    queues and runner process become the active ones and the previously
+    active ones become the next spare.
+
+    The browser and runner are launched on start_thread, so the other
+    attributes must not be used until that thread has been joined."""
+
+    def __init__(self, browser, command_queue, remote_queue):
+        self.browser = browser
+        self.command_queue = command_queue
+        self.remote_queue = remote_queue
+        self.start_thread = None
+        self.test_runner_proc = None
+        self.group_metadata = None
+        # Set once the runner has reported init_succeeded
+        self.ready = False
+        self.failed = False
+
+    @property
+    def started(self):
+        return self.test_runner_proc is not None
+
+    def matches(self, test, group_metadata):
+        """Check whether the spare can be used to run test as part of a group
+        with group_metadata"""
+        return (self.started and
+                not self.failed and
+                self.test_runner_proc.is_alive() and
+                self.group_metadata == group_metadata and
+                self.browser.browser_settings == self.browser.browser.settings(test) and
+                test.expected() != "CRASH")
+
+
 class _RunnerManagerState(object):
     before_init = namedtuple("before_init", [])
     initializing = namedtuple("initializing_browser",
@@ -255,7 +295,8 @@ RunnerManagerState = _RunnerManagerState()
 class TestRunnerManager(threading.Thread):
     def __init__(self, suite_name, test_queue, test_source_cls, browser_cls, browser_kwargs,
                  executor_cls, executor_kwargs, stop_flag, rerun=1, pause_after_test=False,
-                 pause_on_unexpected=False, restart_on_unexpected=True, debug_info=None):
+                 pause_on_unexpected=False, restart_on_unexpected=True, debug_info=None,
+                 spare_browser=False):
         """Thread that owns a single TestRunner process and any processes required
         by the TestRunner (e.g. the Firefox binary).
 
@@ -270,6 +311,11 @@ class TestRunnerManager(threading.Thread):
         * Log the test results
         * Take any remedial action required e.g. restart crashed or hung
           processes
+
+        With spare_browser set, a second browser and TestRunner are started
+        on a helper thread once a test has been sent to the active runner, so
+        that restarts can swap to them rather than waiting for a new browser
+        to start.
         """
         self.suite_name = suite_name
 
@@ -291,6 +337,7 @@ class TestRunnerManager(threading.Thread):
         self.pause_on_unexpected = pause_on_unexpected
         self.restart_on_unexpected = restart_on_unexpected
         self.debug_info = debug_info
+        self.spare_browser = spare_browser
 
         self.manager_number = next_manager_number()
 
@@ -298,6 +345,10 @@ class TestRunnerManager(threading.Thread):
         self.remote_queue = Queue()
 
         self.test_runner_proc = None
+        self.spare = None
+        # Set when the spare was swapped in before its runner reported that
+        # it had started
+        self.spare_swapped = False
 
         threading.Thread.__init__(self, name="Thread-TestrunnerManager-%i" % self.manager_number)
         # This is started in the actual new thread
@@ -306,6 +357,16 @@ class TestRunnerManager(threading.Thread):
         self.test_count = 0
         self.unexpected_count = 0
 
+        # Used to report how long the manager was idle at the end of the run
+        self.started_at = None
+        self.finished_at = None
+
+        # Counters for the restart report at the end of the run
+        self.restart_count = 0
+        self.spare_count = 0
+        self.startup_time = 0
+        self.init_started_at = None
+
         # This may not really be what we want
         self.daemon = True
 
@@ -322,11 +383,21 @@ class TestRunnerManager(threading.Thread):
         that the manager should shut down the next time the event loop
         spins."""
         self.logger = structuredlog.StructuredLogger(self.suite_name)
-        with self.browser_cls(self.logger, **self.browser_kwargs) as browser:
+        self.started_at = time.time()
+        spare_context = self.make_spare_browser()
+        with self.browser_cls(self.logger, **self.browser_kwargs) as browser, spare_context as spare_browser:
             self.browser = BrowserManager(self.logger,
                                           browser,
                                           self.command_queue,
                                           no_timeout=self.debug_info is not None)
+            if spare_browser is not None:
+                command_queue = Queue()
+                self.spare = SpareRunner(BrowserManager(self.logger,
+                                                        spare_browser,
+                                                        command_queue,
+                                                        no_timeout=self.debug_info is not None),
+                                         command_queue,
+                                         Queue())
             dispatch = {
                 RunnerManagerState.before_init: self.start_init,
                 RunnerManagerState.initializing: self.init,
@@ -367,10 +438,23 @@ class TestRunnerManager(threading.Thread):
             finally:
                 self.logger.debug("TestRunnerManager main loop terminating, starting cleanup")
                 clean = isinstance(self.state, RunnerManagerState.stop)
+                if self.finished_at is None:
+                    self.finished_at = time.time()
                 self.stop_runner(force=not clean)
+                self.stop_spare(force=not clean)
                 self.teardown()
         self.logger.debug("TestRunnerManager main loop terminated")
 
+    @contextmanager
+    def make_spare_browser(self):
+        """Context manager for the browser used by the spare runner, which
+        is None if spare browsers aren't enabled"""
+        if not self.spare_browser:
+            yield None
+            return
+        with self.browser_cls(self.logger, **self.browser_kwargs) as browser:
+            yield browser
+
     def wait_event(self):
         dispatch = {
             RunnerManagerState.before_init: {},
@@ -393,6 +477,7 @@ class TestRunnerManager(threading.Thread):
                 "error": self.error
             }
         }
+        self.poll_spare()
         try:
             command, data = self.command_queue.get(True, 1)
             self.logger.debug("Got command: %r" % command)
@@ -449,6 +534,13 @@ class TestRunnerManager(threading.Thread):
             self.logger.error("Max restarts exceeded")
             return RunnerManagerState.error()
 
+        self.init_started_at = time.time()
+        if self.spare_swapped:
+            # The browser and runner were started as the spare; wait for the
+            # runner to report that it is ready
+            self.spare_swapped = False
+            return
+
         self.browser.update_settings(self.state.test)
 
         result = self.browser.init(self.state.group_metadata)
@@ -471,25 +563,35 @@ class TestRunnerManager(threading.Thread):
         assert self.command_queue is not None
         assert self.remote_queue is not None
         self.logger.info("Starting runner")
-        executor_browser_cls, executor_browser_kwargs = self.browser.browser.executor_browser()
+        self.test_runner_proc = self.start_runner_process(self.browser,
+                                                          self.remote_queue,
+                                                          self.command_queue,
+                                                          self.executor_kwargs)
+        self.logger.debug("Test runner started")
+        # Now we wait for either an init_succeeded event or an init_failed event
+
+    def start_runner_process(self, browser, remote_queue, command_queue, executor_kwargs):
+        executor_browser_cls, executor_browser_kwargs = browser.browser.executor_browser()
 
-        args = (self.remote_queue,
-                self.command_queue,
+        args = (remote_queue,
+                command_queue,
                 self.executor_cls,
-                self.executor_kwargs,
+                executor_kwargs,
                 executor_browser_cls,
                 executor_browser_kwargs,
                 self.child_stop_flag)
-        self.test_runner_proc = Process(target=start_runner,
-                                        args=args,
-                                        name="Thread-TestRunner-%i" % self.manager_number)
-        self.test_runner_proc.start()
-        self.logger.debug("Test runner started")
-        # Now we wait for either an init_succeeded event or an init_failed event
+        proc = Process(target=start_runner,
+                       args=args,
+                       name="Thread-TestRunner-%i" % self.manager_number)
+        proc.start()
+        return proc
 
     def init_succeeded(self):
         assert isinstance(self.state, RunnerManagerState.initializing)
         self.browser.after_init()
+        if self.init_started_at is not None:
+            self.startup_time += time.time() - self.init_started_at
+            self.init_started_at = None
         return RunnerManagerState.running(self.state.test,
                                           self.state.test_group,
                                           self.state.group_metadata)
@@ -510,8 +612,13 @@ class TestRunnerManager(threading.Thread):
                 test_group, group_metadata = self.test_source.group()
                 if test_group is None:
                     self.logger.info("No more tests")
+                    self.finished_at = time.time()
                     return None, None, None
-            test = test_group.popleft()
+            try:
+                test = test_group.popleft()
+            except IndexError:
+                # Another manager took the last test in a shared group
+                test_group = None
         self.run_count = 0
         return test, test_group, group_metadata
 
@@ -529,16 +636,22 @@ class TestRunnerManager(threading.Thread):
         if self.rerun > 1:
             self.logger.info("Run %d/%d" % (self.run_count, self.rerun))
         self.run_count += 1
-        self.send_message("run_test", self.state.test)
-
-    def test_ended(self, test, results):
+        # The runner only gets a TestDescriptor; the full Test, with its
+        # expectation metadata, stays in this process
+        self.send_message("run_test", self.state.test.descriptor)
+        # Only start the spare now, so that its startup doesn't delay the
+        # first test run by a new browser
+        self.start_spare()
+
+    def test_ended(self, test_id, results):
         """Handle the end of a test.
 
         Output the result of each subtest, and the result of the overall
         harness to the logs.
         """
         assert isinstance(self.state, RunnerManagerState.running)
-        assert test == self.state.test
+        assert test_id == self.state.test.id
+        test = self.state.test
         # Write the result of each subtest
         file_result, test_results = results
         subtest_unexpected = False
@@ -624,7 +737,7 @@ class TestRunnerManager(threading.Thread):
             test, test_group, group_metadata = self.get_next_test()
             if test is None:
                 return RunnerManagerState.stop()
-            if test_group != self.state.test_group:
+            if test_group is not self.state.test_group:
                 # We are starting a new group of tests, so force a restart
                 restart = True
         else:
@@ -639,9 +752,145 @@ class TestRunnerManager(threading.Thread):
     def restart_runner(self):
         """Stop and restart the TestRunner"""
         assert isinstance(self.state, RunnerManagerState.restarting)
+        self.restart_count += 1
         self.stop_runner()
+        self.wait_spare_started()
+        if self.spare is not None:
+            if self.spare.started:
+                if self.spare.matches(self.state.test, self.state.group_metadata):
+                    return self.swap_spare()
+                self.logger.debug("Spare browser doesn't match the next test, stopping it")
+                self.stop_spare()
+            # A spare that failed to start is tried again after each restart
+            self.spare.failed = False
         return RunnerManagerState.initializing(self.state.test, self.state.test_group, self.state.group_metadata, 0)
 
+    def start_spare(self):
+        """Start the spare browser and TestRunner on a helper thread, with
+        the settings for the current test, if spare browsers are enabled and
+        one isn't already running or starting."""
+        spare = self.spare
+        if (spare is None or spare.started or spare.start_thread is not None or
+            spare.failed):
+            return
+        self.logger.debug("Starting spare browser")
+        group_metadata = self.state.group_metadata
+        executor_kwargs = dict(self.executor_kwargs, group_metadata=group_metadata)
+        spare.start_thread = threading.Thread(target=self.launch_spare,
+                                              args=(self.state.test, group_metadata,
+                                                    executor_kwargs),
+                                              name="Thread-SpareBrowser-%i" % self.manager_number)
+        spare.start_thread.start()
+
+    def launch_spare(self, test, group_metadata, executor_kwargs):
+        """Start the spare browser and its TestRunner process. This runs on
+        the spare's start_thread."""
+        spare = self.spare
+        try:
+            spare.browser.update_settings(test)
+            if not spare.browser.init(group_metadata):
+                spare.browser.stop(force=True)
+                spare.failed = True
+                return
+            spare.group_metadata = group_metadata
+            spare.ready = False
+            spare.test_runner_proc = self.start_runner_process(spare.browser,
+                                                               spare.remote_queue,
+                                                               spare.command_queue,
+                                                               executor_kwargs)
+        except Exception:
+            self.logger.error("Failed to start spare browser:\n%s" % traceback.format_exc())
+            spare.failed = True
+
+    def wait_spare_started(self):
+        """Wait for the spare's start_thread, if any, to finish"""
+        spare = self.spare
+        if spare is not None and spare.start_thread is not None:
+            spare.start_thread.join()
+            spare.start_thread = None
+
+    def poll_spare(self):
+        """Handle any messages from the spare runner without blocking, so
+        that its log messages aren't delayed and its init timer is
+        cancelled as soon as it has started."""
+        spare = self.spare
+        if spare is None:
+            return
+        if spare.start_thread is not None:
+            if spare.start_thread.is_alive():
+                return
+            self.wait_spare_started()
+        if not spare.started:
+            return
+        while True:
+            try:
+                command, data = spare.command_queue.get_nowait()
+            except Empty:
+                return
+            if command == "log":
+                self.log(*data)
+            elif command == "init_succeeded":
+                spare.browser.after_init()
+                spare.ready = True
+            elif command == "init_failed":
+                # This can come from the init timer firing after the runner
+                # reported success, in which case it's ignored
+                if not spare.ready:
+                    spare.browser.after_init()
+                    spare.failed = True
+            elif command == "error":
+                self.logger.error(*data)
+                spare.failed = True
+            elif command == "runner_teardown":
+                self.logger.debug("Spare runner stopped")
+            else:
+                self.logger.warning("Got command %s from spare runner" % command)
+
+    def swap_spare(self):
+        """Make the spare browser and runner the active ones. The stopped
+        browser becomes the next spare, which is started once the new
+        active runner has been sent a test."""
+        assert isinstance(self.state, RunnerManagerState.restarting)
+        spare = self.spare
+        self.logger.info("Using spare browser")
+        self.spare_count += 1
+        (self.browser, spare.browser) = (spare.browser, self.browser)
+        (self.command_queue, spare.command_queue) = (spare.command_queue, self.command_queue)
+        (self.remote_queue, spare.remote_queue) = (spare.remote_queue, self.remote_queue)
+        self.test_runner_proc = spare.test_runner_proc
+        self.executor_kwargs["group_metadata"] = spare.group_metadata
+        ready = spare.ready
+        spare.test_runner_proc = None
+        spare.group_metadata = None
+        spare.ready = False
+        if ready:
+            return RunnerManagerState.running(self.state.test,
+                                              self.state.test_group,
+                                              self.state.group_metadata)
+        # The runner hasn't reported that it's ready yet, so wait for its
+        # init_succeeded message as for a normal start
+        self.spare_swapped = True
+        return RunnerManagerState.initializing(self.state.test, self.state.test_group, self.state.group_metadata, 0)
+
+    def stop_spare(self, force=False):
+        """Stop the spare TestRunner and browser, if they are running"""
+        self.wait_spare_started()
+        spare = self.spare
+        if spare is None or not spare.started:
+            return
+        if spare.test_runner_proc.is_alive():
+            spare.remote_queue.put(("stop", ()))
+        try:
+            spare.browser.stop(force=force)
+            self.stop_process(spare.test_runner_proc)
+        finally:
+            spare.browser.cleanup()
+            self.poll_spare()
+            spare.test_runner_proc = None
+            spare.group_metadata = None
+            spare.ready = False
+            spare.failed = False
+
     def log(self, action, kwargs):
         getattr(self.logger, action)(**kwargs)
 
@@ -669,22 +918,28 @@ class TestRunnerManager(threading.Thread):
         self.remote_queue.close()
         self.command_queue = None
         self.remote_queue = None
+        if self.spare is not None:
+            self.spare.command_queue.close()
+            self.spare.remote_queue.close()
+            self.spare = None
 
     def ensure_runner_stopped(self):
         self.logger.debug("ensure_runner_stopped")
         if self.test_runner_proc is None:
             return
+        self.stop_process(self.test_runner_proc)
 
+    def stop_process(self, proc):
         self.logger.debug("waiting for runner process to end")
-        self.test_runner_proc.join(10)
+        proc.join(10)
         self.logger.debug("After join")
-        if self.test_runner_proc.is_alive():
+        if proc.is_alive():
             # This might leak a file handle from the queue
             self.logger.warning("Forcibly terminating runner process")
-            self.test_runner_proc.terminate()
-            self.test_runner_proc.join(10)
+            proc.terminate()
+            proc.join(10)
         else:
-            self.logger.debug("Testrunner exited with code %i" % self.test_runner_proc.exitcode)
+            self.logger.debug("Testrunner exited with code %i" % proc.exitcode)
 
     def runner_teardown(self):
         self.ensure_runner_stopped()
@@ -717,11 +972,6 @@ class TestRunnerManager(threading.Thread):
 
 def make_test_queue(tests, test_source_cls, **test_source_kwargs):
     queue = test_source_cls.make_queue(tests, **test_source_kwargs)
-
-    # There is a race condition that means sometimes we continue
-    # before the tests have been written to the underlying pipe.
-    # Polling the pipe for data here avoids that
-    queue._reader.poll(10)
     assert not queue.empty()
     return queue
 
@@ -734,7 +984,8 @@ class ManagerGroup(object):
                  pause_after_test=False,
                  pause_on_unexpected=False,
                  restart_on_unexpected=True,
-                 debug_info=None):
+                 debug_info=None,
+                 spare_browser=False):
         """Main thread object that owns all the TestManager threads."""
         self.suite_name = suite_name
         self.size = size
@@ -749,6 +1000,7 @@ class ManagerGroup(object):
         self.restart_on_unexpected = restart_on_unexpected
         self.debug_info = debug_info
         self.rerun = rerun
+        self.spare_browser = spare_browser
 
         self.pool = set()
         # Event that is polled by threads so that they can gracefully exit in the face
@@ -785,7 +1037,8 @@ class ManagerGroup(object):
                                         self.pause_after_test,
                                         self.pause_on_unexpected,
                                         self.restart_on_unexpected,
-                                        self.debug_info)
+                                        self.debug_info,
+                                        self.spare_browser)
             manager.start()
             self.pool.add(manager)
         self.wait()
@@ -798,6 +1051,52 @@ class ManagerGroup(object):
         """Wait for all the managers in the group to finish"""
         for item in self.pool:
             item.join()
+        self.log_idle_times()
+        self.log_restarts()
+
+    def idle_times(self):
+        """Get a list of (manager number, tests run, busy time, idle time)
+        for each manager, where the idle time is how long the manager had
+        no tests left to run before the last manager finished."""
+        managers = [item for item in self.pool
+                    if item.started_at is not None and item.finished_at is not None]
+        if not managers:
+            return []
+        end = max(item.finished_at for item in managers)
+        return [(item.manager_number,
+                 item.test_count,
+                 item.finished_at - item.started_at,
+                 end - item.finished_at)
+                for item in sorted(managers, key=lambda item: item.manager_number)]
+
+    def log_idle_times(self):
+        idle_times = self.idle_times()
+        if not idle_times:
+            return
+        for number, test_count, busy, idle in idle_times:
+            self.logger.info("Manager %i ran %i tests: busy %.1fs, idle %.1fs" %
+                             (number, test_count, busy, idle))
+        total_busy = sum(item[2] for item in idle_times)
+        total_idle = sum(item[3] for item in idle_times)
+        if total_busy + total_idle > 0:
+            self.logger.info("Total manager idle time %.1fs (%.1f%%)" %
+                             (total_idle, 100. * total_idle / (total_busy + total_idle)))
+
+    def log_restarts(self):
+        managers = sorted(self.pool, key=lambda item: item.manager_number)
+        for item in managers:
+            if item.restart_count or item.startup_time:
+                self.logger.info("Manager %i restarted %i times (%i using a spare browser), "
+                                 "waited %.1fs for browser startup" %
+                                 (item.manager_number, item.restart_count, item.spare_count,
+                                  item.startup_time))
+        restarts = sum(item.restart_count for item in managers)
+        if restarts:
+            self.logger.info("Total %i restarts (%i using a spare browser), %.1fs waiting for "
+                             "browser startup" %
+                             (restarts,
+                              sum(item.spare_count for item in managers),
+                              sum(item.startup_time for item in managers)))
 
     def stop(self):
         """Set the stop flag so that all managers in the group stop as soon
@@ -0,0 +1,68 @@
+import os
+import stat
+import sys
+from os.path import join, dirname
+
+import mock
+import pytest
+
+sys.path.insert(0, join(dirname(__file__), "..", "..", ".."))
+
+firefox = pytest.importorskip("wptrunner.browsers.firefox")
+
+from mozlog import structuredlog
+
+
+fake_certutil = """#!/bin/sh
+echo "$@" >> "%s"
+if [ "$1" = "-N" ]; then
+    echo db > "$3/cert9.db"
+fi
+"""
+
+
+@pytest.fixture
+def certutil(tmpdir):
+    log_path = str(tmpdir.join("certutil.log"))
+    path = str(tmpdir.join("certutil"))
+    with open(path, "w") as f:
+        f.write(fake_certutil % log_path)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path, log_path
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="fake certutil is a shell script")
+def test_profile_reuses_prefs_and_cert_db(tmpdir, certutil):
+    certutil_path, log_path = certutil
+    prefs_root = tmpdir.mkdir("prefs")
+    prefs_root.mkdir("common").join("user.js").write('user_pref("test.pref", 1);\n')
+    ca_path = str(tmpdir.join("cacert.pem"))
+
+    browser = firefox.FirefoxBrowser(structuredlog.StructuredLogger("test"),
+                                     str(tmpdir.join("firefox")),
+                                     str(prefs_root),
+                                     "testharness",
+                                     extra_prefs={},
+                                     certutil_binary=certutil_path,
+                                     ca_certificate_path=ca_path,
+                                     config=mock.Mock(domains_set={"web-platform.test"}))
+    with mock.patch.object(firefox, "FirefoxRunner"), \
+            mock.patch.object(browser, "load_prefs", wraps=browser.load_prefs) as load_prefs:
+        profiles = []
+        for _ in range(2):
+            browser.start()
+            profiles.append(browser.profile)
+
+        assert load_prefs.call_count == 1
+        with open(log_path) as f:
+            assert len(f.readlines()) == 3
+        for profile in profiles:
+            assert os.path.exists(os.path.join(profile.profile, "cert9.db"))
+            with open(os.path.join(profile.profile, "user.js")) as f:
+                assert "test.pref" in f.read()
+        assert profiles[0].profile != profiles[1].profile
+
+        template = browser.cert_db_template
+        browser.cleanup()
+        assert browser.cert_db_template is None
+        assert not os.path.exists(template)
@@ -87,6 +87,40 @@ class TestEqualTimeChunker(unittest.TestCase):
         self.assertEquals(tests[1:101], chunk_2)
         self.assertEquals(tests[101:102], chunk_3)
 
+    def test_durations(self):
+        tests = []
+        for dir_path in ["a", "b", "c"]:
+            for i in range(10):
+                path = "%s/%i.html" % (dir_path, i)
+                tests.append(("test", path, set([MockTest(path, path)])))
+        durations = {test.id: 10 if test.id.startswith("c/") else 1
+                     for _, _, items in tests for test in items}
+
+        # Using timeouts each directory takes the same time
+        self.assertEquals(tests[:10], list(EqualTimeChunker(2, 1)(tests)))
+        self.assertEquals(tests[10:], list(EqualTimeChunker(2, 2)(tests)))
+
+        chunk_1 = list(EqualTimeChunker(2, 1, durations=durations)(tests))
+        chunk_2 = list(EqualTimeChunker(2, 2, durations=durations)(tests))
+
+        self.assertEquals(tests[:20], chunk_1)
+        self.assertEquals(tests[20:], chunk_2)
+
+    def test_durations_unknown(self):
+        tests = []
+        for dir_path in ["a", "b"]:
+            for i in range(10):
+                path = "%s/%i.html" % (dir_path, i)
+                tests.append(("test", path, set([MockTest(path, path)])))
+        # Tests without timing data are assumed to take the mean recorded
+        # time, rather than their timeout
+        durations = {"a/%i.html" % i: 2 for i in range(10)}
+
+        by_dir, total_time = EqualTimeChunker(2, 1, durations=durations)._group_by_directory(tests)
+        self.assertEquals(20, by_dir[("a",)].time)
+        self.assertEquals(20, by_dir[("b",)].time)
+        self.assertEquals(40, total_time)
+
     def test_too_few_dirs(self):
         with self.assertRaises(ValueError):
             tests = make_mock_manifest(("test", "a", 1), ("test", "a/b", 100),
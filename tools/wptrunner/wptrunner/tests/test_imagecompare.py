@@ -0,0 +1,192 @@
+import base64
+import os
+import struct
+import sys
+import zlib
+
+import mock
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from wptrunner import imagecompare, wpttest
+from wptrunner.executors.base import RefTestImplementation
+
+
+def chunk(chunk_type, data):
+    return (struct.pack(">I", len(data)) + chunk_type + data +
+            struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def filter_row(filter_type, row, prior, bpp):
+    """Apply a PNG filter to a row of bytes, the inverse of what's being tested"""
+    rv = bytearray(len(row))
+    for i in xrange(len(row)):
+        a = row[i - bpp] if i >= bpp else 0
+        b = prior[i]
+        c = prior[i - bpp] if i >= bpp else 0
+        if filter_type == 0:
+            predictor = 0
+        elif filter_type == 1:
+            predictor = a
+        elif filter_type == 2:
+            predictor = b
+        elif filter_type == 3:
+            predictor = (a + b) >> 1
+        else:
+            predictor = imagecompare._paeth(a, b, c)
+        rv[i] = (row[i] - predictor) & 0xff
+    return rv
+
+
+def make_png(width, height, rows, colour_type=6, bit_depth=8, filters=(0,), extra_chunks=()):
+    """Encode rows of samples as a PNG, cycling through filter types by row"""
+    bpp = max(1, imagecompare.channel_counts[colour_type] * bit_depth // 8)
+    data = bytearray()
+    prior = bytearray(len(rows[0]))
+    for y, row in enumerate(rows):
+        filter_type = filters[y % len(filters)]
+        data.append(filter_type)
+        data.extend(filter_row(filter_type, bytearray(row), prior, bpp))
+        prior = bytearray(row)
+    header = struct.pack(">IIBBBBB", width, height, bit_depth, colour_type, 0, 0, 0)
+    return (imagecompare.png_signature + chunk(b"IHDR", header) +
+            b"".join(chunk(*item) for item in extra_chunks) +
+            chunk(b"IDAT", zlib.compress(bytes(data))) + chunk(b"IEND", b""))
+
+
+def rgba_rows(width, height):
+    return [bytearray((x * 40 + y * 7 + c * 60) & 0xff for x in xrange(width) for c in xrange(4))
+            for y in xrange(height)]
+
+
+@pytest.mark.parametrize("filters", [(0,), (1,), (2,), (3,), (4,), (0, 1, 2, 3, 4)])
+def test_decode_filters(filters):
+    rows = rgba_rows(7, 5)
+    image = imagecompare.decode_png(make_png(7, 5, rows, filters=filters))
+    assert image.size == (7, 5)
+    assert image.pixels == b"".join(bytes(row) for row in rows)
+
+
+def test_decode_colour_types():
+    rgb = imagecompare.decode_png(make_png(2, 1, [b"\x01\x02\x03\x04\x05\x06"], colour_type=2,
+                                           filters=(1,)))
+    assert rgb.pixels == b"\x01\x02\x03\xff\x04\x05\x06\xff"
+
+    grey = imagecompare.decode_png(make_png(2, 1, [b"\x10\x20"], colour_type=0))
+    assert grey.pixels == b"\x10\x10\x10\xff\x20\x20\x20\xff"
+
+    grey_alpha = imagecompare.decode_png(make_png(1, 1, [b"\x10\x80"], colour_type=4))
+    assert grey_alpha.pixels == b"\x10\x10\x10\x80"
+
+    rgba_16 = imagecompare.decode_png(make_png(1, 1, [b"\x01\xff\x02\xff\x03\xff\x04\xff"],
+                                               bit_depth=16, filters=(4,)))
+    assert rgba_16.pixels == b"\x01\x02\x03\x04"
+
+    palette = imagecompare.decode_png(make_png(3, 1, [b"\x01\x00\x01"], colour_type=3,
+                                               extra_chunks=[(b"PLTE", b"\x0a\x0b\x0c\x14\x15\x16"),
+                                                             (b"tRNS", b"\x00")]))
+    assert palette.pixels == b"\x14\x15\x16\xff\x0a\x0b\x0c\x00\x14\x15\x16\xff"
+
+
+@pytest.mark.parametrize("data", [b"GIF89a",
+                                  make_png(1, 1, [b"\x00\x00\x00\x00"])[:-30],
+                                  make_png(1, 1, [b"\x00"], colour_type=0, bit_depth=4)])
+def test_decode_invalid(data):
+    with pytest.raises(ValueError):
+        imagecompare.decode_png(data)
+
+
+def image(width, height, changes=None):
+    pixels = bytearray(b"\x80" * (width * height * 4))
+    for (x, y), value in (changes or {}).iteritems():
+        pixels[(y * width + x) * 4:(y * width + x + 1) * 4] = value
+    return imagecompare.Image(width, height, pixels)
+
+
+def test_compare():
+    assert imagecompare.compare(image(4, 3), image(4, 3)) == (0, 0, None)
+    diff = imagecompare.compare(image(4, 3), image(4, 3, {(1, 0): b"\x81\x80\x80\x80",
+                                                          (2, 2): b"\x80\x80\x70\x80"}))
+    assert diff == (16, 2, (1, 0, 3, 3))
+    assert imagecompare.compare(image(4, 3), image(3, 4)) == (255, 16, (0, 0, 4, 4))
+
+
+def descriptor(url, references=None, fuzzy=None):
+    return wpttest.TestDescriptor("reftest", url, 10, {"protocol": "http", "prefs": {}},
+                                  "PASS", references=references, fuzzy=fuzzy)
+
+
+def png_screenshot(changes=None):
+    rows = [bytearray(b"\x80" * 16) for _ in xrange(3)]
+    for (x, y), value in (changes or {}).iteritems():
+        rows[y][x * 4:(x + 1) * 4] = value
+    return base64.b64encode(make_png(4, 3, rows))
+
+
+def run_reftest(screenshots, relation="==", fuzzy=None):
+    ref = descriptor("/ref.html")
+    test = descriptor("/test.html", references=[(ref, relation)], fuzzy=fuzzy)
+    executor = mock.Mock(timeout_multiplier=1, screenshot_cache={})
+    executor.screenshot.side_effect = lambda node, viewport_size, dpi: (True, screenshots[node.url])
+    return RefTestImplementation(executor).run_test(test), executor
+
+
+@pytest.mark.parametrize("relation,fuzzy,status", [("==", None, "FAIL"),
+                                                   ("==", {None: ((1, 2), (1, 1))}, "PASS"),
+                                                   ("==", {"/ref.html": ((1, 2), (1, 1))}, "PASS"),
+                                                   ("==", {"/other.html": ((1, 2), (1, 1))}, "FAIL"),
+                                                   ("==", {None: ((0, 1), (0, 1))}, "FAIL"),
+                                                   ("!=", None, "PASS"),
+                                                   ("!=", {None: ((1, 2), (1, 1))}, "FAIL")])
+@mock.patch.object(imagecompare, "accelerated", True)
+def test_reftest_fuzzy(relation, fuzzy, status):
+    screenshots = {"/test.html": png_screenshot(),
+                   "/ref.html": png_screenshot({(3, 1): b"\x80\x82\x80\x80"})}
+    result, executor = run_reftest(screenshots, relation, fuzzy)
+    assert result["status"] == status
+    # Screenshots are only taken once, even when the test fails
+    assert executor.screenshot.call_count == 2
+    if status == "FAIL" and relation == "==":
+        assert result["extra"]["reftest_diff"] == {"max_difference": 2,
+                                                   "pixels_different": 1,
+                                                   "bounds": (3, 1, 4, 2)}
+        assert result["extra"]["reftest_screenshots"][0]["screenshot"] == screenshots["/test.html"]
+        assert "Found 1 pixels different, maximum difference per channel 2" in result["message"]
+
+
+@pytest.mark.parametrize("fuzzy,status", [({None: ((0, 2), (0, 300))}, "PASS"),
+                                          ({None: ((1, 2), (1, 300))}, "FAIL"),
+                                          ({None: ((0, 2), (1, 300))}, "FAIL")])
+def test_reftest_fuzzy_identical(fuzzy, status):
+    # Fuzzy ranges with a nonzero minimum require the screenshots to differ
+    screenshots = {"/test.html": png_screenshot(),
+                   "/ref.html": png_screenshot()}
+    assert run_reftest(screenshots, fuzzy=fuzzy)[0]["status"] == status
+
+
+@mock.patch.object(imagecompare, "accelerated", True)
+def test_reftest_same_pixels():
+    # Screenshots with the same pixels are equal, even if they're encoded differently
+    screenshot = png_screenshot()
+    screenshots = {"/test.html": screenshot,
+                   "/ref.html": base64.b64encode(base64.b64decode(screenshot)[:-12] +
+                                                 chunk(b"tEXt", b"Comment\x00ref") +
+                                                 chunk(b"IEND", b""))}
+    assert screenshots["/test.html"] != screenshots["/ref.html"]
+    assert run_reftest(screenshots)[0]["status"] == "PASS"
+    assert run_reftest(screenshots, "!=")[0]["status"] == "PASS"
+
+
+@mock.patch.object(imagecompare, "accelerated", False)
+def test_reftest_unaccelerated():
+    screenshots = {"/test.html": png_screenshot(),
+                   "/ref.html": png_screenshot({(3, 1): b"\x80\x82\x80\x80"})}
+    # Without NumPy, screenshots are only decoded when there's fuzzy metadata
+    with mock.patch.object(imagecompare, "decode_png", wraps=imagecompare.decode_png) as decode_png:
+        result = run_reftest(screenshots)[0]
+        assert result["status"] == "FAIL"
+        assert "reftest_diff" not in result["extra"]
+        assert not decode_png.called
+        assert run_reftest(screenshots, fuzzy={None: ((1, 2), (1, 1))})[0]["status"] == "PASS"
+        assert decode_png.call_count == 2
@@ -0,0 +1,128 @@
+import os
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+
+import mock
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from wptrunner import manifestexpected, metadatacache
+from wptrunner.wptmanifest.parser import parse
+
+test_ini = """\
+[test.html]
+  expected:
+    if os == "linux" and not debug: FAIL
+    TIMEOUT
+  [subtest]
+    expected: [PASS, FAIL]
+"""
+
+dir_ini = """\
+prefs: [dom.foo:true]
+"""
+
+
+@pytest.fixture
+def metadata_root():
+    path = tempfile.mkdtemp()
+    os.makedirs(os.path.join(path, "a", "b"))
+    with open(os.path.join(path, "a", "b", "test.html.ini"), "w") as f:
+        f.write(test_ini)
+    with open(os.path.join(path, "a", "__dir__.ini"), "w") as f:
+        f.write(dir_ini)
+    yield path
+    shutil.rmtree(path)
+
+
+def test_tuple_round_trip():
+    ast = parse(StringIO(test_ini))
+    rebuilt = metadatacache.from_tuple(metadatacache.to_tuple(ast))
+    assert rebuilt == ast
+    assert rebuilt.children[0].parent is rebuilt
+
+
+def test_get(metadata_root):
+    cache = metadatacache.MetadataCache(metadata_root)
+    assert cache.get(os.path.join(metadata_root, "a", "missing.html.ini")) is None
+    assert cache.get(os.path.join(metadata_root, "a", "b", "test.html.ini")) == parse(StringIO(test_ini))
+    assert cache.ini_files("a") == set(["__dir__.ini"])
+
+
+def test_lists_only_requested_dirs(metadata_root):
+    os.makedirs(os.path.join(metadata_root, "other"))
+    with open(os.path.join(metadata_root, "other", "test.html.ini"), "w") as f:
+        f.write(test_ini)
+    cache = metadatacache.MetadataCache(metadata_root)
+    assert cache.get(os.path.join(metadata_root, "a", "b", "test.html.ini")) is not None
+    assert cache.get(os.path.join(metadata_root, "missing", "test.html.ini")) is None
+    assert sorted(cache.dirs.keys()) == [os.path.join("a", "b"), "missing"]
+
+
+def test_get_manifest(metadata_root):
+    cache = metadatacache.MetadataCache(metadata_root)
+    for run_info in [{"os": "linux", "debug": False},
+                     {"os": "linux", "debug": True}]:
+        uncached = manifestexpected.get_manifest(metadata_root, "a/b/test.html", "/", run_info)
+        cached = manifestexpected.get_manifest(metadata_root, "a/b/test.html", "/", run_info,
+                                               cache=cache)
+        assert (cached.get_test("/a/b/test.html").get("expected") ==
+                uncached.get_test("/a/b/test.html").get("expected"))
+    assert manifestexpected.get_manifest(metadata_root, "a/other.html", "/", {},
+                                         cache=cache) is None
+    dir_manifest = manifestexpected.get_dir_manifest(os.path.join(metadata_root, "a", "__dir__.ini"),
+                                                     {}, cache=cache)
+    assert dir_manifest.prefs == {"dom.foo": "true"}
+
+
+def test_persistent(metadata_root):
+    cache_path = os.path.join(metadata_root, "cache", "metadata.cache")
+    test_path = os.path.join(metadata_root, "a", "b", "test.html.ini")
+
+    cache = metadatacache.MetadataCache(metadata_root, cache_path)
+    cache.get(test_path)
+    cache.save()
+    assert os.path.exists(cache_path)
+
+    with mock.patch.object(metadatacache, "parse") as parse_mock:
+        cache = metadatacache.MetadataCache(metadata_root, cache_path)
+        assert cache.get(test_path) == parse(StringIO(test_ini))
+        assert not parse_mock.called
+
+    # Changing the file invalidates the cached AST
+    with open(test_path, "w") as f:
+        f.write("[test.html]\n  disabled: true\n")
+    cache = metadatacache.MetadataCache(metadata_root, cache_path)
+    ast = cache.get(test_path)
+    assert ast.children[0].children[0].data == "disabled"
+
+
+def test_cache_version(metadata_root):
+    cache_path = os.path.join(metadata_root, "metadata.cache")
+    test_path = os.path.join(metadata_root, "a", "b", "test.html.ini")
+    version = metadatacache.MetadataCache.version
+    assert version == metadatacache.cache_version()
+
+    # A cache written by a different version of the parser isn't used
+    with mock.patch.object(metadatacache.MetadataCache, "version", "other"):
+        cache = metadatacache.MetadataCache(metadata_root, cache_path)
+        cache.get(test_path)
+        cache.save()
+
+    with mock.patch.object(metadatacache, "parse", side_effect=metadatacache.parse) as parse_mock:
+        cache = metadatacache.MetadataCache(metadata_root, cache_path, mock.Mock())
+        assert cache.get(test_path) == parse(StringIO(test_ini))
+        assert parse_mock.called
+
+
+def test_invalid_cache_file(metadata_root):
+    cache_path = os.path.join(metadata_root, "metadata.cache")
+    with open(cache_path, "w") as f:
+        f.write("not a cache")
+    logger = mock.Mock()
+    cache = metadatacache.MetadataCache(metadata_root, cache_path, logger)
+    assert logger.warning.called
+    assert cache.get(os.path.join(metadata_root, "a", "b", "test.html.ini")) is not None
@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import sys
+
+import mock
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from wptrunner import screenshotcache, wpttest
+from wptrunner.executors.base import RefTestImplementation
+
+
+@pytest.fixture
+def tests_root(tmpdir):
+    root = tmpdir.mkdir("tests")
+    css = root.mkdir("css")
+    css.join("ref.html").write('<link rel=stylesheet href="support/ref.css"><img src=/images/a.png>')
+    css.join("test.html").write('<link rel=match href="ref.html"><p>test</p>')
+    css.mkdir("support").join("ref.css").write('@import "base.css"; p { background: url(bg.png) }')
+    css.join("support", "base.css").write("p { color: green }")
+    css.join("support", "bg.png").write("png")
+    root.mkdir("images").join("a.png").write("a")
+    return root
+
+
+def descriptor(tests_root, url, references=None):
+    return wpttest.TestDescriptor("reftest", url, 10, {"protocol": "http", "prefs": {}},
+                                  "PASS", abs_path=os.path.join(str(tests_root), *url.split("/")),
+                                  references=references)
+
+
+@pytest.mark.parametrize("path", ["css/ref.html",
+                                  "css/support/ref.css",
+                                  "css/support/base.css",
+                                  "css/support/bg.png",
+                                  "images/a.png"])
+def test_key_changes_with_dependency(tmpdir, tests_root, path):
+    cache = screenshotcache.PersistentScreenshotCache(str(tmpdir.join("cache")), "browser")
+    ref = descriptor(tests_root, "/css/ref.html")
+    key = cache.key(ref, None, None)
+    assert key is not None
+    assert cache.key(ref, None, None) == key
+    assert cache.key(ref, (800, 600), None) != key
+
+    tests_root.join(path).write("changed", mode="a")
+    assert cache.key(ref, None, None) != key
+
+
+def test_key_headers(tmpdir, tests_root):
+    cache = screenshotcache.PersistentScreenshotCache(str(tmpdir.join("cache")), "browser")
+    ref = descriptor(tests_root, "/css/ref.html")
+    key = cache.key(ref, None, None)
+    tests_root.join("css", "ref.html.headers").write("Content-Type: text/plain")
+    assert cache.key(ref, None, None) != key
+
+
+@pytest.mark.parametrize("data", ['<img src="/common/image.py">',
+                                  '<img src="image.png?pipe=trickle(d1)">',
+                                  '<img src="http://{{host}}/image.png">'])
+def test_uncacheable(tmpdir, tests_root, data):
+    tests_root.join("css", "ref.html").write(data)
+    cache = screenshotcache.PersistentScreenshotCache(str(tmpdir.join("cache")), "browser")
+    assert cache.key(descriptor(tests_root, "/css/ref.html"), None, None) is None
+    assert cache.uncacheable == 1
+
+
+def test_get_set(tmpdir):
+    cache = screenshotcache.PersistentScreenshotCache(str(tmpdir.join("cache")), "browser")
+    assert cache.get("0123abcd") is None
+    cache.set("0123abcd", "hash")
+    assert cache.get("0123abcd") == "hash"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    logger = mock.Mock()
+    cache.log_stats(logger)
+    assert "1 hits, 1 misses (50% hit rate)" in logger.info.call_args[0][0]
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_reftest_implementation(tmpdir, tests_root):
+    ref = descriptor(tests_root, "/css/ref.html")
+    test = descriptor(tests_root, "/css/test.html", references=[(ref, "==")])
+    cache_path = str(tmpdir.join("cache"))
+
+    def run():
+        persistent = screenshotcache.PersistentScreenshotCache(cache_path, "browser")
+        executor = mock.Mock(timeout_multiplier=1,
+                             screenshot_cache=screenshotcache.ScreenshotCache({}, persistent))
+        executor.screenshot.return_value = (True, "screenshot")
+        result = RefTestImplementation(executor).run_test(test)
+        assert result["status"] == "PASS"
+        return [item[0][0].url for item in executor.screenshot.call_args_list]
+
+    assert run() == ["/css/test.html", "/css/ref.html"]
+    # Later runs reuse the reference screenshot, but not the test screenshot
+    assert run() == ["/css/test.html"]
+
+
+def test_shared_store():
+    store = screenshotcache.SharedScreenshotStore(sets=1, ways=2, blocks=2, block_size=8)
+    assert ("/a.html", None, None) not in store
+    assert store.get(("/a.html", None, None)) is None
+    with pytest.raises(KeyError):
+        store[("/a.html", None, None)]
+
+    store[("/a.html", None, None)] = ("hash_a", None)
+    store[(u"/b.html", None, None)] = ("hash_b", "shot_b")
+    assert store[("/a.html", None, None)] == ("hash_a", None)
+    assert store[("/b.html", None, None)] == ("hash_b", "shot_b")
+
+    # Adding a third entry evicts the least recently used one
+    store[("/c.html", None, None)] = ("hash_c", "toolarge_c")
+    assert ("/a.html", None, None) not in store
+    assert store[("/b.html", None, None)] == ("hash_b", "shot_b")
+    # Screenshots that don't fit in a block aren't stored
+    assert store[("/c.html", None, None)] == ("hash_c", None)
+
+    # Replacing an entry replaces its screenshot, and screenshot blocks are
+    # reused in least recently used order
+    store[("/c.html", None, None)] = ("hash_c", "shot_c")
+    store[("/b.html", None, None)] = ("hash_b2", "shot_b2")
+    assert store[("/c.html", None, None)] == ("hash_c", "shot_c")
+    assert store[("/b.html", None, None)] == ("hash_b2", "shot_b2")
+    store[("/b.html", None, None)] = ("hash_b2", None)
+    assert store[("/b.html", None, None)] == ("hash_b2", None)
+    assert store[("/c.html", None, None)] == ("hash_c", "shot_c")
+
+
+def set_item(store, key, value):
+    store[key] = value
+
+
+def test_shared_store_processes():
+    store = screenshotcache.SharedScreenshotStore(sets=16, blocks=2, block_size=1024)
+    proc = multiprocessing.Process(target=set_item,
+                                   args=(store, ("/a.html", (800, 600), 96), ("hash", "shot")))
+    proc.start()
+    proc.join()
+    assert store[("/a.html", (800, 600), 96)] == ("hash", "shot")
@@ -3,11 +3,16 @@ from __future__ import unicode_literals
 import os
 import sys
 import tempfile
+from collections import deque
+from Queue import Empty
+
+import pytest
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
 
 from mozlog import structured
 from wptrunner.testloader import TestFilter as Filter
+from wptrunner.testloader import PathGroupedSource, SingleTestSource, TestQueue, order_groups
 from .test_chunker import make_mock_manifest
 
 structured.set_default_logger(structured.structuredlog.StructuredLogger("TestLoader"))
@@ -28,3 +33,74 @@ def test_filter_unicode():
         f.flush()
 
         Filter(manifest_path=f.name, test_manifests=tests)
+
+
+class MockTest(object):
+    def __init__(self, id, timeout=10):
+        self.id = id
+        self.url = id
+        self.timeout = timeout
+        self.metadata = None
+
+    def update_metadata(self, metadata):
+        self.metadata = metadata
+
+
+def test_order_groups():
+    tests = [MockTest("/a/%i.html" % i) for i in range(3)]
+    slow = MockTest("/b/slow.html", timeout=60)
+    groups = [(deque(tests), {"scope": "/a"}), (deque([slow]), {"scope": "/b"})]
+
+    ordered = order_groups(groups)
+    assert [metadata["scope"] for _, metadata in ordered] == ["/b", "/a"]
+    # Stable in the absence of timing data
+    assert list(ordered[1][0]) == tests
+
+    durations = {"/a/2.html": 100, "/b/slow.html": 1}
+    ordered = order_groups(groups, durations)
+    assert [metadata["scope"] for _, metadata in ordered] == ["/a", "/b"]
+    assert [test.id for test in ordered[0][0]] == ["/a/2.html", "/a/0.html", "/a/1.html"]
+
+
+def test_queue_steal():
+    group_a = deque([1, 2, 3])
+    group_b = deque([4])
+    queue = TestQueue([(group_a, "a"), (group_b, "b")])
+
+    assert queue.get() == (group_a, "a")
+    assert queue.get() == (group_b, "b")
+    group_b.popleft()
+    # Every group has been handed out, so the one with tests left is shared
+    assert queue.get()[0] is group_a
+    group_a.clear()
+    assert queue.empty()
+    with pytest.raises(Empty):
+        queue.get()
+
+
+def test_queue_no_steal():
+    queue = TestQueue([(deque([1, 2]), "a")], steal=False)
+    queue.get()
+    assert queue.empty()
+    with pytest.raises(Empty):
+        queue.get()
+
+
+def test_single_test_source():
+    tests = [MockTest("/a/%i.html" % i) for i in range(4)]
+    queue = SingleTestSource.make_queue(tests, processes=2)
+    sources = [SingleTestSource(queue), SingleTestSource(queue)]
+    groups = [source.group()[0] for source in sources]
+    assert groups[0] is groups[1]
+    assert list(groups[0]) == tests
+
+
+def test_path_grouped_source():
+    tests = [MockTest("/a/%i.html" % i) for i in range(2)] + [MockTest("/b/0.html", timeout=60)]
+    queue = PathGroupedSource.make_queue(tests, depth=True)
+    group, metadata = queue.get()
+    assert metadata == {"scope": "/b"}
+    assert tests[2].metadata == {"scope": "/b"}
+    group, metadata = queue.get()
+    assert metadata == {"scope": "/a"}
+    assert list(group) == tests[:2]
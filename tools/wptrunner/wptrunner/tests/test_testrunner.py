@@ -0,0 +1,132 @@
+from __future__ import unicode_literals
+
+import os
+import sys
+import threading
+from collections import deque
+
+import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from mozlog import structuredlog
+from wptrunner.testloader import SingleTestSource
+from wptrunner.testrunner import (BrowserManager, RunnerManagerState, SpareRunner,
+                                  TestRunnerManager)
+
+
+class MockTest(object):
+    def __init__(self, id, expected="OK", settings=None):
+        self.id = id
+        self._expected = expected
+        self.settings = settings or {}
+        self.descriptor = id
+
+    def expected(self):
+        return self._expected
+
+
+class MockBrowser(object):
+    def settings(self, test):
+        return test.settings
+
+
+def make_spare(test, group_metadata, alive=True):
+    logger = structuredlog.StructuredLogger("test")
+    browser = BrowserManager(logger, MockBrowser(), mock.Mock())
+    browser.update_settings(test)
+    spare = SpareRunner(browser, mock.Mock(), mock.Mock())
+    spare.test_runner_proc = mock.Mock(**{"is_alive.return_value": alive})
+    spare.group_metadata = group_metadata
+    return spare
+
+
+def test_spare_matches():
+    test = MockTest("/a.html")
+    spare = make_spare(test, {"scope": "/"})
+    assert spare.matches(test, {"scope": "/"})
+    assert spare.matches(MockTest("/b.html"), {"scope": "/"})
+
+    assert not spare.matches(test, {"scope": "/other"})
+    assert not spare.matches(MockTest("/b.html", settings={"x": 1}), {"scope": "/"})
+    # Tests expected to crash always get a newly started browser
+    assert not spare.matches(MockTest("/b.html", expected="CRASH"), {"scope": "/"})
+
+    spare.failed = True
+    assert not spare.matches(test, {"scope": "/"})
+
+    assert not make_spare(test, {"scope": "/"}, alive=False).matches(test, {"scope": "/"})
+
+
+def test_swap_spare():
+    test = MockTest("/a.html")
+    manager = TestRunnerManager("test", deque(), SingleTestSource, MockBrowser, {},
+                                None, {}, threading.Event(), spare_browser=True)
+    manager.logger = structuredlog.StructuredLogger("test")
+    manager.browser = BrowserManager(manager.logger, MockBrowser(), manager.command_queue)
+    active_queues = (manager.command_queue, manager.remote_queue)
+
+    spare = make_spare(test, {"scope": "/"})
+    spare_browser = spare.browser
+    spare_proc = spare.test_runner_proc
+    spare.ready = True
+    manager.spare = spare
+    manager.start_spare = mock.Mock()
+
+    manager.state = RunnerManagerState.restarting(test, deque(), {"scope": "/"})
+    new_state = manager.swap_spare()
+
+    assert isinstance(new_state, RunnerManagerState.running)
+    assert manager.browser is spare_browser
+    assert manager.test_runner_proc is spare_proc
+    assert (spare.command_queue, spare.remote_queue) == active_queues
+    assert not spare.started
+    assert manager.spare_count == 1
+    # The next spare is only started once the new runner has been sent a test
+    assert not manager.start_spare.called
+
+    # A spare that hasn't finished starting is waited for as for a normal start
+    spare.test_runner_proc = mock.Mock()
+    spare.group_metadata = {"scope": "/"}
+    manager.state = RunnerManagerState.restarting(test, deque(), {"scope": "/"})
+    new_state = manager.swap_spare()
+    assert isinstance(new_state, RunnerManagerState.initializing)
+    assert manager.spare_swapped
+    manager.state = new_state
+    assert manager.init() is None
+    assert not manager.spare_swapped
+
+
+def test_spare_started_after_first_test():
+    test = MockTest("/a.html")
+    manager = TestRunnerManager("test", deque(), SingleTestSource, MockBrowser, {},
+                                None, {}, threading.Event(), spare_browser=True)
+    manager.logger = structuredlog.StructuredLogger("test")
+    manager.browser = BrowserManager(manager.logger, MockBrowser(), manager.command_queue)
+    events = []
+    manager.remote_queue = mock.Mock(**{"put.side_effect": lambda item: events.append(item[0])})
+
+    spare = SpareRunner(BrowserManager(manager.logger, MockBrowser(), mock.Mock()),
+                        mock.Mock(), mock.Mock())
+    manager.spare = spare
+    manager_thread = threading.current_thread()
+
+    def init(group_metadata):
+        events.append(("spare_init", threading.current_thread() is manager_thread))
+        return False
+
+    manager.state = RunnerManagerState.running(test, deque(), {})
+    with mock.patch.object(spare.browser, "init", side_effect=init):
+        with mock.patch.object(spare.browser, "stop"):
+            assert manager.run_test() is None
+            manager.wait_spare_started()
+
+    # The test is sent before the spare starts, and the spare isn't started
+    # on the manager thread
+    assert events == ["run_test", ("spare_init", False)]
+    assert not spare.started
+    assert spare.failed
+
+    # A spare that failed to start isn't tried again until the next restart
+    manager.run_test()
+    assert spare.start_thread is None
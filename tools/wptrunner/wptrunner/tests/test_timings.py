@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from wptrunner import timings
+
+
+def test_add():
+    store = timings.TimingStore()
+    store.add("firefox", "/a.html", 1.0)
+    store.add("firefox", "/a.html", 2.0)
+    store.add("chrome", "/a.html", 0.5)
+    assert store.durations("firefox") == {"/a.html": 1.5}
+    assert store.durations("chrome") == {"/a.html": 0.5}
+    assert store.durations("servo") == {}
+
+
+def test_add_max_samples():
+    store = timings.TimingStore()
+    for _ in range(100):
+        store.add("firefox", "/a.html", 1.0)
+    for _ in range(store.max_samples):
+        store.add("firefox", "/a.html", 2.0)
+    # Older samples are forgotten
+    assert store.durations("firefox")["/a.html"] > 1.5
+
+
+def test_merge():
+    store = timings.TimingStore()
+    store.add("firefox", "/a.html", 1.0)
+    other = timings.TimingStore()
+    other.add("firefox", "/a.html", 4.0)
+    other.add("firefox", "/a.html", 4.0)
+    other.add("firefox", "/b.html", 2.0)
+    store.merge(other)
+    assert store.durations("firefox") == {"/a.html": 3.0, "/b.html": 2.0}
+
+
+def test_save_load():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "cache", "timings.json")
+        store = timings.TimingStore()
+        store.add("firefox", "/a.html", 1.25)
+        store.save(path)
+        assert os.listdir(os.path.dirname(path)) == ["timings.json"]
+
+        loaded = timings.TimingStore.load(path)
+        assert loaded.durations("firefox") == {"/a.html": 1.25}
+
+        with open(path, "w") as f:
+            f.write("{")
+        assert timings.TimingStore.load(path).durations("firefox") == {}
+
+        with open(path, "w") as f:
+            json.dump({"version": 0, "products": {}}, f)
+        assert timings.TimingStore.load(path).durations("firefox") == {}
+
+        assert timings.TimingStore.load(os.path.join(tmp_dir, "missing")).products == {}
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_recorder():
+    store = timings.TimingStore()
+    recorder = timings.TimingRecorder(store, "firefox")
+    recorder({"action": "test_start", "test": "/a.html", "time": 1000})
+    recorder({"action": "test_start", "test": "/b.html", "time": 1500})
+    recorder({"action": "log", "level": "INFO", "message": "", "time": 1600})
+    recorder({"action": "test_end", "test": "/a.html", "status": "OK", "time": 3000})
+    recorder({"action": "test_end", "test": "/b.html", "status": "SKIP", "time": 3000})
+    assert store.durations("firefox") == {"/a.html": 2.0}
@@ -546,3 +546,121 @@ def test_update_lsan_3():
 
     assert not new_manifest.is_empty
     assert new_manifest.get("lsan-allowed") == ["baz", "foo"]
+
+
+def write_log(tmpdir, name, entries):
+    path = tmpdir.join(name)
+    path.write(create_log(entries).getvalue())
+    return str(path)
+
+
+def test_iter_log_summaries(tmpdir):
+    log_0 = write_log(tmpdir, "log_0", suite_log([
+        ("test_start", {"test": "/path/to/test.htm"}),
+        ("info", {"message": '"action": "test_end"'}),
+        ("test_status", {"test": "/path/to/test.htm",
+                         "subtest": "test1",
+                         "status": "FAIL",
+                         "message": "assert_true: expected true got false"}),
+        ("assertion_count", {"test": "/path/to/test.htm", "count": 2,
+                             "min_expected": 0, "max_expected": 0}),
+        ("test_end", {"test": "/path/to/test.htm", "status": "OK"})],
+        run_info={"os": "linux"}))
+    log_1 = write_log(tmpdir, "log_1", suite_log([
+        ("lsan_leak", {"scope": "other/", "frames": ["foo"]})]))
+
+    summaries = list(metadata.iter_log_summaries([log_0, log_1], processes=1))
+    assert summaries == [
+        [({"os": "linux"},
+          {"/path/to/test.htm": ([("test1", "FAIL")], ["OK"], [2])},
+          [])],
+        [({}, {}, [("other/__dir__", ["foo"], None)])]]
+    assert list(metadata.iter_log_summaries([log_0, log_1], processes=2)) == summaries
+
+    assert metadata.get_test_ids(summaries[0]) == {"/path/to/test.htm"}
+    assert metadata.get_test_ids(summaries[1]) == {"other/__dir__"}
+
+
+def test_summarize_log_repeated():
+    log = create_log(suite_log([
+        ("test_status", {"test": "/a.htm", "subtest": "before start", "status": "FAIL"}),
+        ("test_start", {"test": "/a.htm"}),
+        ("test_status", {"test": "/a.htm", "subtest": "test1", "status": "FAIL"}),
+        ("test_end", {"test": "/a.htm", "status": "OK"}),
+        ("test_status", {"test": "/a.htm", "subtest": "after end", "status": "FAIL"}),
+        ("test_start", {"test": "/a.htm"}),
+        ("test_status", {"test": "/a.htm", "subtest": "test1", "status": "PASS"}),
+        ("test_end", {"test": "/a.htm", "status": "TIMEOUT"})]))
+    # Repeated results for a test are kept, in order, in a single entry
+    assert metadata.summarize_log(log) == [
+        ({}, {"/a.htm": ([("test1", "FAIL"), ("test1", "PASS")], ["OK", "TIMEOUT"], [])}, [])]
+
+
+def test_create_test_tree_scoped(tmpdir):
+    tests = [("path/to/test.htm", ["/path/to/test.htm"], "testharness", None),
+             ("path/to/other.htm", ["/path/to/other.htm"], "testharness", None),
+             ("other/test.htm", ["/other/test.htm"], "testharness", None)]
+    m = create_test_manifest(tests)
+    metadata_path = tmpdir.mkdir("meta")
+    metadata_path.mkdir("path").mkdir("to").join("test.htm.ini").write(
+        "[test.htm]\n  expected: FAIL\n")
+    metadata.do_delayed_imports(None)
+
+    id_test_map = metadata.create_test_tree(str(metadata_path), m)
+    assert set(id_test_map.keys()) == {"/path/to/test.htm", "/path/to/other.htm",
+                                       "/other/test.htm", "__dir__", "path/__dir__",
+                                       "path/to/__dir__", "other/__dir__"}
+
+    with mock.patch.object(manifestupdate, "get_manifest",
+                           wraps=manifestupdate.get_manifest) as get_manifest:
+        id_test_map = metadata.create_test_tree(str(metadata_path), m,
+                                                test_ids={"/path/to/test.htm", "other/__dir__"})
+    assert set(id_test_map.keys()) == {"/path/to/test.htm", "other/__dir__"}
+    assert get_manifest.call_count == 2
+    test = id_test_map["/path/to/test.htm"].expected.get_test("/path/to/test.htm")
+    assert test.get("expected") == "FAIL"
+
+
+def test_update_from_logs(tmpdir):
+    tests = [("path/to/test.htm", ["/path/to/test.htm"], "testharness", None),
+             ("path/to/other.htm", ["/path/to/other.htm"], "testharness", None),
+             ("other/test.htm", ["/other/test.htm"], "testharness", None)]
+    m = create_test_manifest(tests)
+    metadata_path = tmpdir.mkdir("meta")
+    metadata.do_delayed_imports(None)
+    logs = [write_log(tmpdir, "log_%i" % i, suite_log([
+        ("test_start", {"test": "/path/to/test.htm"}),
+        ("test_end", {"test": "/path/to/test.htm", "status": "ERROR", "expected": "OK"})],
+        run_info={"os": os_name})) for i, os_name in enumerate(["linux", "win"])]
+
+    id_test_map = metadata.update_from_logs({m: {"metadata_path": str(metadata_path)}}, *logs,
+                                            processes=2)
+    # Only the expectations for the tests in the logs are loaded
+    assert set(id_test_map.keys()) == {"/path/to/test.htm"}
+    test = id_test_map["/path/to/test.htm"].expected.get_test("/path/to/test.htm")
+    assert test.get("expected", {"os": "linux"}) == "ERROR"
+    assert test.get("expected", {"os": "win"}) == "ERROR"
+
+
+def test_write_modified(tmpdir):
+    metadata_path = tmpdir.mkdir("meta")
+    ini_dir = metadata_path.mkdir("path").mkdir("to")
+    tests = [("path/to/test.htm", ["/path/to/test.htm"], "testharness",
+              "[test.htm]\n  expected: FAIL\n"),
+             ("path/to/other.htm", ["/path/to/other.htm"], "testharness",
+              "[other.htm]\n  expected: FAIL\n")]
+    for path, _, _, data in tests:
+        metadata_path.join(path + ".ini").write(data)
+    ini_dir.join("unrelated.htm.ini").write("[unrelated.htm]\n  expected: FAIL\n")
+
+    log = suite_log([("test_start", {"test": "/path/to/test.htm"}),
+                     ("test_end", {"test": "/path/to/test.htm", "status": "OK",
+                                   "expected": "FAIL"})])
+    id_test_map = update(tests, log)
+    expected = [item.expected for item in id_test_map.itervalues()]
+    metadata.write_modified(str(metadata_path), expected)
+
+    # The test's expectations are now empty, and the other files are untouched
+    assert not ini_dir.join("test.htm.ini").exists()
+    assert ini_dir.join("other.htm.ini").read() == "[other.htm]\n  expected: FAIL\n"
+    assert ini_dir.join("unrelated.htm.ini").exists()
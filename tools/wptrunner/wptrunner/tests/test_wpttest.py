@@ -1,4 +1,5 @@
 import os
+import pickle
 import sys
 from io import BytesIO
 
@@ -48,3 +49,89 @@ def test_metadata_inherit():
     assert test_obj.min_assertion_count == 1
     assert test_obj.prefs == {"b": "c", "c": "d"}
     assert test_obj.tags == {"a", "dir:a"}
+
+
+test_1 = """\
+[1.html]
+  expected: ERROR
+  prefs: [c:d]
+  [subtest]
+    expected: FAIL
+"""
+
+
+def test_descriptor():
+    tests = make_mock_manifest(("test", "a", 10))
+
+    inherit_metadata = [
+        manifestexpected.static.compile(
+            BytesIO(dir_ini_0),
+            {},
+            data_cls_getter=lambda x,y: manifestexpected.DirectoryManifest)]
+    test_metadata = manifestexpected.static.compile(BytesIO(test_1),
+                                                    {},
+                                                    data_cls_getter=manifestexpected.data_cls_getter,
+                                                    test_path="a",
+                                                    url_base="")
+
+    test = tests[1][2].pop()
+    test_obj = wpttest.from_manifest(test, inherit_metadata, test_metadata.get_test(test.id))
+    descriptor = pickle.loads(pickle.dumps(test_obj.descriptor, pickle.HIGHEST_PROTOCOL))
+
+    assert descriptor.id == test_obj.id
+    assert descriptor.url == test_obj.url
+    assert descriptor.timeout == test_obj.timeout
+    assert descriptor.environment == {"protocol": "http", "prefs": {"a": "b", "c": "d"}}
+    assert descriptor.expected() == "ERROR"
+    assert descriptor.result_cls is wpttest.TestharnessResult
+    assert descriptor.subtest_result_cls is wpttest.TestharnessSubtestResult
+    assert not hasattr(descriptor, "_test_metadata")
+    assert len(pickle.dumps(test_obj.descriptor)) < len(pickle.dumps(test_obj))
+
+
+def test_descriptor_references():
+    test = wpttest.ReftestTest("/", "/a.html", [], None, [], path="a.html")
+    ref = wpttest.ReftestTest("/", "/b.html", [], None, [])
+    ref.references.append((test, "!="))
+    test.references.append((ref, "=="))
+
+    descriptor = pickle.loads(pickle.dumps(test.descriptor, pickle.HIGHEST_PROTOCOL))
+    assert descriptor.result_cls is wpttest.ReftestResult
+    assert descriptor.abs_path == os.path.join("/", "a.html")
+    ref_descriptor, relation = descriptor.references[0]
+    assert relation == "=="
+    assert ref_descriptor.url == "/b.html"
+    assert ref_descriptor.abs_path is None
+    assert ref_descriptor.references == [(descriptor, "!=")]
+
+
+dir_ini_fuzzy = """\
+fuzzy: maxDifference=1;totalPixels=0-10
+"""
+
+test_fuzzy = """\
+[r.html]
+  fuzzy: [ref.html:2-3;4, "ref2.html:totalPixels=5-6;maxDifference=7"]
+"""
+
+
+def test_reftest_fuzzy():
+    inherit_metadata = [
+        manifestexpected.static.compile(
+            BytesIO(dir_ini_fuzzy),
+            {},
+            data_cls_getter=lambda x,y: manifestexpected.DirectoryManifest)]
+    test_metadata = manifestexpected.static.compile(BytesIO(test_fuzzy),
+                                                    {},
+                                                    data_cls_getter=manifestexpected.data_cls_getter,
+                                                    test_path="a/r.html",
+                                                    url_base="/")
+
+    test = wpttest.ReftestTest("/", "/a/r.html", inherit_metadata,
+                               test_metadata.get_test("/a/r.html"), [])
+    expected = {None: ((1, 1), (0, 10)),
+                "/a/ref.html": ((2, 3), (4, 4)),
+                "/a/ref2.html": ((7, 7), (5, 6))}
+    assert test.fuzzy == expected
+    descriptor = pickle.loads(pickle.dumps(test.descriptor, pickle.HIGHEST_PROTOCOL))
+    assert descriptor.fuzzy == expected
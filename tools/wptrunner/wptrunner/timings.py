@@ -0,0 +1,149 @@
+"""Store of the time taken to run each test.
+
+Durations are recorded from the test_start and test_end log actions of
+a run, and are used to balance the equal_time chunker and to order
+tests across processes. The store is a small JSON file holding, for
+each product, a mapping of test id to a [mean duration in ms, sample
+count] pair. Stores written by separate runs or chunks can be merged."""
+
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class TimingStore(object):
+    version = 1
+
+    # Limit on the sample count so that the mean follows recent runs
+    max_samples = 10
+
+    def __init__(self, data=None):
+        self.lock = threading.Lock()
+        self.products = {}
+        if data is not None:
+            if data.get("version") != self.version:
+                raise ValueError("Unsupported timing data version %s" % data.get("version"))
+            self.products = data["products"]
+
+    @classmethod
+    def load(cls, path, logger=None):
+        """Load the store from path, returning an empty store if the file
+        doesn't exist or can't be read."""
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path) as f:
+                return cls(json.load(f))
+        except (IOError, ValueError, KeyError) as e:
+            if logger is not None:
+                logger.warning("Ignoring invalid timing data in %s: %s" % (path, e))
+            return cls()
+
+    def save(self, path):
+        """Write the store to path, replacing the file atomically"""
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        with self.lock:
+            data = {"version": self.version, "products": self.products}
+            fd, tmp_path = tempfile.mkstemp(dir=dir_name or None, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(data, f, separators=(",", ":"), sort_keys=True)
+                os.rename(tmp_path, path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+
+    def add(self, product, test_id, duration):
+        """Record a single run of a test.
+
+        :param product: Name of the product the test ran in
+        :param test_id: Id of the test
+        :param duration: Time taken to run the test in seconds"""
+        duration_ms = int(round(duration * 1000))
+        with self.lock:
+            tests = self.products.setdefault(product, {})
+            if test_id in tests:
+                mean, count = tests[test_id]
+                count = min(count + 1, self.max_samples)
+                mean = int(round(mean + float(duration_ms - mean) / count))
+            else:
+                mean, count = duration_ms, 1
+            tests[test_id] = [mean, count]
+
+    def merge(self, other):
+        """Merge the data from another TimingStore into this one"""
+        with self.lock:
+            for product, other_tests in other.products.iteritems():
+                tests = self.products.setdefault(product, {})
+                for test_id, (other_mean, other_count) in other_tests.iteritems():
+                    if test_id not in tests:
+                        tests[test_id] = [other_mean, other_count]
+                        continue
+                    mean, count = tests[test_id]
+                    total = count + other_count
+                    tests[test_id] = [int(round(float(mean * count + other_mean * other_count) / total)),
+                                      min(total, self.max_samples)]
+
+    def durations(self, product):
+        """Get a dictionary of test id to mean duration in seconds for a
+        product"""
+        with self.lock:
+            return {test_id: mean / 1000.
+                    for test_id, (mean, _) in self.products.get(product, {}).iteritems()}
+
+
+class TimingRecorder(object):
+    """Log handler that records the duration of each test run in a
+    TimingStore.
+
+    :param store: The TimingStore to update
+    :param product: Name of the product the tests run in
+    """
+
+    def __init__(self, store, product):
+        self.store = store
+        self.product = product
+        self.start_times = {}
+
+    def __call__(self, data):
+        action = data["action"]
+        if action == "test_start":
+            self.start_times[data["test"]] = data["time"]
+        elif action == "test_end":
+            start_time = self.start_times.pop(data["test"], None)
+            # Skipped tests don't tell us anything about how long a test takes
+            if start_time is not None and data["status"] != "SKIP":
+                self.store.add(self.product, data["test"], (data["time"] - start_time) / 1000.)
+
+
+def load(path, merge_paths=None, logger=None):
+    """Load the TimingStore at path, merging in the stores at merge_paths"""
+    store = TimingStore.load(path, logger)
+    for merge_path in merge_paths or []:
+        store.merge(TimingStore.load(merge_path, logger))
+    return store
+
+
+@contextmanager
+def record(logger, store, product, path):
+    """Context manager that records test durations logged by logger in
+    store, and writes the store to path on exit. Does nothing if store is
+    None."""
+    if store is None:
+        yield
+        return
+
+    recorder = TimingRecorder(store, product)
+    logger.add_handler(recorder)
+    try:
+        yield
+    finally:
+        logger.remove_handler(recorder)
+        try:
+            store.save(path)
+        except (IOError, OSError) as e:
+            logger.warning("Failed to write timing data to %s: %s" % (path, e))
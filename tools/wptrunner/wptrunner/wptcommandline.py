@@ -62,6 +62,10 @@ scheme host and port.""")
                         "directory")
     parser.add_argument("--processes", action="store", type=int, default=None,
                         help="Number of simultaneous processes to use")
+    parser.add_argument("--spare-browser", action="store_true", default=False,
+                        help="Keep a spare browser starting in the background for each process, "
+                        "so that restarting the browser between tests doesn't have to wait for "
+                        "it to start. Uses twice as many browser instances.")
 
     parser.add_argument("--no-capture-stdio", action="store_true", default=False,
                         help="Don't capture stdio and write to logging")
@@ -188,6 +192,17 @@ scheme host and port.""")
                               help="Path to root directory containing test files"),
     config_group.add_argument("--manifest", action="store", type=abs_path, dest="manifest_path",
                               help="Path to test manifest (default is ${metadata_root}/MANIFEST.json)")
+    config_group.add_argument("--metadata-cache-dir", action="store", type=abs_path,
+                              help="Directory in which to cache parsed expectation metadata "
+                              "between runs (wpt run defaults to ~/.cache/wpt/metadata)")
+    config_group.add_argument("--no-metadata-cache", action="store_true", default=False,
+                              help="Don't cache parsed expectation metadata between runs")
+    config_group.add_argument("--reftest-screenshot-cache", action="store_true", default=False,
+                              help="Reuse the screenshots of reftest references from earlier runs "
+                              "when the references, the files they load and the browser are unchanged")
+    config_group.add_argument("--reftest-screenshot-cache-dir", action="store", type=abs_path,
+                              help="Directory in which to cache reference screenshots, "
+                              "implies --reftest-screenshot-cache (wpt run defaults to ~/.cache/wpt/screenshots)")
     config_group.add_argument("--run-info", action="store", type=abs_path,
                               help="Path to directory containing extra json files to add to run info")
     config_group.add_argument("--product", action="store", choices=product_choices,
@@ -216,6 +231,15 @@ scheme host and port.""")
                                 help="Chunk number to run")
     chunking_group.add_argument("--chunk-type", action="store", choices=["none", "equal_time", "hash", "dir_hash"],
                                 default=None, help="Chunking type to use")
+    chunking_group.add_argument("--timings-path", action="store", type=abs_path,
+                                help="Path to a file of recorded test durations, used to balance "
+                                "equal_time chunks and to order tests, and updated with the durations "
+                                "from this run. Every chunk of a run must use the same file, or the "
+                                "chunks may not cover all the tests. Without this, chunks are balanced "
+                                "using test timeouts")
+    chunking_group.add_argument("--merge-timings", action="append", type=abs_path, default=[],
+                                help="Path to a file of test durations recorded by another run "
+                                "or chunk to merge into --timings-path before running")
 
     ssl_group = parser.add_argument_group("SSL/TLS")
     ssl_group.add_argument("--ssl-type", action="store", default=None,
@@ -224,6 +248,9 @@ scheme host and port.""")
 
     ssl_group.add_argument("--openssl-binary", action="store",
                         help="Path to openssl binary", default="openssl")
+    ssl_group.add_argument("--openssl-cert-dir", action="store", type=abs_path,
+                        help="Directory in which certificates generated with openssl are "
+                        "cached for reuse by later runs (wpt run defaults to ~/.cache/wpt/certs)")
     ssl_group.add_argument("--certutil-binary", action="store",
                         help="Path to certutil binary for use with Firefox + ssl")
 
@@ -478,6 +505,16 @@ def check_args(kwargs):
             sys.exit(1)
         kwargs["openssl_binary"] = path
 
+    if kwargs["no_metadata_cache"]:
+        kwargs["metadata_cache_dir"] = None
+
+    if kwargs["reftest_screenshot_cache"]:
+        require_arg(kwargs, "reftest_screenshot_cache_dir")
+
+    if kwargs["merge_timings"] and kwargs["timings_path"] is None:
+        print >> sys.stderr, "--merge-timings requires --timings-path"
+        sys.exit(1)
+
     if kwargs["ssl_type"] != "none" and kwargs["product"] == "firefox" and kwargs["certutil_binary"]:
         path = exe_path(kwargs["certutil_binary"])
         if path is None:
@@ -554,6 +591,11 @@ def create_parser_update(product_choices=None):
     parser.add_argument("--stability", nargs="?", action="store", const="unstable", default=None,
         help=("Reason for disabling tests. When updating test results, disable tests that have "
               "inconsistent results across many runs with the given reason."))
+    parser.add_argument("--full", action="store_true", default=False,
+                        help=("Load and rewrite the expectations for every test, not just the tests "
+                              "in the logs, removing expectations for tests that no longer exist"))
+    parser.add_argument("--processes", action="store", type=int, default=None,
+                        help="Number of processes to use to read the logs (default: number of CPUs)")
     parser.add_argument("--continue", action="store_true", help="Continue a previously started run of the update script")
     parser.add_argument("--abort", action="store_true", help="Clear state from a previous incomplete run of the update script")
     parser.add_argument("--exclude", action="store", nargs="*",
@@ -1,5 +1,4 @@
-import operator
-
+from ..condition import compile_condition
 from ..node import NodeVisitor, DataNode, ConditionalNode, KeyValueNode, ListNode, ValueNode
 from ..parser import parse
 
@@ -137,64 +136,7 @@ class Compiler(NodeVisitor):
         return (lambda x: True, node.data)
 
     def visit_ConditionalNode(self, node):
-        return self.visit(node.children[0]), self.visit(node.children[1])
-
-    def visit_StringNode(self, node):
-        indexes = [self.visit(child) for child in node.children]
-
-        def value(x):
-            rv = node.data
-            for index in indexes:
-                rv = rv[index(x)]
-            return rv
-        return value
-
-    def visit_NumberNode(self, node):
-        if "." in node.data:
-            return lambda x: float(node.data)
-        else:
-            return lambda x: int(node.data)
-
-    def visit_VariableNode(self, node):
-        indexes = [self.visit(child) for child in node.children]
-
-        def value(x):
-            data = x[node.data]
-            for index in indexes:
-                data = data[index(x)]
-            return data
-        return value
-
-    def visit_IndexNode(self, node):
-        assert len(node.children) == 1
-        return self.visit(node.children[0])
-
-    def visit_UnaryExpressionNode(self, node):
-        assert len(node.children) == 2
-        operator = self.visit(node.children[0])
-        operand = self.visit(node.children[1])
-
-        return lambda x: operator(operand(x))
-
-    def visit_BinaryExpressionNode(self, node):
-        assert len(node.children) == 3
-        operator = self.visit(node.children[0])
-        operand_0 = self.visit(node.children[1])
-        operand_1 = self.visit(node.children[2])
-
-        assert operand_0 is not None
-        assert operand_1 is not None
-
-        return lambda x: operator(operand_0(x), operand_1(x))
-
-    def visit_UnaryOperatorNode(self, node):
-        return {"not": operator.not_}[node.data]
-
-    def visit_BinaryOperatorNode(self, node):
-        return {"and": operator.and_,
-                "or": operator.or_,
-                "==": operator.eq,
-                "!=": operator.ne}[node.data]
+        return compile_condition(node.children[0]), self.visit(node.children[1])
 
 
 class ManifestItem(object):
@@ -1,5 +1,4 @@
-import operator
-
+from ..condition import compile_condition, freeze
 from ..node import NodeVisitor
 from ..parser import parse
 
@@ -24,7 +23,7 @@ class Compiler(NodeVisitor):
         """
 
         self._kwargs = kwargs
-        self.expr_data = expr_data
+        self.expr_data = freeze(expr_data)
 
         if data_cls_getter is None:
             self.data_cls_getter = lambda x, y: ManifestItem
@@ -72,56 +71,9 @@ class Compiler(NodeVisitor):
 
     def visit_ConditionalNode(self, node):
         assert len(node.children) == 2
-        if self.visit(node.children[0]):
+        if compile_condition(node.children[0])(self.expr_data):
             return self.visit(node.children[1])
 
-    def visit_StringNode(self, node):
-        value = node.data
-        for child in node.children:
-            value = self.visit(child)(value)
-        return value
-
-    def visit_NumberNode(self, node):
-        if "." in node.data:
-            return float(node.data)
-        else:
-            return int(node.data)
-
-    def visit_VariableNode(self, node):
-        value = self.expr_data[node.data]
-        for child in node.children:
-            value = self.visit(child)(value)
-        return value
-
-    def visit_IndexNode(self, node):
-        assert len(node.children) == 1
-        index = self.visit(node.children[0])
-        return lambda x: x[index]
-
-    def visit_UnaryExpressionNode(self, node):
-        assert len(node.children) == 2
-        operator = self.visit(node.children[0])
-        operand = self.visit(node.children[1])
-
-        return operator(operand)
-
-    def visit_BinaryExpressionNode(self, node):
-        assert len(node.children) == 3
-        operator = self.visit(node.children[0])
-        operand_0 = self.visit(node.children[1])
-        operand_1 = self.visit(node.children[2])
-
-        return operator(operand_0, operand_1)
-
-    def visit_UnaryOperatorNode(self, node):
-        return {"not": operator.not_}[node.data]
-
-    def visit_BinaryOperatorNode(self, node):
-        return {"and": operator.and_,
-                "or": operator.or_,
-                "==": operator.eq,
-                "!=": operator.ne}[node.data]
-
 
 class ManifestItem(object):
     def __init__(self, name, **kwargs):
@@ -0,0 +1,185 @@
+"""Benchmark for the wptmanifest tokenizer and parser.
+
+Generates a synthetic metadata tree, with a mix of the constructs found
+in real expectation metadata: test and subtest headings, conditional
+values, lists, atoms, quoted strings, escapes and comments, along with
+__dir__.ini files. Each file is then tokenized and parsed, and the time
+taken and throughput are reported.
+
+Run with:
+
+    python -m wptrunner.wptmanifest.bench [--files N]
+
+from tools/wptrunner."""
+
+from __future__ import print_function, division
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from .parser import Tokenizer, parse, token_types
+
+conditions = ['os == "linux"',
+              'os == "win"',
+              'debug',
+              'not debug',
+              'os == "mac" and version == "OS X 10.10"',
+              '(os == "linux") and (bits == 64) and not e10s',
+              'webrender or (os == "android" and processor == "x86")',
+              'product == "firefox" and prefs["dom.foo"] == "true"']
+
+statuses = ["PASS", "FAIL", "TIMEOUT", "ERROR", "NOTRUN", "CRASH"]
+
+
+def conditional_value(rng, key, indent, values):
+    lines = ["%s%s:" % (indent, key)]
+    for condition in rng.sample(conditions, rng.randint(1, 4)):
+        lines.append("%s  if %s: %s" % (indent, condition, rng.choice(values)))
+    lines.append("%s  %s" % (indent, rng.choice(values)))
+    return lines
+
+
+def make_test_file(rng, name):
+    lines = ["[%s]" % name.replace("]", "\\]")]
+    if rng.random() < 0.3:
+        lines.extend(conditional_value(rng, "expected", "  ", statuses))
+    elif rng.random() < 0.5:
+        lines.append("  expected: %s  # comment" % rng.choice(statuses))
+    if rng.random() < 0.2:
+        lines.append("  disabled:")
+        lines.append("    if %s: https://bugzilla.mozilla.org/show_bug.cgi?id=%i" %
+                     (rng.choice(conditions), rng.randint(1, 1500000)))
+    if rng.random() < 0.1:
+        lines.append("  prefs: [dom.foo:true, 'layout.bar:1', @Reset]")
+    for i in xrange(rng.choice([0, 1, 2, 5, 10, 30])):
+        lines.append("")
+        lines.append("  [subtest %i: \\u00e9l\\xe9ment with \"quotes\" and [brackets\\]]" % i)
+        if rng.random() < 0.5:
+            lines.extend(conditional_value(rng, "expected", "    ", statuses))
+        else:
+            lines.append("    expected: [%s]" % ", ".join(rng.sample(statuses, 2)))
+    return "\n".join(lines) + "\n"
+
+
+def make_dir_file(rng):
+    lines = ["lsan-allowed: [Alloc, Create, Malloc]",
+             "leak-threshold: [default:51200, tab:10000]"]
+    if rng.random() < 0.5:
+        lines.extend(conditional_value(rng, "disabled", "", ["true", "false"]))
+    if rng.random() < 0.5:
+        lines.append("tags: [\"foo\", 'bar']")
+    return "\n".join(lines) + "\n"
+
+
+def create_tree(path, count=10000, seed=0):
+    """Create count test metadata files, in a directory tree, under path.
+
+    Returns the list of paths to the files created, including the
+    __dir__.ini files."""
+    rng = random.Random(seed)
+    rv = []
+    for i in xrange(count):
+        dir_path = os.path.join(path, "dir%i" % (i // 500), "sub%i" % (i // 25))
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+            if rng.random() < 0.3:
+                dir_file = os.path.join(dir_path, "__dir__.ini")
+                with open(dir_file, "w") as f:
+                    f.write(make_dir_file(rng))
+                rv.append(dir_file)
+        name = "test-%i.html" % i
+        file_path = os.path.join(dir_path, name + ".ini")
+        with open(file_path, "w") as f:
+            f.write(make_test_file(rng, name))
+        rv.append(file_path)
+    return rv
+
+
+def tokenize(data):
+    for token in Tokenizer().tokenize(data):
+        if token[0] == token_types.eof:
+            break
+
+
+def time_files(func, contents):
+    start = time.time()
+    for data in contents:
+        func(data)
+    return time.time() - start
+
+
+def run_benchmark(paths, repeat=3):
+    """Time tokenizing and parsing the files at paths, taking the fastest
+    of repeat runs"""
+    contents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    size = sum(len(item) for item in contents)
+
+    results = {"files": len(contents), "bytes": size}
+    for name, func in [("tokenize", tokenize), ("parse", parse)]:
+        elapsed = min(time_files(func, contents) for _ in xrange(repeat))
+        results[name] = {"seconds": elapsed,
+                         "files_per_second": len(contents) / elapsed if elapsed else None,
+                         "mb_per_second": size / elapsed / 1e6 if elapsed else None}
+    return results
+
+
+def format_results(results):
+    lines = ["%i files, %.1f MB" % (results["files"], results["bytes"] / 1e6),
+             "%-10s %10s %12s %10s" % ("", "seconds", "files/s", "MB/s")]
+    for name in ["tokenize", "parse"]:
+        item = results[name]
+        lines.append("%-10s %10.2f %12.0f %10.2f" % (name,
+                                                     item["seconds"],
+                                                     item["files_per_second"] or 0,
+                                                     item["mb_per_second"] or 0))
+    return "\n".join(lines)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the wptmanifest parser")
+    parser.add_argument("--files", "-n", action="store", type=int, default=10000,
+                        help="Number of test metadata files to generate")
+    parser.add_argument("--repeat", action="store", type=int, default=3,
+                        help="Number of times to parse the files; the fastest run is reported")
+    parser.add_argument("--seed", action="store", type=int, default=0,
+                        help="Seed for generating the metadata files")
+    parser.add_argument("--path", action="store",
+                        help="Directory in which to generate the metadata, which is kept "
+                        "(default: a temporary directory that is removed afterwards)")
+    parser.add_argument("--json", action="store", dest="json_path",
+                        help="Path to write the results to as JSON")
+    return parser
+
+
+def run(files=10000, repeat=3, seed=0, path=None, json_path=None):
+    tree_path = path if path is not None else tempfile.mkdtemp()
+    try:
+        paths = create_tree(tree_path, files, seed)
+        results = run_benchmark(paths, repeat)
+    finally:
+        if path is None:
+            shutil.rmtree(tree_path)
+    print(format_results(results))
+    if json_path is not None:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def main():
+    kwargs = vars(get_parser().parse_args())
+    run(**kwargs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
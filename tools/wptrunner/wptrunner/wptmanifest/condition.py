@@ -0,0 +1,142 @@
+"""Compilation of conditional expressions into predicate functions.
+
+The expression of each ConditionalNode is translated into the source
+of an equivalent Python expression, which is compiled into a function of
+run_info. Compiled conditions are interned by that source, so a condition
+that appears in many files, like `os == "linux" and debug`, is only
+compiled once per process. When called with a FrozenRunInfo, the result
+of a condition is memoised, so evaluating the same condition for the
+same run_info again is a dictionary lookup."""
+
+unary_operators = {"not": "not"}
+
+binary_operators = {"and": "&",
+                    "or": "|",
+                    "==": "==",
+                    "!=": "!="}
+
+
+class FrozenRunInfo(dict):
+    """Immutable, hashable, copy of a run_info dictionary.
+
+    Nested dictionaries are frozen and lists are converted to tuples.
+    Raises TypeError if run_info contains a value that can't be made
+    hashable."""
+
+    def __init__(self, run_info):
+        dict.__init__(self, ((key, freeze_value(value))
+                             for key, value in run_info.iteritems()))
+        self._hash = hash(frozenset(self.iteritems()))
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("%s is immutable" % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+
+def freeze_value(value):
+    if isinstance(value, FrozenRunInfo):
+        return value
+    if isinstance(value, dict):
+        return FrozenRunInfo(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_value(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def freeze(run_info):
+    """Get a FrozenRunInfo for run_info, so that conditions called with it
+    memoise their results.
+
+    A FrozenRunInfo, or a run_info that can't be frozen, is returned
+    unchanged."""
+    if isinstance(run_info, FrozenRunInfo):
+        return run_info
+    try:
+        return FrozenRunInfo(run_info)
+    except TypeError:
+        return run_info
+
+
+class CompiledCondition(object):
+    """Predicate function for a conditional expression.
+
+    Calling the condition with a run_info dictionary evaluates the
+    expression with the variables taken from the run_info; as when the
+    expression is evaluated by walking the AST, a KeyError is raised if a
+    variable is missing. Results for a FrozenRunInfo are memoised.
+
+    :param source: Python source of the expression, in terms of a run_info
+                   dictionary named x
+    """
+    __slots__ = ("source", "func", "results")
+
+    def __init__(self, source):
+        self.source = source
+        self.func = eval("lambda x: %s" % source, {"__builtins__": {}})
+        self.results = {}
+
+    def __repr__(self):
+        return "<CompiledCondition %s>" % self.source
+
+    def __call__(self, run_info):
+        if not isinstance(run_info, FrozenRunInfo):
+            return self.func(run_info)
+        results = self.results
+        if run_info in results:
+            return results[run_info]
+        rv = results[run_info] = self.func(run_info)
+        return rv
+
+
+def expression_source(node):
+    """Get the source of a Python expression equivalent to the wptmanifest
+    expression AST rooted at node"""
+    # This runs for every conditional value in every metadata file, so
+    # dispatch inline rather than with a NodeVisitor
+    name = node.__class__.__name__
+    children = node.children
+    if name == "BinaryExpressionNode":
+        assert len(children) == 3
+        return "(%s %s %s)" % (expression_source(children[1]),
+                               binary_operators[children[0].data],
+                               expression_source(children[2]))
+    elif name == "UnaryExpressionNode":
+        assert len(children) == 2
+        return "(%s %s)" % (unary_operators[children[0].data],
+                            expression_source(children[1]))
+    elif name == "NumberNode":
+        if "." in node.data:
+            return repr(float(node.data))
+        return repr(int(node.data))
+    elif name == "VariableNode":
+        rv = "x[%r]" % node.data
+    elif name == "StringNode":
+        rv = repr(node.data)
+    else:
+        raise ValueError("Unexpected %s in conditional expression" % name)
+    for index_node in children:
+        rv += "[%s]" % expression_source(index_node.children[0])
+    return rv
+
+
+# Table of all the conditions compiled so far, keyed by their source
+_conditions = {}
+
+
+def compile_condition(node):
+    """Get the interned CompiledCondition for the expression AST rooted at
+    node"""
+    source = expression_source(node)
+    condition = _conditions.get(source)
+    if condition is None:
+        condition = _conditions.setdefault(source, CompiledCondition(source))
+    return condition
@@ -14,6 +14,7 @@
 
 from __future__ import unicode_literals
 
+import re
 from cStringIO import StringIO
 
 from node import (AtomNode, BinaryExpressionNode, BinaryOperatorNode,
@@ -44,6 +45,22 @@ binary_operators = ["==", "!=", "and", "or"]
 
 operators = ["==", "!=", "not", "and", "or"]
 
+hex_digits = "0123456789abcdefABCDEF"
+escapes = {"a": "\a", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+number_end_chars = parens + operator_chars + " :"
+
+# Runs of characters that need no special handling in each state
+whitespace_re = re.compile(" *")
+heading_re = re.compile(r"[^\\\]]+")
+key_re = re.compile(r"[^\\ :]+")
+list_value_re = re.compile(r"[^\\#, \]]+")
+value_re = re.compile(r"[^\\# ]+")
+string_res = {"'": re.compile(r"[^\\']+"),
+              '"': re.compile(r'[^\\"]+')}
+operator_re = re.compile("[%s]+" % operator_chars)
+number_re = re.compile(r"[0-9.]*")
+ident_re = re.compile(r"[^.\[\]()=! :]*")
+
 atoms = {"True": True,
          "False": False,
          "Reset": object()}
@@ -66,14 +83,25 @@ token_types = TokenTypes()
 
 
 class Tokenizer(object):
+    """Tokenizer for the manifest format.
+
+    Input is processed one line at a time. Each state handles the part of
+    the line it applies to and returns the state to use for the rest of the
+    line, or None at the end of the line. Runs of characters that don't
+    need any special handling are matched with regular expressions rather
+    than being consumed one character at a time."""
+
     def __init__(self):
         self.reset()
 
     def reset(self):
         self.indent_levels = [0]
-        self.state = self.line_start_state
         self.next_state = self.data_line_state
         self.line_number = 0
+        self.filename = ""
+        self.line = ""
+        self.index = 0
+        self.tokens = []
 
     def tokenize(self, stream):
         self.reset()
@@ -88,21 +116,22 @@ class Tokenizer(object):
         self.next_line_state = self.line_start_state
         for i, line in enumerate(stream):
             assert isinstance(line, str)
-            self.state = self.next_line_state
-            assert self.state is not None
-            states = []
-            self.next_line_state = None
+            state = self.next_line_state
+            self.next_line_state = self.line_start_state
             self.line_number = i + 1
             self.index = 0
             self.line = line.decode('utf-8').rstrip()
-            assert isinstance(self.line, unicode)
-            while self.state != self.eol_state:
-                states.append(self.state)
-                tokens = self.state()
-                if tokens:
-                    for token in tokens:
-                        yield token
-            self.state()
+            self.tokens = tokens = []
+            error = None
+            try:
+                while state is not None:
+                    state = state()
+            except ParseError as e:
+                error = e
+            for token in tokens:
+                yield token
+            if error is not None:
+                raise error
         while True:
             yield (token_types.eof, None)
 
@@ -115,29 +144,20 @@ class Tokenizer(object):
         if self.index < len(self.line):
             self.index += 1
 
-    def peek(self, length):
-        return self.line[self.index:self.index + length]
-
     def skip_whitespace(self):
-        while self.char() == " ":
-            self.consume()
-
-    def eol_state(self):
-        if self.next_line_state is None:
-            self.next_line_state = self.line_start_state
+        self.index = whitespace_re.match(self.line, self.index).end()
 
     def line_start_state(self):
         self.skip_whitespace()
-        if self.char() == eol:
-            self.state = self.eol_state
-            return
+        if self.index == len(self.line):
+            return None
         if self.index > self.indent_levels[-1]:
             self.indent_levels.append(self.index)
-            yield (token_types.group_start, None)
+            self.tokens.append((token_types.group_start, None))
         else:
             while self.index < self.indent_levels[-1]:
                 self.indent_levels.pop()
-                yield (token_types.group_end, None)
+                self.tokens.append((token_types.group_end, None))
                 # This is terrible; if we were parsing an expression
                 # then the next_state will be expr_or_value but when we deindent
                 # it must always be a heading or key next so we go back to data_line_state
@@ -145,39 +165,45 @@ class Tokenizer(object):
             if self.index != self.indent_levels[-1]:
                 raise ParseError(self.filename, self.line_number, "Unexpected indent")
 
-        self.state = self.next_state
+        return self.next_state
 
     def data_line_state(self):
         if self.char() == "[":
-            yield (token_types.paren, self.char())
-            self.consume()
-            self.state = self.heading_state
-        else:
-            self.state = self.key_state
+            self.tokens.append((token_types.paren, "["))
+            self.index += 1
+            return self.heading_state
+        return self.key_state
 
     def heading_state(self):
+        line = self.line
         rv = ""
         while True:
+            m = heading_re.match(line, self.index)
+            if m:
+                rv += m.group()
+                self.index = m.end()
             c = self.char()
             if c == "\\":
                 rv += self.consume_escape()
             elif c == "]":
                 break
-            elif c == eol:
-                raise ParseError(self.filename, self.line_number, "EOL in heading")
             else:
-                rv += c
-                self.consume()
+                raise ParseError(self.filename, self.line_number, "EOL in heading")
 
-        yield (token_types.string, decode(rv))
-        yield (token_types.paren, "]")
-        self.consume()
-        self.state = self.line_end_state
+        self.tokens.append((token_types.string, decode(rv)))
+        self.tokens.append((token_types.paren, "]"))
+        self.index += 1
         self.next_state = self.data_line_state
+        return self.line_end_state
 
     def key_state(self):
+        line = self.line
         rv = ""
         while True:
+            m = key_re.match(line, self.index)
+            if m:
+                rv += m.group()
+                self.index = m.end()
             c = self.char()
             if c == " ":
                 self.skip_whitespace()
@@ -188,269 +214,210 @@ class Tokenizer(object):
                 break
             elif c == eol:
                 raise ParseError(self.filename, self.line_number, "EOL in key name (missing ':'?)")
-            elif c == "\\":
-                rv += self.consume_escape()
             else:
-                rv += c
-                self.consume()
-        yield (token_types.string, decode(rv))
-        yield (token_types.separator, ":")
-        self.consume()
-        self.state = self.after_key_state
+                rv += self.consume_escape()
+        self.tokens.append((token_types.string, decode(rv)))
+        self.tokens.append((token_types.separator, ":"))
+        self.index += 1
+        return self.after_key_state
 
     def after_key_state(self):
         self.skip_whitespace()
         c = self.char()
-        if c == "#":
-            self.next_state = self.expr_or_value_state
-            self.state = self.comment_state
-        elif c == eol:
+        if c == "#" or c == eol:
             self.next_state = self.expr_or_value_state
-            self.state = self.eol_state
+            return None
         elif c == "[":
-            self.state = self.list_start_state
+            return self.list_start_state
         else:
-            self.state = self.value_state
+            return self.value_state
 
     def list_start_state(self):
-        yield (token_types.list_start, "[")
-        self.consume()
-        self.state = self.list_value_start_state
+        self.tokens.append((token_types.list_start, "["))
+        self.index += 1
+        return self.list_value_start_state
 
     def list_value_start_state(self):
         self.skip_whitespace()
-        if self.char() == "]":
-            self.state = self.list_end_state
-        elif self.char() in ("'", '"'):
-            quote_char = self.char()
-            self.consume()
-            yield (token_types.string, self.consume_string(quote_char))
+        c = self.char()
+        if c == "]":
+            return self.list_end_state
+        elif c in ("'", '"'):
+            self.index += 1
+            self.tokens.append((token_types.string, self.consume_string(c)))
             self.skip_whitespace()
-            if self.char() == "]":
-                self.state = self.list_end_state
-            elif self.char() != ",":
+            c = self.char()
+            if c == "]":
+                state = self.list_end_state
+            elif c != ",":
                 raise ParseError(self.filename, self.line_number, "Junk after quoted string")
+            else:
+                state = self.list_value_start_state
             self.consume()
-        elif self.char() == "#":
-            self.state = self.comment_state
-            self.next_line_state = self.list_value_start_state
-        elif self.char() == eol:
+            return state
+        elif c == "#" or c == eol:
             self.next_line_state = self.list_value_start_state
-            self.state = self.eol_state
-        elif self.char() == ",":
+            return None
+        elif c == ",":
             raise ParseError(self.filename, self.line_number, "List item started with separator")
-        elif self.char() == "@":
-            self.state = self.list_value_atom_state
+        elif c == "@":
+            self.index += 1
+            return self.list_value_state(token_types.atom)
         else:
-            self.state = self.list_value_state
+            return self.list_value_state()
 
-    def list_value_state(self):
+    def list_value_state(self, token_type=token_types.string):
+        line = self.line
         rv = ""
         spaces = 0
         while True:
+            m = list_value_re.match(line, self.index)
+            if m:
+                rv += " " * spaces + m.group()
+                spaces = 0
+                self.index = m.end()
             c = self.char()
             if c == "\\":
-                escape = self.consume_escape()
-                rv += escape
+                rv += self.consume_escape()
             elif c == eol:
                 raise ParseError(self.filename, self.line_number, "EOL in list value")
             elif c == "#":
                 raise ParseError(self.filename, self.line_number, "EOL in list value (comment)")
             elif c == ",":
-                self.state = self.list_value_start_state
-                self.consume()
+                state = self.list_value_start_state
+                self.index += 1
                 break
             elif c == " ":
                 spaces += 1
-                self.consume()
-            elif c == "]":
-                self.state = self.list_end_state
-                self.consume()
-                break
+                self.index += 1
             else:
-                rv += " " * spaces
-                spaces = 0
-                rv += c
-                self.consume()
+                state = self.list_end_state
+                self.index += 1
+                break
 
         if rv:
-            yield (token_types.string, decode(rv))
-
-    def list_value_atom_state(self):
-        self.consume()
-        for _, value in self.list_value_state():
-            yield token_types.atom, value
+            self.tokens.append((token_type, decode(rv)))
+        return state
 
     def list_end_state(self):
         self.consume()
-        yield (token_types.list_end, "]")
-        self.state = self.line_end_state
+        self.tokens.append((token_types.list_end, "]"))
+        return self.line_end_state
 
     def value_state(self):
         self.skip_whitespace()
-        if self.char() in ("'", '"'):
-            quote_char = self.char()
-            self.consume()
-            yield (token_types.string, self.consume_string(quote_char))
+        c = self.char()
+        if c in ("'", '"'):
+            self.index += 1
+            self.tokens.append((token_types.string, self.consume_string(c)))
             if self.char() == "#":
-                self.state = self.comment_state
-            else:
-                self.state = self.line_end_state
-        elif self.char() == "@":
-            self.consume()
-            for _, value in self.value_inner_state():
-                yield token_types.atom, value
+                return None
+            return self.line_end_state
+        elif c == "@":
+            self.index += 1
+            return self.value_inner_state(token_types.atom)
         else:
-            self.state = self.value_inner_state
+            return self.value_inner_state()
 
-    def value_inner_state(self):
+    def value_inner_state(self, token_type=token_types.string):
+        line = self.line
         rv = ""
         spaces = 0
         while True:
+            m = value_re.match(line, self.index)
+            if m:
+                rv += " " * spaces + m.group()
+                spaces = 0
+                self.index = m.end()
             c = self.char()
             if c == "\\":
                 rv += self.consume_escape()
-            elif c == "#":
-                self.state = self.comment_state
-                break
             elif c == " ":
                 # prevent whitespace before comments from being included in the value
-                spaces += 1
-                self.consume()
-            elif c == eol:
-                self.state = self.line_end_state
-                break
+                end = whitespace_re.match(line, self.index).end()
+                spaces += end - self.index
+                self.index = end
             else:
-                rv += " " * spaces
-                spaces = 0
-                rv += c
-                self.consume()
-        yield (token_types.string, decode(rv))
-
-    def comment_state(self):
-        while self.char() is not eol:
-            self.consume()
-        self.state = self.eol_state
+                # Either a comment or the end of the line
+                break
+        self.tokens.append((token_type, decode(rv)))
+        return None
 
     def line_end_state(self):
         self.skip_whitespace()
         c = self.char()
-        if c == "#":
-            self.state = self.comment_state
-        elif c == eol:
-            self.state = self.eol_state
-        else:
+        if c != "#" and c != eol:
             raise ParseError(self.filename, self.line_number, "Junk before EOL %s" % c)
+        return None
 
     def consume_string(self, quote_char):
+        line = self.line
+        string_re = string_res[quote_char]
         rv = ""
         while True:
+            m = string_re.match(line, self.index)
+            if m:
+                rv += m.group()
+                self.index = m.end()
             c = self.char()
             if c == "\\":
                 rv += self.consume_escape()
             elif c == quote_char:
-                self.consume()
+                self.index += 1
                 break
-            elif c == eol:
-                raise ParseError(self.filename, self.line_number, "EOL in quoted string")
             else:
-                rv += c
-                self.consume()
+                raise ParseError(self.filename, self.line_number, "EOL in quoted string")
 
         return decode(rv)
 
     def expr_or_value_state(self):
-        if self.peek(3) == "if ":
-            self.state = self.expr_state
-        else:
-            self.state = self.value_state
+        if self.line.startswith("if ", self.index):
+            return self.expr_state
+        return self.value_state
 
     def expr_state(self):
-        self.skip_whitespace()
-        c = self.char()
-        if c == eol:
-            raise ParseError(self.filename, self.line_number, "EOL in expression")
-        elif c in "'\"":
-            self.consume()
-            yield (token_types.string, self.consume_string(c))
-        elif c == "#":
-            raise ParseError(self.filename, self.line_number, "Comment before end of expression")
-        elif c == ":":
-            yield (token_types.separator, c)
-            self.consume()
-            self.state = self.value_state
-        elif c in parens:
-            self.consume()
-            yield (token_types.paren, c)
-        elif c in ("!", "="):
-            self.state = self.operator_state
-        elif c in digits:
-            self.state = self.digit_state
-        else:
-            self.state = self.ident_state
-
-    def operator_state(self):
-        # Only symbolic operators
-        index_0 = self.index
-        while True:
-            c = self.char()
-            if c == eol:
-                break
-            elif c in operator_chars:
-                self.consume()
-            else:
-                self.state = self.expr_state
-                break
-        yield (token_types.ident, self.line[index_0:self.index])
-
-    def digit_state(self):
-        index_0 = self.index
-        seen_dot = False
+        line = self.line
+        length = len(line)
+        tokens = self.tokens
+        index = self.index
         while True:
-            c = self.char()
-            if c == eol:
-                break
-            elif c in digits:
-                self.consume()
-            elif c == ".":
-                if seen_dot:
-                    raise ParseError(self.filename, self.line_number, "Invalid number")
-                self.consume()
-                seen_dot = True
-            elif c in parens:
-                break
-            elif c in operator_chars:
-                break
-            elif c == " ":
-                break
+            index = whitespace_re.match(line, index).end()
+            if index == length:
+                raise ParseError(self.filename, self.line_number, "EOL in expression")
+            c = line[index]
+            if c in "'\"":
+                self.index = index + 1
+                tokens.append((token_types.string, self.consume_string(c)))
+                index = self.index
+            elif c == "#":
+                raise ParseError(self.filename, self.line_number, "Comment before end of expression")
             elif c == ":":
-                break
-            else:
-                raise ParseError(self.filename, self.line_number, "Invalid character in number")
-
-        self.state = self.expr_state
-        yield (token_types.number, self.line[index_0:self.index])
-
-    def ident_state(self):
-        index_0 = self.index
-        while True:
-            c = self.char()
-            if c == eol:
-                break
-            elif c == ".":
-                break
+                tokens.append((token_types.separator, c))
+                self.index = index + 1
+                return self.value_state
             elif c in parens:
-                break
+                index += 1
+                tokens.append((token_types.paren, c))
             elif c in operator_chars:
-                break
-            elif c == " ":
-                break
-            elif c == ":":
-                break
+                # Only symbolic operators
+                m = operator_re.match(line, index)
+                index = m.end()
+                tokens.append((token_types.ident, m.group()))
+            elif c in digits:
+                m = number_re.match(line, index)
+                if m.group().count(".") > 1:
+                    raise ParseError(self.filename, self.line_number, "Invalid number")
+                index = m.end()
+                if index < length and line[index] not in number_end_chars:
+                    raise ParseError(self.filename, self.line_number, "Invalid character in number")
+                tokens.append((token_types.number, m.group()))
             else:
-                self.consume()
-        self.state = self.expr_state
-        yield (token_types.ident, self.line[index_0:self.index])
+                m = ident_re.match(line, index)
+                if not m.group():
+                    raise ParseError(self.filename, self.line_number,
+                                     "Invalid character in expression %s" % c)
+                index = m.end()
+                tokens.append((token_types.ident, m.group()))
 
     def consume_escape(self):
         assert self.char() == "\\"
@@ -463,8 +430,8 @@ class Tokenizer(object):
             return self.decode_escape(4)
         elif c == "U":
             return self.decode_escape(6)
-        elif c in ["a", "b", "f", "n", "r", "t", "v"]:
-            return eval("'\%s'" % c)
+        elif c in escapes:
+            return escapes[c]
         elif c is eol:
             raise ParseError(self.filename, self.line_number, "EOL in escape")
         else:
@@ -481,14 +448,9 @@ class Tokenizer(object):
         return unichr(value)
 
     def escape_value(self, c):
-        if '0' <= c <= '9':
-            return ord(c) - ord('0')
-        elif 'a' <= c <= 'f':
-            return ord(c) - ord('a') + 10
-        elif 'A' <= c <= 'F':
-            return ord(c) - ord('A') + 10
-        else:
-            raise ParseError(self.filename, self.line_number, "Invalid character escape")
+        if c is not eol and c in hex_digits:
+            return int(c, 16)
+        raise ParseError(self.filename, self.line_number, "Invalid character escape")
 
 
 class Parser(object):
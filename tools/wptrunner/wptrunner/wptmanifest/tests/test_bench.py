@@ -0,0 +1,33 @@
+import shutil
+import tempfile
+import unittest
+
+from .. import bench
+from ..parser import parse
+
+
+class BenchTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_create_tree(self):
+        paths = bench.create_tree(self.path, 50, seed=1)
+        self.assertTrue(len(paths) >= 50)
+        for path in paths:
+            with open(path) as f:
+                parse(f)
+
+    def test_run_benchmark(self):
+        paths = bench.create_tree(self.path, 10)
+        results = bench.run_benchmark(paths, repeat=1)
+        self.assertEquals(results["files"], len(paths))
+        for name in ["tokenize", "parse"]:
+            self.assertTrue(results[name]["seconds"] >= 0)
+        self.assertIn("parse", bench.format_results(results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import pickle
+import unittest
+from cStringIO import StringIO
+
+from .. import condition
+from ..parser import parse
+
+
+class TestCondition(unittest.TestCase):
+    def compile(self, expr):
+        tree = parse(StringIO("key:\n  if %s: value\n" % expr))
+        conditional_node = tree.children[0].children[0]
+        return condition.compile_condition(conditional_node.children[0])
+
+    def test_source(self):
+        self.assertEquals(self.compile('os == "linux" and not debug').source,
+                          "((x[u'os'] == u'linux') & (not x[u'debug']))")
+        self.assertEquals(self.compile('a[1] == "ab"[1] or b != 1.5').source,
+                          "((x[u'a'][1] == u'ab'[1]) | (x[u'b'] != 1.5))")
+
+    def test_evaluate(self):
+        cond = self.compile('(os == "linux" or os == "mac") and not debug')
+        self.assertTrue(cond({"os": "linux", "debug": False}))
+        self.assertTrue(cond({"os": "mac", "debug": False}))
+        self.assertFalse(cond({"os": "mac", "debug": True}))
+        self.assertFalse(cond({"os": "win", "debug": False}))
+        self.assertTrue(self.compile('prefs["dom.foo"] == "true"')({"prefs": {"dom.foo": "true"}}))
+        with self.assertRaises(KeyError):
+            cond({"os": "linux"})
+
+    def test_interned(self):
+        self.assertIs(self.compile('os == "linux" and debug'),
+                      self.compile('os=="linux"   and debug'))
+        self.assertIsNot(self.compile('os == "linux" and debug'),
+                         self.compile('os == "linux" or debug'))
+
+    def test_memoised(self):
+        cond = self.compile('os == "win" and bits == 32')
+        run_info = condition.freeze({"os": "win", "bits": 32})
+        self.assertTrue(cond(run_info))
+        self.assertEquals(cond.results, {run_info: True})
+        self.assertTrue(cond(condition.freeze({"os": "win", "bits": 32})))
+        self.assertEquals(len(cond.results), 1)
+
+        # Unfrozen run_info isn't memoised
+        self.assertFalse(cond({"os": "win", "bits": 64}))
+        self.assertEquals(len(cond.results), 1)
+
+    def test_freeze(self):
+        run_info = {"os": "linux", "prefs": {"a": [1, 2]}, "tags": set(["b"])}
+        frozen = condition.freeze(run_info)
+        self.assertIsInstance(frozen, condition.FrozenRunInfo)
+        self.assertIs(condition.freeze(frozen), frozen)
+        self.assertEquals(frozen["prefs"], {"a": (1, 2)})
+        self.assertEquals(hash(frozen), hash(condition.freeze(run_info)))
+        self.assertEquals(pickle.loads(pickle.dumps(frozen)), frozen)
+        with self.assertRaises(TypeError):
+            frozen["os"] = "win"
+
+        unhashable = {"os": bytearray("linux")}
+        self.assertIs(condition.freeze(unhashable), unhashable)
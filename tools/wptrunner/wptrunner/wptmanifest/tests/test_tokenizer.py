@@ -340,5 +340,39 @@ key:
              (token_types.separator, ":"),
              (token_types.string, "value")])
 
+    def test_expr_11(self):
+        with self.assertRaises(parser.ParseError):
+            self.tokenize(
+                """
+key:
+  if a.b: value""")
+
+    def test_expr_12(self):
+        with self.assertRaises(parser.ParseError):
+            self.tokenize(
+                """
+key:
+  if a ==""")
+
+    def test_escape_0(self):
+        self.compare(r"""key: a\x41\u00e9\t b""",
+                     [(token_types.string, "key"),
+                      (token_types.separator, ":"),
+                      (token_types.string, u"aA\u00e9\t b")])
+
+    def test_escape_1(self):
+        with self.assertRaises(parser.ParseError):
+            self.tokenize(r"""key: \xg1""")
+
+    def test_list_escape(self):
+        self.compare(r"""key: [a\,b, c\]]""",
+                     [(token_types.string, "key"),
+                      (token_types.separator, ":"),
+                      (token_types.list_start, "["),
+                      (token_types.string, "a,b"),
+                      (token_types.string, "c]"),
+                      (token_types.list_end, "]")])
+
+
 if __name__ == "__main__":
     unittest.main()
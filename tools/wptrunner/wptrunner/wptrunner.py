@@ -9,6 +9,7 @@ from wptserve import sslutils
 import environment as env
 import products
 import testloader
+import timings
 import wptcommandline
 import wptlogging
 import wpttest
@@ -41,7 +42,7 @@ def setup_logging(*args, **kwargs):
     logger = wptlogging.setup(*args, **kwargs)
 
 
-def get_loader(test_paths, product, debug=None, run_info_extras=None, **kwargs):
+def get_loader(test_paths, product, debug=None, run_info_extras=None, durations=None, **kwargs):
     if run_info_extras is None:
         run_info_extras = {}
 
@@ -74,7 +75,9 @@ def get_loader(test_paths, product, debug=None, run_info_extras=None, **kwargs):
                                         total_chunks=kwargs["total_chunks"],
                                         chunk_number=kwargs["this_chunk"],
                                         include_https=ssl_enabled,
-                                        skip_timeout=kwargs["skip_timeout"])
+                                        skip_timeout=kwargs["skip_timeout"],
+                                        durations=durations,
+                                        metadata_cache_dir=kwargs["metadata_cache_dir"])
     return run_info, test_loader
 
 
@@ -148,6 +151,14 @@ def run_tests(config, test_paths, product, **kwargs):
                 ahem=os.path.join(kwargs["tests_root"], "fonts/Ahem.ttf")
             ))
 
+        timings_path = kwargs.get("timings_path")
+        if timings_path:
+            timing_store = timings.load(timings_path, kwargs.get("merge_timings"), logger)
+            durations = timing_store.durations(product)
+        else:
+            timing_store = None
+            durations = None
+
         if "test_loader" in kwargs:
             run_info = wpttest.get_run_info(kwargs["run_info"], product,
                                             browser_version=kwargs.get("browser_version"),
@@ -158,9 +169,11 @@ def run_tests(config, test_paths, product, **kwargs):
             run_info, test_loader = get_loader(test_paths,
                                                product,
                                                run_info_extras=run_info_extras(**kwargs),
+                                               durations=durations,
                                                **kwargs)
 
-        test_source_kwargs = {"processes": kwargs["processes"]}
+        test_source_kwargs = {"processes": kwargs["processes"],
+                              "durations": durations}
         if kwargs["run_by_dir"] is False:
             test_source_cls = testloader.SingleTestSource
         else:
@@ -176,7 +189,8 @@ def run_tests(config, test_paths, product, **kwargs):
         kwargs["pause_after_test"] = get_pause_after_test(test_loader, **kwargs)
 
         ssl_config = {"type": kwargs["ssl_type"],
-                      "openssl": {"openssl_binary": kwargs["openssl_binary"]},
+                      "openssl": {"openssl_binary": kwargs["openssl_binary"],
+                                  "base_path": kwargs.get("openssl_cert_dir")},
                       "pregenerated": {"host_key_path": kwargs["host_key_path"],
                                        "host_cert_path": kwargs["host_cert_path"],
                                        "ca_cert_path": kwargs["ca_cert_path"]}}
@@ -186,7 +200,8 @@ def run_tests(config, test_paths, product, **kwargs):
                                  kwargs["debug_info"],
                                  env_options,
                                  ssl_config,
-                                 env_extras) as test_environment:
+                                 env_extras) as test_environment, \
+                timings.record(logger, timing_store, product, timings_path):
             try:
                 test_environment.ensure_started()
             except env.TestEnvironmentError as e:
@@ -271,7 +286,9 @@ def run_tests(config, test_paths, product, **kwargs):
                                       kwargs["pause_after_test"],
                                       kwargs["pause_on_unexpected"],
                                       kwargs["restart_on_unexpected"],
-                                      kwargs["debug_info"]) as manager_group:
+                                      kwargs["debug_info"],
+                                      kwargs["spare_browser"] and
+                                      kwargs["debug_info"] is None) as manager_group:
                         try:
                             manager_group.run(test_type, run_tests)
                         except KeyboardInterrupt:
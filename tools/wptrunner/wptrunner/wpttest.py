@@ -1,5 +1,6 @@
 import os
 import subprocess
+import urlparse
 from collections import defaultdict
 
 from wptmanifest.parser import atoms
@@ -108,6 +109,61 @@ class RunInfo(dict):
         mozinfo.find_and_update_from_json(*dirs)
 
 
+class TestDescriptor(object):
+    """Description of a test holding just the data needed to run it.
+
+    This is what is sent to the TestRunner process for each test, in
+    place of the Test itself; the expectation metadata stays with the
+    TestRunnerManager.
+
+    :param test_type: The type of the test e.g. "testharness"
+    :param url: The URL of the test, which is also its id
+    :param timeout: Timeout for the test in seconds
+    :param environment: Dictionary describing the environment the test
+                        needs, with keys "protocol" and "prefs"
+    :param expected: The expected status of the test
+    :param abs_path: Absolute path to the test file, or None
+    :param references: For reftests, a list of (TestDescriptor, relation)
+                       tuples
+    :param viewport_size: For reftests, the viewport size or None
+    :param dpi: For reftests, the dpi or None
+    :param fuzzy: For reftests, a dictionary of {reference url or None:
+                  ((min, max) max difference, (min, max) total pixels)}
+                  giving the allowed differences from each reference
+    """
+
+    def __init__(self, test_type, url, timeout, environment, expected, abs_path=None,
+                 references=None, viewport_size=None, dpi=None, fuzzy=None):
+        self.test_type = test_type
+        self.url = url
+        self.timeout = timeout
+        self.environment = environment
+        self._expected = expected
+        self.abs_path = abs_path
+        self.references = references if references is not None else []
+        self.viewport_size = viewport_size
+        self.dpi = dpi
+        self.fuzzy = fuzzy if fuzzy is not None else {}
+
+    @property
+    def id(self):
+        return self.url
+
+    @property
+    def result_cls(self):
+        return manifest_test_cls[self.test_type].result_cls
+
+    @property
+    def subtest_result_cls(self):
+        return manifest_test_cls[self.test_type].subtest_result_cls
+
+    def expected(self):
+        return self._expected
+
+    def __repr__(self):
+        return "<%s.%s %s>" % (self.__module__, self.__class__.__name__, self.id)
+
+
 class Test(object):
 
     result_cls = None
@@ -135,6 +191,22 @@ class Test(object):
             metadata = {}
         return metadata
 
+    @property
+    def descriptor(self):
+        """TestDescriptor for the test, which is sent to the TestRunner
+        process to run it"""
+        if getattr(self, "_descriptor", None) is None:
+            self._descriptor = self._make_descriptor({})
+        return self._descriptor
+
+    def _make_descriptor(self, nodes):
+        return TestDescriptor(self.test_type,
+                              self.url,
+                              self.timeout,
+                              self.environment,
+                              self.expected(),
+                              abs_path=self.abs_path if self.path is not None else None)
+
     @classmethod
     def from_manifest(cls, manifest_item, inherit_metadata, test_metadata):
         timeout = cls.long_timeout if manifest_item.timeout == "long" else cls.default_timeout
@@ -394,6 +466,25 @@ class ReftestTest(Test):
 
         return node
 
+    def _make_descriptor(self, nodes):
+        # References may form a graph with cycles, so reuse the descriptor
+        # for any node that has already been seen
+        if self.url in nodes:
+            return nodes[self.url]
+        rv = TestDescriptor(self.test_type,
+                            self.url,
+                            self.timeout,
+                            self.environment,
+                            self.expected(),
+                            abs_path=self.abs_path if self.path is not None else None,
+                            viewport_size=self.viewport_size,
+                            dpi=self.dpi,
+                            fuzzy=self.fuzzy)
+        nodes[self.url] = rv
+        rv.references = [(reference._make_descriptor(nodes), ref_type)
+                         for reference, ref_type in self.references]
+        return rv
+
     def update_metadata(self, metadata):
         if "url_count" not in metadata:
             metadata["url_count"] = defaultdict(int)
@@ -405,6 +496,21 @@ class ReftestTest(Test):
             reference.update_metadata(metadata)
         return metadata
 
+    @property
+    def fuzzy(self):
+        """Allowed differences from the references, as a dictionary of
+        {reference url or None: ((min, max) max difference, (min, max)
+        total pixels)}, with the test's own metadata taking precedence
+        over that of its directories"""
+        rv = {}
+        for meta in reversed(list(self.itermeta())):
+            meta_fuzzy = meta.fuzzy
+            if meta_fuzzy:
+                rv.update((urlparse.urljoin(self.url, reference)
+                           if reference is not None else None, ranges)
+                          for reference, ranges in meta_fuzzy.iteritems())
+        return rv
+
     @property
     def id(self):
         return self.url
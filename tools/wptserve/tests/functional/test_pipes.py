@@ -3,6 +3,7 @@ import unittest
 import time
 import json
 import sys
+import zlib
 
 from six.moves import urllib
 
@@ -139,6 +140,84 @@ class TestTrickle(TestUsingServer):
         self.assertEqual(resp.info()["Pragma"], "no-cache")
         self.assertEqual(resp.info()["Expires"], "0")
 
+class TestCompression(TestUsingServer):
+    def setUp(self):
+        super(TestCompression, self).setUp()
+        wptserve.pipes.compression_cache.clear()
+        with open(os.path.join(doc_root, "document.txt"), "rb") as f:
+            self.expected = f.read()
+
+    def test_gzip(self):
+        resp = self.request("/document.txt", query="pipe=gzip")
+        self.assertEqual(resp.info()["Content-Encoding"], "gzip")
+        data = resp.read()
+        self.assertEqual(int(resp.info()["Content-Length"]), len(data))
+        self.assertEqual(zlib.decompress(data, 16 + zlib.MAX_WBITS), self.expected)
+
+    def test_gzip_cached(self):
+        self.request("/document.txt", query="pipe=gzip").read()
+        self.assertEqual(len(wptserve.pipes.compression_cache._data), 1)
+        resp = self.request("/document.txt", query="pipe=gzip")
+        self.assertEqual(zlib.decompress(resp.read(), 16 + zlib.MAX_WBITS), self.expected)
+        self.assertEqual(len(wptserve.pipes.compression_cache._data), 1)
+
+    def test_deflate(self):
+        resp = self.request("/document.txt", query="pipe=deflate")
+        self.assertEqual(resp.info()["Content-Encoding"], "deflate")
+        self.assertEqual(zlib.decompress(resp.read()), self.expected)
+
+    def test_compress_streaming(self):
+        resp = self.request("/document.txt", query="pipe=compress")
+        self.assertEqual(resp.info()["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.info())
+        self.assertEqual(zlib.decompress(resp.read(), 16 + zlib.MAX_WBITS), self.expected)
+
+    def test_compress_after_sub(self):
+        resp = self.request("/sub.sub.txt", query="pipe=sub|compress(deflate)")
+        self.assertEqual(resp.info()["Content-Encoding"], "deflate")
+        self.assertIn(b"localhost", zlib.decompress(resp.read()))
+
+    def test_precompressed(self):
+        path = os.path.join(doc_root, "precompressed.txt")
+        with open(path, "wb") as f:
+            f.write(b"uncompressed")
+        with open(path + ".gz", "wb") as f:
+            f.write(wptserve.pipes.compress_data(b"precompressed", "gzip"))
+        mtime = os.stat(path).st_mtime
+        os.utime(path + ".gz", (mtime + 1, mtime + 1))
+        try:
+            for pipe in ["gzip", "compress"]:
+                resp = self.request("/precompressed.txt", query="pipe=%s" % pipe)
+                self.assertEqual(zlib.decompress(resp.read(), 16 + zlib.MAX_WBITS),
+                                 b"precompressed")
+
+            # A stale precompressed file is ignored
+            os.utime(path + ".gz", (mtime - 10, mtime - 10))
+            resp = self.request("/precompressed.txt", query="pipe=gzip")
+            self.assertEqual(zlib.decompress(resp.read(), 16 + zlib.MAX_WBITS),
+                             b"uncompressed")
+        finally:
+            os.unlink(path)
+            os.unlink(path + ".gz")
+
+
+class TestCompressionCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = wptserve.pipes.CompressionCache(max_size=10)
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        self.assertEqual(cache.get("a"), b"1234")
+        cache.set("c", b"1234")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1234")
+        self.assertEqual(cache.size, 8)
+
+    def test_too_large(self):
+        cache = wptserve.pipes.CompressionCache(max_size=2)
+        cache.set("a", b"1234")
+        self.assertIsNone(cache.get("a"))
+
+
 class TestPipesWithVariousHandlers(TestUsingServer):
     @pytest.mark.xfail(sys.version_info >= (3,), reason="wptserve only works on Py2")
     def test_with_python_file_handler(self):
@@ -1,10 +1,20 @@
+import hashlib
+import os
+import socket
+import ssl
+import sys
+import time
 import unittest
 
 import pytest
 from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import urlopen
 
 wptserve = pytest.importorskip("wptserve")
-from .base import TestUsingServer
+from .base import TestUsingServer, doc_root
+
+certs_path = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                          os.pardir, os.pardir, os.pardir, "certs"))
 
 
 class TestFileHandler(TestUsingServer):
@@ -40,5 +50,176 @@ class TestRequestHandler(TestUsingServer):
 
         self.assertEqual(cm.exception.code, 500)
 
+class TestTLS(unittest.TestCase):
+    def setUp(self):
+        self.server = wptserve.server.WebTestHttpd(host="localhost",
+                                                   port=0,
+                                                   use_ssl=True,
+                                                   key_file=os.path.join(certs_path, "web-platform.test.key"),
+                                                   certificate=os.path.join(certs_path, "web-platform.test.pem"),
+                                                   doc_root=doc_root)
+        self.server.start(False)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_shared_context(self):
+        other = wptserve.server.get_ssl_context(os.path.join(certs_path, "web-platform.test.key"),
+                                                os.path.join(certs_path, "web-platform.test.pem"))
+        self.assertIs(self.server.httpd.ssl_context, other)
+
+    def test_handshake_stats(self):
+        @wptserve.handlers.handler
+        def handler(request, response):
+            response.headers.set("Content-Length", "2")
+            return "OK"
+
+        self.server.router.register("GET", "/test/tls", handler)
+
+        context = ssl._create_unverified_context()
+        for _ in range(2):
+            resp = urlopen(self.server.get_url("/test/tls"), context=context)
+            self.assertEqual(200, resp.getcode())
+            self.assertEqual(b"OK", resp.read())
+        stats = self.server.handshake_stats.to_dict()
+        self.assertEqual(2, stats["handshakes"])
+        self.assertEqual(0, stats["failed"])
+        self.assertIsNotNone(stats["mean_ms"])
+
+
+class H2Client(object):
+    """Minimal HTTP/2 client able to have several streams open at once"""
+
+    def __init__(self, host, port, initial_window_size=None):
+        from h2.config import H2Configuration
+        from h2.connection import H2Connection
+        from h2.settings import SettingCodes
+
+        self.host = host
+        self.port = port
+        context = ssl._create_unverified_context()
+        context.set_alpn_protocols(["h2"])
+        sock = socket.create_connection((host, port), timeout=10)
+        self.sock = context.wrap_socket(sock, server_hostname=host)
+        self.conn = H2Connection(config=H2Configuration(client_side=True))
+        self.conn.initiate_connection()
+        if initial_window_size is not None:
+            self.conn.update_settings({SettingCodes.INITIAL_WINDOW_SIZE: initial_window_size})
+        self.sock.sendall(self.conn.data_to_send())
+        self.responses = {}
+
+    def send_request(self, path, method="GET", body=None):
+        stream_id = self.conn.get_next_available_stream_id()
+        headers = [(":method", method),
+                   (":path", path),
+                   (":scheme", "https"),
+                   (":authority", "%s:%i" % (self.host, self.port))]
+        self.conn.send_headers(stream_id, headers, end_stream=body is None)
+        if body is not None:
+            while body:
+                size = min(self.conn.local_flow_control_window(stream_id),
+                           self.conn.max_outbound_frame_size)
+                if size == 0:
+                    self.receive()
+                    continue
+                self.conn.send_data(stream_id, body[:size], end_stream=len(body) <= size)
+                self.sock.sendall(self.conn.data_to_send())
+                body = body[size:]
+        self.sock.sendall(self.conn.data_to_send())
+        self.responses[stream_id] = {"status": None, "body": [], "ended": False}
+        return stream_id
+
+    def receive(self):
+        from h2 import events
+
+        data = self.sock.recv(65535)
+        assert data, "Connection closed by server"
+        for event in self.conn.receive_data(data):
+            response = self.responses.get(getattr(event, "stream_id", None))
+            if isinstance(event, events.ResponseReceived):
+                response["status"] = int(dict(event.headers)[b":status"])
+            elif isinstance(event, events.DataReceived):
+                response["body"].append(event.data)
+                self.conn.acknowledge_received_data(event.flow_controlled_length,
+                                                    event.stream_id)
+            elif isinstance(event, events.StreamEnded):
+                response["ended"] = True
+        self.sock.sendall(self.conn.data_to_send())
+
+    def get_response(self, stream_id):
+        while not self.responses[stream_id]["ended"]:
+            self.receive()
+        response = self.responses.pop(stream_id)
+        return response["status"], b"".join(response["body"])
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.mark.skipif(sys.version_info >= (3,), reason="HTTP/2 only works on Py2")
+class TestHTTP2(unittest.TestCase):
+    def setUp(self):
+        self.server = wptserve.server.WebTestHttpd(host="localhost",
+                                                   port=0,
+                                                   use_ssl=True,
+                                                   key_file=os.path.join(certs_path, "web-platform.test.key"),
+                                                   certificate=os.path.join(certs_path, "web-platform.test.pem"),
+                                                   handler_cls=wptserve.server.Http2WebTestRequestHandler,
+                                                   doc_root=doc_root,
+                                                   http2=True)
+        self.server.start(False)
+        self.client = None
+
+    def tearDown(self):
+        if self.client is not None:
+            self.client.close()
+        self.server.stop()
+
+    def connect(self, **kwargs):
+        self.client = H2Client(self.server.host, self.server.port, **kwargs)
+        return self.client
+
+    def test_concurrent_streams(self):
+        @wptserve.handlers.handler
+        def handler(request, response):
+            time.sleep(0.5)
+            return request.GET.first("value")
+
+        self.server.router.register("GET", "/test/h2/slow", handler)
+        client = self.connect()
+
+        start = time.time()
+        stream_ids = [client.send_request("/test/h2/slow?value=%i" % i) for i in range(4)]
+        for i, stream_id in enumerate(stream_ids):
+            self.assertEqual((200, str(i).encode("ascii")), client.get_response(stream_id))
+        self.assertLess(time.time() - start, 1.5)
+
+    def test_request_body(self):
+        @wptserve.handlers.handler
+        def handler(request, response):
+            return "%i %s" % (len(request.body), hashlib.sha1(request.body).hexdigest())
+
+        self.server.router.register("POST", "/test/h2/body", handler)
+        client = self.connect()
+
+        # Larger than the default flow control window, and with no
+        # Content-Length header
+        body = b"abcdefgh" * 20000
+        stream_id = client.send_request("/test/h2/body", method="POST", body=body)
+        expected = "%i %s" % (len(body), hashlib.sha1(body).hexdigest())
+        self.assertEqual((200, expected.encode("ascii")), client.get_response(stream_id))
+
+    def test_flow_control(self):
+        @wptserve.handlers.handler
+        def handler(request, response):
+            return b"x" * 100000
+
+        self.server.router.register("GET", "/test/h2/large", handler)
+        client = self.connect(initial_window_size=1024)
+
+        stream_id = client.send_request("/test/h2/large")
+        self.assertEqual((200, b"x" * 100000), client.get_response(stream_id))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,93 @@
+import logging
+import os
+import shutil
+import tempfile
+
+from distutils.spawn import find_executable
+
+import pytest
+
+openssl = pytest.importorskip("wptserve.sslutils.openssl")
+
+pytestmark = pytest.mark.skipif(find_executable("openssl") is None,
+                                reason="openssl binary not available")
+
+
+@pytest.fixture
+def base_path():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def make_env(base_path):
+    return openssl.OpenSSLEnvironment(logging.getLogger("test_sslutils"),
+                                      base_path=base_path,
+                                      duration=2)
+
+
+def test_cert_reused(base_path, monkeypatch):
+    hosts = ["web-platform.test", "www.web-platform.test"]
+    with make_env(base_path) as env:
+        ca_path = env.ca_cert_path()
+        key_path, cert_path = env.host_cert_path(hosts)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("openssl should not be run for cached certificates")
+
+    monkeypatch.setattr(openssl.OpenSSL, "__call__", fail)
+
+    with make_env(base_path) as env:
+        assert env.ca_cert_path() == ca_path
+        assert env.host_cert_path(list(reversed(hosts))) == (key_path, cert_path)
+
+
+def test_cert_keyed_by_hosts(base_path):
+    with make_env(base_path) as env:
+        first = env.host_cert_path(["web-platform.test", "www.web-platform.test"])
+
+    with make_env(base_path) as env:
+        second = env.host_cert_path(["web-platform.test", "www1.web-platform.test"])
+
+    assert first != second
+    assert all(os.path.exists(path) for path in first + second)
+
+
+def test_cert_expired(base_path):
+    hosts = ["web-platform.test"]
+    with make_env(base_path) as env:
+        env.host_cert_path(hosts)
+        digest = openssl.hosts_digest(hosts)
+        env._update_cache_index(digest, *env._host_cert_paths(hosts), end_time=0, hosts=hosts)
+
+    with make_env(base_path) as env:
+        assert env._load_host_cert(tuple(hosts)) is None
+
+
+def test_cert_regenerated_with_new_ca(base_path):
+    hosts = ["web-platform.test"]
+    with make_env(base_path) as env:
+        env.host_cert_path(hosts)
+
+    os.unlink(os.path.join(base_path, "cacert.pem"))
+
+    with make_env(base_path) as env:
+        assert env._load_host_cert(tuple(hosts)) is None
+
+
+@pytest.mark.skipif(openssl.fcntl is None, reason="needs fcntl")
+def test_generated_with_lock_held(base_path, monkeypatch):
+    call = openssl.OpenSSL.__call__
+
+    def check_locked(self, *args, **kwargs):
+        with open(os.path.join(base_path, "cert_cache.lock")) as f:
+            with pytest.raises(IOError):
+                openssl.fcntl.flock(f.fileno(), openssl.fcntl.LOCK_EX | openssl.fcntl.LOCK_NB)
+        return call(self, *args, **kwargs)
+
+    monkeypatch.setattr(openssl.OpenSSL, "__call__", check_locked)
+
+    with make_env(base_path) as env:
+        env.host_cert_path(["web-platform.test"])
+
+    assert not [name for name in os.listdir(base_path) if name.endswith(".tmp")]
@@ -1,14 +1,21 @@
 from cgi import escape
-from collections import deque
-import gzip as gzip_module
+from collections import deque, OrderedDict
 import hashlib
 import os
 import re
+import threading
 import time
 import uuid
-from six.moves import StringIO
+import zlib
 
-from six import text_type, binary_type
+from six import text_type, binary_type, string_types
+
+from .utils import HTTPException
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 def resolve_content(response):
     return b"".join(item for item in response.iter_content(read_file=True))
@@ -497,6 +504,200 @@ def template(request, content, escape_type="html"):
 
     return new_content
 
+class CompressionCache(object):
+    """Bounded LRU cache of compressed response bodies.
+
+    Entries are keyed by the content encoding and either the path, size
+    and modification time of a file on disk, or a hash of the uncompressed
+    content, so that identical bodies are only compressed once.
+
+    :param max_size: Maximum total size in bytes of the cached data"""
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+        with self._lock:
+            old_value = self._data.pop(key, None)
+            if old_value is not None:
+                self.size -= len(old_value)
+            self._data[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+compression_cache = CompressionCache()
+
+# Suffix of precompressed siblings for each encoding, e.g. foo.js.gz
+precompressed_suffixes = {"gzip": ".gz",
+                          "br": ".br"}
+
+
+def get_compressor(encoding):
+    """Get an object with compress(data) and flush() methods for encoding
+    data with the given HTTP content-coding."""
+    if encoding == "gzip":
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, zlib.MAX_WBITS)
+    elif encoding == "br":
+        if brotli is None:
+            raise HTTPException(500, "brotli encoding requires the brotli module")
+        return BrotliCompressor()
+    raise ValueError("Unsupported content encoding %s" % encoding)
+
+
+class BrotliCompressor(object):
+    """Adapter giving the brotli and brotlipy compressors the same interface as
+    zlib compression objects"""
+
+    def __init__(self):
+        self.compressor = brotli.Compressor()
+
+    def compress(self, data):
+        if hasattr(self.compressor, "process"):
+            return self.compressor.process(data)
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+def compress_data(data, encoding):
+    compressor = get_compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _encode(response, item):
+    if isinstance(item, text_type):
+        return item.encode(response.encoding)
+    return item
+
+
+def _iter_body(response, chunk_size=64 * 1024):
+    """Iterate over the body of response as byte strings, reading files in
+    chunks of chunk_size bytes rather than all at once"""
+    # Capture the content immediately, since callers may replace
+    # response.content before the returned generator is first used
+    content = response.content
+    if isinstance(content, (binary_type, text_type)) or hasattr(content, "read"):
+        content = [content]
+    return _iter_chunks(response, content, chunk_size)
+
+
+def _iter_chunks(response, content, chunk_size):
+    for item in content:
+        if hasattr(item, "__call__"):
+            item = item()
+        if not item:
+            continue
+        if hasattr(item, "read"):
+            try:
+                while True:
+                    data = item.read(chunk_size)
+                    if not data:
+                        break
+                    yield data
+            finally:
+                item.close()
+        else:
+            yield _encode(response, item)
+
+
+def _content_file(response):
+    """Get the file object of the response if the response body is still an
+    unmodified file on disk, or None otherwise."""
+    content = response.content
+    if hasattr(content, "read") and isinstance(getattr(content, "name", None), string_types):
+        return content
+    return None
+
+
+def _precompressed_file(response, encoding):
+    """Get an open file for a precompressed sibling of the file being served
+    e.g. foo.js.gz for foo.js, if one exists and is at least as new as the
+    uncompressed file."""
+    suffix = precompressed_suffixes.get(encoding)
+    content_file = _content_file(response)
+    if suffix is None or content_file is None:
+        return None
+
+    path = content_file.name
+    try:
+        if os.stat(path + suffix).st_mtime < os.stat(path).st_mtime:
+            return None
+        return open(path + suffix, "rb")
+    except (OSError, IOError):
+        return None
+
+
+def _file_cache_key(encoding, content_file):
+    try:
+        stat = os.fstat(content_file.fileno())
+    except (OSError, IOError, AttributeError):
+        return None
+    return (encoding, "file", content_file.name, stat.st_size, stat.st_mtime)
+
+
+def _set_encoding(response, encoding):
+    response.headers.set("Content-Encoding", encoding)
+
+
+def compress_response(response, encoding):
+    """Compress the whole response body, setting Content-Encoding and
+    Content-Length.
+
+    A precompressed sibling of a file body is sent as-is where available,
+    otherwise the compressed data is taken from, or stored in,
+    compression_cache."""
+    precompressed = _precompressed_file(response, encoding)
+    if precompressed is not None:
+        response.content.close()
+        response.content = precompressed
+        _set_encoding(response, encoding)
+        response.headers.set("Content-Length", os.fstat(precompressed.fileno()).st_size)
+        return response
+
+    content_file = _content_file(response)
+    cache_key = _file_cache_key(encoding, content_file) if content_file is not None else None
+    data = compression_cache.get(cache_key) if cache_key is not None else None
+
+    if data is None:
+        content = b"".join(_iter_body(response))
+        if cache_key is None:
+            cache_key = (encoding, "content", hashlib.sha1(content).hexdigest())
+            data = compression_cache.get(cache_key)
+        if data is None:
+            data = compress_data(content, encoding)
+            compression_cache.set(cache_key, data)
+    elif content_file is not None:
+        content_file.close()
+
+    response.content = data
+    _set_encoding(response, encoding)
+    response.headers.set("Content-Length", len(data))
+    return response
+
+
 @pipe()
 def gzip(request, response):
     """This pipe gzip-encodes response data.
@@ -504,15 +705,69 @@ def gzip(request, response):
     It sets (or overwrites) these HTTP headers:
     Content-Encoding is set to gzip
     Content-Length is set to the length of the compressed content
+
+    If the response is a file foo and a file foo.gz exists that is at
+    least as new as foo, the content of foo.gz is sent without further
+    compression. Otherwise compressed content is cached, so identical
+    responses are only compressed once.
     """
-    content = resolve_content(response)
-    response.headers.set("Content-Encoding", "gzip")
+    return compress_response(response, "gzip")
+
+
+@pipe()
+def deflate(request, response):
+    """This pipe deflate-encodes response data.
+
+    Content-Encoding is set to deflate and Content-Length is set to the
+    length of the compressed content. As for gzip, compressed content is
+    cached."""
+    return compress_response(response, "deflate")
+
+
+@pipe()
+def br(request, response):
+    """This pipe brotli-encodes response data.
+
+    This requires the brotli module. Content-Encoding is set to br and
+    Content-Length is set to the length of the compressed content. As for
+    gzip, a precompressed foo.br sibling is used if present and
+    compressed content is cached."""
+    return compress_response(response, "br")
+
+
+@pipe(opt(str))
+def compress(request, response, encoding="gzip"):
+    """This pipe compresses response data as it is sent.
+
+    Unlike the gzip pipe, the body is never held in memory as a
+    whole; file and iterable bodies are compressed chunk by chunk, so
+    no Content-Length is sent. A precompressed sibling file is still
+    used if one exists, in which case it is sent with a Content-Length.
+
+    :param encoding: The content-coding to use; one of gzip (the default),
+                     deflate or br. br requires the brotli module.
+    """
+    compressor = get_compressor(encoding)
+
+    if "Content-Length" in response.headers:
+        del response.headers["Content-Length"]
+
+    precompressed = _precompressed_file(response, encoding)
+    if precompressed is not None:
+        response.content.close()
+        response.content = precompressed
+        response.headers.set("Content-Length", os.fstat(precompressed.fileno()).st_size)
+    else:
+        body = _iter_body(response)
 
-    out = StringIO()
-    with gzip_module.GzipFile(fileobj=out, mode="w") as f:
-        f.write(content)
-    response.content = out.getvalue()
+        def compressed_body():
+            for data in body:
+                data = compressor.compress(data)
+                if data:
+                    yield data
+            yield compressor.flush()
 
-    response.headers.set("Content-Length", len(response.content))
+        response.content = compressed_body()
 
+    _set_encoding(response, encoding)
     return response
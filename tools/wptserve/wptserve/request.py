@@ -276,8 +276,11 @@ class Request(object):
 
         self._headers = None
 
-        self.raw_input = InputFile(request_handler.rfile,
-                                   int(self.headers.get("Content-Length", 0)))
+        # HTTP/2 requests need not have a Content-Length; in that case the
+        # handler provides the length of the body once it is complete
+        content_length = self.headers.get("Content-Length",
+                                          getattr(request_handler, "body_length", 0))
+        self.raw_input = InputFile(request_handler.rfile, int(content_length))
         self._body = None
 
         self._GET = None
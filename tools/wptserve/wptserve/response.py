@@ -6,7 +6,6 @@ import uuid
 import socket
 from .constants import response_codes, h2_headers
 from .logger import get_logger
-from io import BytesIO
 
 from six import binary_type, text_type, itervalues
 
@@ -377,6 +376,7 @@ class H2Response(Response):
 
 
 class H2ResponseWriter(object):
+    file_chunk_size = 64 * 1024
 
     def __init__(self, handler, response):
         self.socket = handler.request
@@ -411,38 +411,42 @@ class H2ResponseWriter(object):
 
     def write_content(self, item, last=False):
         if isinstance(item, (text_type, binary_type)):
-            data = BytesIO(self.encode(item))
-        else:
-            data = item
-
-        # Find the length of the data
-        data.seek(0, 2)
-        data_len = data.tell()
-        data.seek(0)
-
-        # If the data is longer than max payload size, need to write it in chunks
-        payload_size = self.get_max_payload_size()
-        while data_len > payload_size:
-            self.write_content_frame(data.read(payload_size), False)
-            data_len -= payload_size
-            payload_size = self.get_max_payload_size()
+            self.write_content_frame(self.encode(item), last)
+            return
 
-        self.write_content_frame(data.read(), last)
+        # Read files in chunks, reading ahead so that the final chunk can
+        # be sent with END_STREAM set
+        data = item.read(self.file_chunk_size)
+        while True:
+            next_data = item.read(self.file_chunk_size) if data else b""
+            if not next_data:
+                self.write_content_frame(data, last)
+                break
+            self.write_content_frame(data, False)
+            data = next_data
 
     def write_content_frame(self, data, last):
+        """Send data on the stream, split into as many DATA frames as are
+        needed. When the flow control window is exhausted this waits for
+        the client to send a WINDOW_UPDATE rather than failing."""
+        stream_id = self.request.h2_stream_id
         with self.h2conn as connection:
-            connection.send_data(
-                stream_id=self.request.h2_stream_id,
-                data=data,
-                end_stream=last,
-            )
-            self.write(connection)
+            while True:
+                if data:
+                    payload_size = self.h2conn.wait_for_window(stream_id)
+                else:
+                    payload_size = 0
+                payload, data = data[:payload_size], data[payload_size:]
+                connection.send_data(
+                    stream_id=stream_id,
+                    data=payload,
+                    end_stream=last and not data,
+                )
+                self.write(connection)
+                if not data:
+                    break
         self.content_written = last
 
-    def get_max_payload_size(self):
-        with self.h2conn as connection:
-            return min(connection.remote_settings.max_frame_size, connection.local_flow_control_window(self.request.h2_stream_id)) - 9
-
     def write(self, connection):
         data = connection.data_to_send()
         self.socket.sendall(data)
@@ -10,12 +10,15 @@ import time
 import traceback
 from six import binary_type, text_type
 import uuid
-from collections import OrderedDict
+from collections import OrderedDict, deque
 
 from h2.config import H2Configuration
 from h2.connection import H2Connection
-from h2.events import RequestReceived, ConnectionTerminated
+from h2.events import (RequestReceived, ConnectionTerminated, DataReceived, StreamEnded,
+                       StreamReset, WindowUpdated, RemoteSettingsChanged)
+from h2.exceptions import ProtocolError, StreamClosedError
 
+from six.moves.queue import Queue
 from six.moves.urllib.parse import urlsplit, urlunsplit
 
 from . import routes as default_routes
@@ -109,6 +112,81 @@ class RequestRewriter(object):
                 request_handler.path = new_url
 
 
+_ssl_contexts = {}
+_ssl_contexts_lock = threading.Lock()
+
+
+def get_ssl_context(key_file, certificate, http2=False):
+    """Get a server-side SSLContext for a key and certificate.
+
+    Contexts are shared by all the servers in a process that use the same
+    key and certificate, so that TLS sessions established with one server
+    can be resumed, either using session tickets or the server-side session
+    cache, on new connections to any of them.
+
+    :param key_file: Path to the private key file
+
+    :param certificate: Path to the certificate file
+
+    :param http2: Boolean indicating whether the context should negotiate
+                  HTTP/2 using ALPN
+    """
+    key = (key_file, certificate, http2)
+    with _ssl_contexts_lock:
+        if key not in _ssl_contexts:
+            if http2:
+                context = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH)
+                context.set_alpn_protocols(['h2'])
+            else:
+                context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.load_cert_chain(keyfile=key_file, certfile=certificate)
+            # Session tickets are on by default, but make sure nothing has
+            # turned them off since they allow resumption without any
+            # server-side state
+            context.options &= ~getattr(ssl, "OP_NO_TICKET", 0)
+            _ssl_contexts[key] = context
+        return _ssl_contexts[key]
+
+
+class HandshakeStats(object):
+    """Counters for the TLS handshakes performed by a server"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.resumed = 0
+        self.failed = 0
+        self.total_time = 0.
+        self.max_time = 0.
+
+    def record(self, duration, resumed):
+        with self._lock:
+            self.count += 1
+            if resumed:
+                self.resumed += 1
+            self.total_time += duration
+            self.max_time = max(self.max_time, duration)
+
+    def record_failure(self):
+        with self._lock:
+            self.failed += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {"handshakes": self.count,
+                    "resumed": self.resumed,
+                    "failed": self.failed,
+                    "mean_ms": (self.total_time / self.count * 1000) if self.count else None,
+                    "max_ms": self.max_time * 1000 if self.count else None}
+
+    def __str__(self):
+        data = self.to_dict()
+        if not data["handshakes"]:
+            return "%(handshakes)i TLS handshakes (%(failed)i failed)" % data
+        return ("%(handshakes)i TLS handshakes (%(resumed)i resumed, %(failed)i failed), "
+                "mean %(mean_ms).2f ms, max %(max_ms).2f ms" % data)
+
+
 class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
     allow_reuse_address = True
     acceptable_errors = (errno.EPIPE, errno.ECONNABORTED)
@@ -185,25 +263,38 @@ class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
         self.key_file = key_file
         self.certificate = certificate
         self.encrypt_after_connect = use_ssl and encrypt_after_connect
+        self.ssl_context = None
+        self.handshake_stats = HandshakeStats()
 
-        if use_ssl and not encrypt_after_connect:
-            if http2:
-                ssl_context = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH)
-                ssl_context.load_cert_chain(keyfile=self.key_file, certfile=self.certificate)
-                ssl_context.set_alpn_protocols(['h2'])
-                self.socket = ssl_context.wrap_socket(self.socket,
-                                                      server_side=True)
+        if use_ssl:
+            self.ssl_context = get_ssl_context(self.key_file, self.certificate, http2)
 
-            else:
-                self.socket = ssl.wrap_socket(self.socket,
-                                              keyfile=self.key_file,
-                                              certfile=self.certificate,
-                                              server_side=True)
+        if use_ssl and not encrypt_after_connect:
+            # The handshake is done on the request thread rather than in
+            # accept(), so that a slow handshake doesn't block other connections
+            self.socket = self.ssl_context.wrap_socket(self.socket,
+                                                       server_side=True,
+                                                       do_handshake_on_connect=False)
+
+    def do_handshake(self, ssl_socket):
+        """Perform the TLS handshake for a newly accepted connection, recording
+        its duration and whether the session was resumed."""
+        start = time.time()
+        try:
+            ssl_socket.do_handshake()
+        except (ssl.SSLError, socket.error):
+            self.handshake_stats.record_failure()
+            raise
+        self.handshake_stats.record(time.time() - start,
+                                    getattr(ssl_socket, "session_reused", False))
 
     def handle_error(self, request, client_address):
         error = sys.exc_info()[1]
 
-        if ((isinstance(error, socket.error) and
+        if isinstance(error, ssl.SSLError):
+            # The client failed or aborted the TLS handshake
+            self.logger.debug("TLS error from %s: %s" % (client_address, error))
+        elif ((isinstance(error, socket.error) and
              isinstance(error.args, tuple) and
              error.args[0] in self.acceptable_errors) or
             (isinstance(error, IOError) and
@@ -220,6 +311,11 @@ class BaseWebTestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.logger = get_logger()
         BaseHTTPServer.BaseHTTPRequestHandler.__init__(self, *args, **kwargs)
 
+    def setup(self):
+        if isinstance(self.request, ssl.SSLSocket):
+            self.server.do_handshake(self.request)
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
     def finish_handling(self, request_line_is_valid, response_cls):
             self.server.rewriter.rewrite(self)
 
@@ -299,10 +395,9 @@ class BaseWebTestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         response.write()
         if self.server.encrypt_after_connect:
             self.logger.debug("Enabling SSL for connection")
-            self.request = ssl.wrap_socket(self.connection,
-                                           keyfile=self.server.key_file,
-                                           certfile=self.server.certificate,
-                                           server_side=True)
+            self.request = self.server.ssl_context.wrap_socket(self.connection,
+                                                               server_side=True,
+                                                               do_handshake_on_connect=False)
             self.setup()
         return
 
@@ -315,6 +410,13 @@ class Http2WebTestRequestHandler(BaseWebTestRequestHandler):
         This is the main HTTP/2.0 Handler. When a browser opens a connection to the server
         on the HTTP/2.0 port, Because there can be multiple H2 connections active at the same
         time, a UUID is created for each so that it is easier to tell them apart in the logs.
+
+        This thread only reads frames from the connection; each request
+        is handled by a H2StreamHandler on a worker thread from a pool
+        bounded by the number of concurrent streams the server allows.
+        Request body data is fed to the stream's H2StreamInput as it
+        arrives, and the workers wait on the connection for flow control
+        window updates when sending response data.
         """
 
         config = H2Configuration(client_side=False)
@@ -322,64 +424,153 @@ class Http2WebTestRequestHandler(BaseWebTestRequestHandler):
         self.close_connection = False
 
         # Generate a UUID to make it easier to distinguish different H2 connection debug messages
-        uid = uuid.uuid4()
+        self.uid = uuid.uuid4()
 
-        self.logger.debug('(%s) Initiating h2 Connection' % uid)
+        self.logger.debug('(%s) Initiating h2 Connection' % self.uid)
+
+        # Frames are written as soon as they are ready, often several per
+        # response, so don't let Nagle's algorithm hold them back
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
         with self.conn as connection:
             connection.initiate_connection()
-            data = connection.data_to_send()
+            self.request.sendall(connection.data_to_send())
+            max_streams = connection.local_settings.max_concurrent_streams
+
+        self.streams = {}
+        self.workers = H2StreamWorkerPool(max_streams, "h2-%s" % self.uid)
 
-        self.request.sendall(data)
+        try:
+            while not self.close_connection:
+                try:
+                    # This size may need to be made variable based on remote settings?
+                    data = self.request.recv(65535)
+                    if not data:
+                        self.logger.debug('(%s) Connection closed by remote peer' % self.uid)
+                        break
+
+                    with self.conn as connection:
+                        try:
+                            events = connection.receive_data(data)
+                        finally:
+                            # Also sends the GOAWAY frame for a protocol error
+                            self.request.sendall(connection.data_to_send())
+
+                    self.logger.debug('(%s) Events: ' % (self.uid) + str(events))
+
+                    for event in events:
+                        self._h2_handle_event(event)
+
+                except (socket.timeout, socket.error) as e:
+                    self.logger.debug('(%s) ERROR - Closing Connection - \n%s' % (self.uid, str(e)))
+                    self.close_connection = True
+                except ProtocolError as e:
+                    self.logger.debug('(%s) Protocol error - Closing Connection - \n%s' %
+                                      (self.uid, str(e)))
+                    self.close_connection = True
+        finally:
+            self.close_connection = True
+            self.conn.close()
+            for stream in self.streams.values():
+                stream.rfile.end()
+            self.workers.shutdown()
+
+    def _h2_handle_event(self, event):
+        if isinstance(event, RequestReceived):
+            self.logger.debug('(%s) Parsing RequestReceived' % (self.uid))
+            stream = H2StreamHandler(self, event)
+            self.streams[event.stream_id] = stream
+            if event.stream_ended is not None:
+                stream.rfile.end()
+            self.workers.submit(self._h2_handle_stream, stream)
+        elif isinstance(event, DataReceived):
+            stream = self.streams.get(event.stream_id)
+            if stream is not None:
+                stream.rfile.feed(event.data)
+            # The data is buffered by the stream, so the window can be
+            # reopened straight away
+            with self.conn as connection:
+                connection.acknowledge_received_data(event.flow_controlled_length,
+                                                     event.stream_id)
+                self.request.sendall(connection.data_to_send())
+        elif isinstance(event, StreamEnded):
+            stream = self.streams.get(event.stream_id)
+            if stream is not None:
+                stream.rfile.end()
+        elif isinstance(event, StreamReset):
+            stream = self.streams.get(event.stream_id)
+            if stream is not None:
+                stream.rfile.end()
+            self.conn.notify_window()
+        elif isinstance(event, (WindowUpdated, RemoteSettingsChanged)):
+            self.conn.notify_window()
+        elif isinstance(event, ConnectionTerminated):
+            self.logger.debug('(%s) Connection terminated by remote peer ' % (self.uid))
+            self.close_connection = True
 
-        self.request_threads = []
+    def _h2_handle_stream(self, stream):
+        try:
+            stream.handle()
+        except (socket.error, StreamClosedError, H2ConnectionClosed) as e:
+            self.logger.debug('(%s) Stream %i closed before response was sent - %s' %
+                              (self.uid, stream.h2_stream_id, str(e)))
+        except Exception:
+            self.logger.error(traceback.format_exc())
+        finally:
+            self.streams.pop(stream.h2_stream_id, None)
 
-        # TODO Need to do some major work on multithreading. Current idea is to have a thread per stream
-        # so that processing of the request can start from the first frame.
 
-        while not self.close_connection:
-            try:
-                # This size may need to be made variable based on remote settings?
-                data = self.request.recv(65535)
-
-                with self.conn as connection:
-                    events = connection.receive_data(data)
-
-                self.logger.debug('(%s) Events: ' % (uid) + str(events))
-
-                for event in events:
-                    if isinstance(event, RequestReceived):
-                        self.logger.debug('(%s) Parsing RequestReceived' % (uid))
-                        self._h2_parse_request(event)
-                        t = threading.Thread(target=BaseWebTestRequestHandler.finish_handling, args=(self, True, H2Response))
-                        self.request_threads.append(t)
-                        t.start()
-                    if isinstance(event, ConnectionTerminated):
-                        self.logger.debug('(%s) Connection terminated by remote peer ' % (uid))
-                        self.close_connection = True
-
-            except (socket.timeout, socket.error) as e:
-                self.logger.debug('(%s) ERROR - Closing Connection - \n%s' % (uid, str(e)))
-                self.close_connection = True
-                for t in self.request_threads:
-                    t.join()
+class H2StreamHandler(BaseWebTestRequestHandler):
+    """Request handler for a single HTTP/2 stream.
+
+    This provides the parts of the request handler API that are used
+    by Request and H2Response, so that concurrent streams on the same
+    connection don't share any per-request state."""
+
+    protocol_version = "HTTP/2.0"
+
+    def __init__(self, connection_handler, event):
+        self.server = connection_handler.server
+        self.request = connection_handler.request
+        self.client_address = connection_handler.client_address
+        self.conn = connection_handler.conn
+        self.logger = connection_handler.logger
+        self.close_connection = False
 
-    def _h2_parse_request(self, event):
         self.headers = H2Headers(event.headers)
         self.command = self.headers['method']
         self.path = self.headers['path']
         self.h2_stream_id = event.stream_id
+        self.rfile = H2StreamInput()
+        self.body_length = 0
 
         # TODO Need to figure out what to do with this thing as it is no longer used
         # For now I can just leave it be as it does not affect anything
         self.raw_requestline = ''
 
+    def handle(self):
+        if "content-length" not in self.headers:
+            # Without a Content-Length, the body length is only known once
+            # the stream has ended
+            self.body_length = self.rfile.wait_for_end()
+        self.finish_handling(True, H2Response)
+
+
+class H2ConnectionClosed(Exception):
+    pass
+
 
 class H2ConnectionGuard(object):
-    lock = threading.Lock()
+    """Lock guarding a single H2Connection and the socket it writes to.
+
+    The lock is also the lock of a condition that is notified whenever
+    the flow control windows of the connection may have grown."""
 
     def __init__(self, obj):
         self.obj = obj
+        self.lock = threading.Lock()
+        self.window_updated = threading.Condition(self.lock)
+        self.closed = False
 
     def __enter__(self):
         self.lock.acquire()
@@ -388,6 +579,126 @@ class H2ConnectionGuard(object):
     def __exit__(self, exception_type, exception_value, traceback):
         self.lock.release()
 
+    def wait_for_window(self, stream_id):
+        """Wait until data can be sent on a stream. Must be called with
+        the lock held.
+
+        :param stream_id: The id of the stream
+        :returns: The number of bytes that may be sent in the next frame"""
+        while True:
+            if self.closed:
+                raise H2ConnectionClosed()
+            window = self.obj.local_flow_control_window(stream_id)
+            if window > 0:
+                return min(window, self.obj.max_outbound_frame_size)
+            self.window_updated.wait()
+
+    def notify_window(self):
+        with self.window_updated:
+            self.window_updated.notify_all()
+
+    def close(self):
+        with self.window_updated:
+            self.closed = True
+            self.window_updated.notify_all()
+
+
+class H2StreamInput(object):
+    """File-like object holding the body of a HTTP/2 request as it is
+    received. Reads block until the requested data has been received or
+    the stream has ended."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._buf = deque()
+        self._buf_len = 0
+        self.received = 0
+        self.ended = False
+
+    def feed(self, data):
+        with self._cond:
+            self._buf.append(data)
+            self._buf_len += len(data)
+            self.received += len(data)
+            self._cond.notify_all()
+
+    def end(self):
+        with self._cond:
+            self.ended = True
+            self._cond.notify_all()
+
+    def wait_for_end(self):
+        """Wait for the stream to end, and return the length of the body"""
+        with self._cond:
+            while not self.ended:
+                self._cond.wait()
+            return self.received
+
+    def read(self, size=-1):
+        with self._cond:
+            while not self.ended and (size < 0 or self._buf_len < size):
+                self._cond.wait()
+            if size < 0 or size > self._buf_len:
+                size = self._buf_len
+            rv = []
+            remaining = size
+            while remaining:
+                data = self._buf.popleft()
+                if len(data) > remaining:
+                    self._buf.appendleft(data[remaining:])
+                    data = data[:remaining]
+                rv.append(data)
+                remaining -= len(data)
+            self._buf_len -= size
+            return b"".join(rv)
+
+
+class H2StreamWorkerPool(object):
+    """Bounded pool of threads used to handle the streams of a HTTP/2
+    connection.
+
+    Threads are started as required, up to max_workers, and are reused
+    for later streams once they are idle."""
+
+    def __init__(self, max_workers, name):
+        self.max_workers = max_workers
+        self.name = name
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._idle = 0
+
+    def submit(self, func, *args):
+        with self._lock:
+            if self._idle:
+                self._idle -= 1
+            elif len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._run,
+                                          name="%s-%i" % (self.name, len(self._workers)))
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+        self._queue.put((func, args))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            func, args = item
+            func(*args)
+            with self._lock:
+                self._idle += 1
+
+    def shutdown(self):
+        """Wait for all submitted work to complete and stop the threads"""
+        with self._lock:
+            workers = self._workers[:]
+        for _ in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join()
+
 
 class H2Headers(dict):
     def __init__(self, headers):
@@ -573,6 +884,11 @@ class WebTestHttpd(object):
             self.server_thread.setDaemon(True)  # don't hang on exit
             self.server_thread.start()
 
+    @property
+    def handshake_stats(self):
+        """HandshakeStats for the TLS handshakes performed by the server"""
+        return self.httpd.handshake_stats
+
     def stop(self):
         """
         Stops the server.
@@ -585,6 +901,10 @@ class WebTestHttpd(object):
                 self.httpd.server_close()
                 self.server_thread.join()
                 self.server_thread = None
+                if self.use_ssl:
+                    self.logger.info("%s server on %s:%s: %s" %
+                                     ("http2" if self.http2 else "https",
+                                      self.host, self.port, self.httpd.handshake_stats))
                 self.logger.info("Stopped http server on %s:%s" % (self.host, self.port))
             except AttributeError:
                 pass
@@ -1,13 +1,22 @@
 import functools
+import hashlib
+import json
 import os
 import random
 import shutil
 import subprocess
 import tempfile
+import time
 from datetime import datetime, timedelta
 
 from six import iteritems
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 # Amount of time beyond the present to consider certificates "expired." This
 # allows certificates to be proactively re-generated in the "buffer" period
 # prior to their exact expiration time.
@@ -91,6 +100,56 @@ class OpenSSL(object):
         return stdout
 
 
+class DirectoryLock(object):
+    def __init__(self, path):
+        """Context manager holding an exclusive lock on a file, so that
+        processes sharing a certificate directory don't generate or
+        record certificates at the same time. The lock is re-entrant
+        within one instance.
+
+        :param path: path of the lock file, which is created if needed"""
+        self.path = path
+        self.depth = 0
+        self.f = None
+
+    def __enter__(self):
+        if self.depth == 0:
+            self.f = open(self.path, "a+")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+                else:
+                    self._lock_windows()
+            except Exception:
+                self.f.close()
+                self.f = None
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.depth -= 1
+        if self.depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+            else:
+                self.f.seek(0)
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+            self.f.close()
+            self.f = None
+
+    def _lock_windows(self):
+        # LK_LOCK only retries for about 10 seconds before failing, and
+        # generating certificates can take longer than that
+        while True:
+            self.f.seek(0)
+            try:
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+            except IOError:
+                continue
+            return
+
+
 def make_subject(common_name,
                  country=None,
                  state=None,
@@ -113,6 +172,19 @@ def make_subject(common_name,
 
     return "".join(rv)
 
+def hosts_digest(hosts):
+    """Get a digest identifying a set of hosts, independent of their order"""
+    data = "\n".join(sorted(hosts))
+    if not isinstance(data, bytes):
+        data = data.encode("utf8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
 def make_alt_names(hosts):
     rv = []
     for name in hosts:
@@ -230,7 +302,11 @@ class OpenSSLEnvironment(object):
 
         By default this will look in base_path for existing certificates that are still
         valid and only create new certificates if there aren't any. This behaviour can
-        be adjusted using the force_regenerate option.
+        be adjusted using the force_regenerate option. Generated certificates are
+        recorded in an index file in base_path, keyed by the set of hosts they cover,
+        along with their expiry time, so that they can be reused by later runs without
+        invoking openssl. base_path may be shared by concurrent runs; a lock file in it
+        is held while certificates are looked up, generated and recorded.
 
         :param logger: a stdlib logging compatible logger or mozlog structured logger
         :param openssl_binary: Path to the OpenSSL binary
@@ -259,20 +335,31 @@ class OpenSSLEnvironment(object):
         self._ca_cert_path = None
         self._ca_key_path = None
         self.host_certificates = {}
+        self._cache_index = None
+        self._lock = None
 
     def __enter__(self):
-        if not os.path.exists(self.base_path):
-            os.makedirs(self.base_path)
+        try:
+            if not os.path.exists(self.base_path):
+                os.makedirs(self.base_path)
+        except OSError:
+            # Another process may have just created it
+            if not os.path.isdir(self.base_path):
+                raise
 
         path = functools.partial(os.path.join, self.base_path)
+        self._lock = DirectoryLock(path("cert_cache.lock"))
 
-        with open(path("index.txt"), "w"):
-            pass
-        with open(path("serial"), "w") as f:
-            serial = "%x" % random.randint(0, 1000000)
-            if len(serial) % 2:
-                serial = "0" + serial
-            f.write(serial)
+        # The CA database is rewritten here, so wait for any other process
+        # that's generating certificates in base_path to finish
+        with self._lock:
+            with open(path("index.txt"), "w"):
+                pass
+            with open(path("serial"), "w") as f:
+                serial = "%x" % random.randint(0, 1000000)
+                if len(serial) % 2:
+                    serial = "0" + serial
+                f.write(serial)
 
         self.path = path
 
@@ -290,41 +377,123 @@ class OpenSSLEnvironment(object):
     def ca_cert_path(self):
         """Get the path to the CA certificate file, generating a
         new one if needed"""
-        if self._ca_cert_path is None and not self.force_regenerate:
-            self._load_ca_cert()
         if self._ca_cert_path is None:
-            self._generate_ca()
+            with self._lock:
+                # Another process may have updated the index since it was read
+                self._cache_index = None
+                if not self.force_regenerate:
+                    self._load_ca_cert()
+                if self._ca_cert_path is None:
+                    self._generate_ca()
         return self._ca_cert_path
 
     def _load_ca_cert(self):
         key_path = self.path("cacert.key")
         cert_path = self.path("cacert.pem")
 
-        if self.check_key_cert(key_path, cert_path, None):
+        entry = self.cache_index.get("ca")
+        if entry is not None:
+            valid = self._check_cache_entry(entry, key_path, cert_path)
+        else:
+            valid = self.check_key_cert(key_path, cert_path, None)
+            if valid:
+                self._update_cache_index("ca", key_path, cert_path,
+                                         self._get_end_time(cert_path, None))
+
+        if valid:
             self.logger.info("Using existing CA cert")
             self._ca_key_path, self._ca_cert_path = key_path, cert_path
 
+    @property
+    def cache_index(self):
+        """Index of the certificates in base_path, loaded from disk on first use.
+
+        This is a dictionary with a "ca" key for the CA certificate and
+        "hosts" key containing a dictionary of host certificates keyed by
+        the digest of their hosts. Each entry records the key and certificate
+        file names, the time at which the certificate expires and, for host
+        certificates, the digest of the CA certificate used to sign it."""
+        if self._cache_index is None:
+            self._cache_index = {"ca": None, "hosts": {}}
+            try:
+                with open(self.path("cert_cache.json")) as f:
+                    data = json.load(f)
+            except (IOError, ValueError):
+                pass
+            else:
+                if isinstance(data, dict):
+                    self._cache_index.update(data)
+        return self._cache_index
+
+    def _update_cache_index(self, name, key_path, cert_path, end_time, hosts=None):
+        entry = {"key": os.path.basename(key_path),
+                 "cert": os.path.basename(cert_path),
+                 "end_time": end_time}
+        if name == "ca":
+            self.cache_index["ca"] = entry
+        else:
+            entry["hosts"] = list(hosts)
+            entry["ca_digest"] = file_digest(self._ca_cert_path)
+            self.cache_index["hosts"][name] = entry
+
+        index_path = self.path("cert_cache.json")
+        fd, tmp_path = tempfile.mkstemp(dir=self.base_path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.cache_index, f, indent=1, sort_keys=True)
+            if os.name == "nt" and os.path.exists(index_path):
+                # os.rename can't replace an existing file on Windows. This
+                # is only done with the lock held, which readers also hold.
+                os.unlink(index_path)
+            os.rename(tmp_path, index_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def _check_cache_entry(self, entry, key_path, cert_path, ca_digest=None):
+        """Check that a certificate in the cache index is present and unexpired,
+        without running openssl."""
+        if (entry.get("key") != os.path.basename(key_path) or
+            entry.get("cert") != os.path.basename(cert_path)):
+            return False
+        if not os.path.exists(key_path) or not os.path.exists(cert_path):
+            return False
+        time_buffer = timedelta(**CERT_EXPIRY_BUFFER)
+        if entry.get("end_time", 0) < time.time() + time_buffer.total_seconds():
+            return False
+        if ca_digest is not None and entry.get("ca_digest") != ca_digest:
+            return False
+        return True
+
     def check_key_cert(self, key_path, cert_path, hosts):
         """Check that a key and cert file exist and are valid"""
         if not os.path.exists(key_path) or not os.path.exists(cert_path):
             return False
 
+        end_date = self._get_end_date(cert_path, hosts)
+        time_buffer = timedelta(**CERT_EXPIRY_BUFFER)
+        # Because `strptime` does not account for time zone offsets, it is
+        # always in terms of UTC, so the current time should be calculated
+        # accordingly.
+        if end_date < datetime.utcnow() + time_buffer:
+            return False
+
+        #TODO: check the key actually signed the cert.
+        return True
+
+    def _get_end_date(self, cert_path, hosts):
         with self._config_openssl(hosts) as openssl:
             end_date_str = openssl("x509",
                                    "-noout",
                                    "-enddate",
                                    "-in", cert_path).split("=", 1)[1].strip()
-            # Not sure if this works in other locales
-            end_date = datetime.strptime(end_date_str, "%b %d %H:%M:%S %Y %Z")
-            time_buffer = timedelta(**CERT_EXPIRY_BUFFER)
-            # Because `strptime` does not account for time zone offsets, it is
-            # always in terms of UTC, so the current time should be calculated
-            # accordingly.
-            if end_date < datetime.utcnow() + time_buffer:
-                return False
+        # Not sure if this works in other locales
+        return datetime.strptime(end_date_str, "%b %d %H:%M:%S %Y %Z")
 
-        #TODO: check the key actually signed the cert.
-        return True
+    def _get_end_time(self, cert_path, hosts):
+        """Get the expiry time of a certificate as seconds since the epoch"""
+        end_date = self._get_end_date(cert_path, hosts)
+        return (end_date - datetime(1970, 1, 1)).total_seconds()
 
     def _generate_ca(self):
         path = self.path
@@ -357,6 +526,8 @@ class OpenSSLEnvironment(object):
         os.unlink(req_path)
 
         self._ca_key_path, self._ca_cert_path = key_path, cert_path
+        self._update_cache_index("ca", key_path, cert_path,
+                                 self._get_end_time(cert_path, None))
 
     def host_cert_path(self, hosts):
         """Get a tuple of (private key path, certificate path) for a host,
@@ -366,25 +537,47 @@ class OpenSSLEnvironment(object):
         the primary hostname first."""
         hosts = tuple(sorted(hosts, key=lambda x:len(x)))
         if hosts not in self.host_certificates:
-            if not self.force_regenerate:
-                key_cert = self._load_host_cert(hosts)
-            else:
-                key_cert = None
-            if key_cert is None:
-                key, cert = self._generate_host_cert(hosts)
-            else:
-                key, cert = key_cert
+            with self._lock:
+                self._cache_index = None
+                if not self.force_regenerate:
+                    key_cert = self._load_host_cert(hosts)
+                else:
+                    key_cert = None
+                if key_cert is None:
+                    key, cert = self._generate_host_cert(hosts)
+                else:
+                    key, cert = key_cert
             self.host_certificates[hosts] = key, cert
 
         return self.host_certificates[hosts]
 
-    def _load_host_cert(self, hosts):
+    def _host_cert_paths(self, hosts):
+        """Get the (key path, cert path) used to store the certificate for
+        hosts. The names include a digest of the full set of hosts, so
+        that certificates for different host sets don't overwrite each
+        other."""
         host = hosts[0]
-        key_path = self.path("%s.key" % host)
-        cert_path = self.path("%s.pem" % host)
+        digest = hosts_digest(hosts)
+        return (self.path("%s.%s.key" % (host, digest[:16])),
+                self.path("%s.%s.pem" % (host, digest[:16])))
+
+    def _load_host_cert(self, hosts):
+        key_path, cert_path = self._host_cert_paths(hosts)
 
-        # TODO: check that this cert was signed by the CA cert
-        if self.check_key_cert(key_path, cert_path, hosts):
+        entry = self.cache_index["hosts"].get(hosts_digest(hosts))
+        if entry is None:
+            return None
+
+        if self._ca_cert_path is None:
+            self._load_ca_cert()
+        if self._ca_cert_path is None:
+            return None
+
+        # The certificate must have been signed by the current CA, which is
+        # checked using the digest of the CA certificate recorded when the host
+        # certificate was generated
+        if self._check_cache_entry(entry, key_path, cert_path,
+                                   ca_digest=file_digest(self._ca_cert_path)):
             self.logger.info("Using existing host cert")
             return key_path, cert_path
 
@@ -399,8 +592,7 @@ class OpenSSLEnvironment(object):
         path = self.path
 
         req_path = path("wpt.req")
-        cert_path = path("%s.pem" % host)
-        key_path = path("%s.key" % host)
+        key_path, cert_path = self._host_cert_paths(hosts)
 
         self.logger.info("Generating new host cert")
 
@@ -422,4 +614,7 @@ class OpenSSLEnvironment(object):
 
         os.unlink(req_path)
 
+        self._update_cache_index(hosts_digest(hosts), key_path, cert_path,
+                                 self._get_end_time(cert_path, hosts), hosts=hosts)
+
         return key_path, cert_path